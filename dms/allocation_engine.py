@@ -1,8 +1,21 @@
+import time
+import uuid
 from datetime import date, datetime
-from typing import List, Dict, Tuple
+from typing import Callable, List, Dict, Tuple
 from database import db
-from models import Agent, Order, Assignment
+from models import Warehouse, Agent, Order, Assignment, AllocationRun
+from bson import ObjectId
 from utils import LocationUtils, AssignmentUtils
+from capacity_planner import capacity_planner
+from deferral_queue import DeferralQueue
+from warm_start import WarmStart, load_previous_routes
+from spatial_index import GridIndex
+from local_search import improve_routes
+from route_bounds import route_bounds
+from route_memo import route_memo
+from performance_stats import PerformanceStats
+from tiled_allocation import TiledAllocator
+from trips import vehicle_capacity
 from config import Config
 import logging
 
@@ -11,199 +24,602 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class OrderAllocationEngine:
-    def __init__(self):
-        self.today = date.today()
+    def __init__(self, today: date = None):
+        # Without a fixed date every run allocates for the day it starts on
+        self.fixed_today = today
+        self.today = today or date.today()
+        self.search_reports = []
+        self.run_id = None
+        self.owner = None
+        self.agent_warehouses = {}
+        self.agent_capacities = {}
     
-    def run_allocation(self) -> Dict:
-        """Main allocation method that runs the complete allocation process"""
-        logger.info(f"Starting order allocation for {self.today}")
+    def run_allocation(self, warm_start: bool = None, time_budget: float = None,
+                       warehouse_ids: List[str] = None, take_over: bool = False) -> Dict:
+        """Main allocation method that runs the complete allocation process.
+        
+        With warm_start, agents are seeded from the routes they were given the
+        previous day (defaults to Config.WARM_START_ENABLED).
+        
+        time_budget (seconds, defaults to Config.ALLOCATION_TIME_BUDGET, 0 for
+        no deadline) makes the run anytime: every warehouse first gets a fast
+        greedy plan, the time left is shared out to improve the routes, and
+        each warehouse commits the best routes found by then. Committed
+        warehouses are checkpointed, so calling again after an interrupted
+        run resumes it without redoing them.
+        
+        Runs may overlap (the scheduler and a manual trigger, or several
+        workers): a run is held under a lease, and agents and orders are
+        claimed with conditional updates, so nothing is assigned twice and
+        routes that lose orders to another run are re-planned.
+        
+        warehouse_ids limits the run to the agents of those warehouses (one
+        task of a distributed allocation); such a run is checkpointed and
+        resumed separately from other warehouse sets. take_over resumes the
+        set's unfinished run even while its lease is live, for a task retried
+        after its worker died: the dead run's unsaved order claims are
+        released and its agent claims carry over, instead of a new run
+        finding them taken.
+        """
+        if warm_start is None:
+            warm_start = Config.WARM_START_ENABLED
+        if time_budget is None:
+            time_budget = Config.ALLOCATION_TIME_BUDGET
+        started = time.monotonic()
+        deadline = started + time_budget if time_budget else None
+        self.today = self.fixed_today or date.today()
+        logger.info(f"Starting order allocation for {self.today}{' (warm start)' if warm_start else ''}"
+                    f"{f' with a {time_budget}s budget' if deadline else ''}")
+        self.search_reports = []
+        route_bounds.reset_stats()
+        route_memo.reset_stats()
         
         # Get all checked-in agents
         checked_in_agents = Agent.get_checked_in_agents()
+        scope = None
+        if warehouse_ids is not None:
+            warehouse_ids = set(warehouse_ids)
+            scope = ','.join(sorted(warehouse_ids))
+            checked_in_agents = [agent for agent in checked_in_agents if agent['warehouse_id'] in warehouse_ids]
+        self.agent_warehouses = {str(agent['_id']): agent['warehouse_id'] for agent in checked_in_agents}
+        self.agent_capacities = {str(agent['_id']): vehicle_capacity(agent) for agent in checked_in_agents}
         logger.info(f"Found {len(checked_in_agents)} checked-in agents")
         
         if not checked_in_agents:
             logger.warning("No agents checked in today")
             return {'status': 'failed', 'message': 'No agents checked in'}
         
+        self.owner = uuid.uuid4().hex
+        lease = Config.ALLOCATION_RUN_LEASE_SECONDS
+        run = AllocationRun.get_open(self.today, self.owner, lease, scope, take_over=take_over)
+        resumed = run is not None
+        if resumed:
+            logger.info(f"Resuming allocation run {run['_id']}, {len(run['warehouses'])} warehouses already committed")
+        else:
+            run = AllocationRun.start(self.today, time_budget, self.owner, lease, scope)
+        self.run_id = str(run['_id'])
+        
+        try:
+            result = self._allocate(run, resumed, checked_in_agents, warm_start, time_budget, started, deadline)
+        except Exception:
+            # Leave the run to be resumed by the next call
+            AllocationRun.release(run['_id'], self.owner)
+            raise
+        
+        result.update({
+            'summary': AssignmentUtils.generate_daily_summary(self.today.isoformat()),
+            'distance_cache': LocationUtils.distance_cache_stats(),
+            'road_network': LocationUtils.road_network_stats()
+        })
+        logger.info(f"Allocation completed in {result['runtime_seconds']}s. Assigned: {result['total_assigned']}, "
+                    f"Deferred: {result['total_deferred']}, distance cache: {result['distance_cache']}")
+        return result
+    
+    def _allocate(self, run: Dict, resumed: bool, checked_in_agents: List[Dict], warm_start: bool,
+                  time_budget: float, started: float, deadline: float) -> Dict:
+        """Plan, improve and commit every warehouse of a run held under its lease"""
+        if resumed:
+            # Orders claimed for assignments the interrupted run never saved go back to pending
+            Order.release_orphans(self.run_id, Assignment.ids_for_run(self.run_id))
+        
+        # Agents already holding an assignment today keep it
+        existing_assignments = Assignment.get_by_agents(
+            [str(agent['_id']) for agent in checked_in_agents], self.today
+        )
+        assigned_agents = {assignment['agent_id'] for assignment in existing_assignments}
+        available_agents = [agent for agent in checked_in_agents if str(agent['_id']) not in assigned_agents]
+        
         # Group agents by warehouse
-        warehouse_agents = {}
-        for agent in checked_in_agents:
-            warehouse_id = agent['warehouse_id']
-            if warehouse_id not in warehouse_agents:
-                warehouse_agents[warehouse_id] = []
-            warehouse_agents[warehouse_id].append(agent)
+        warehouse_agents = self.group_agents_by_warehouse(available_agents)
+        
+        warehouses = {}
+        for warehouse_id in warehouse_agents:
+            warehouse = Warehouse.get_by_id(warehouse_id)
+            if warehouse:
+                warehouses[warehouse_id] = warehouse
         
-        # Process each warehouse
+        previous_routes = load_previous_routes(available_agents, warehouses, self.today) if warm_start else {}
+        
+        # A resumed run also counts what was committed before the interruption,
+        # including a warehouse that was committed but not yet checkpointed
         total_assigned = 0
-        total_deferred = 0
+        total_warm_matched = 0
+        total_conflicts = 0
+        if resumed:
+            total_assigned = sum(len(assignment['order_ids']) for assignment in existing_assignments)
+            total_warm_matched = sum(assignment.get('warm_start_orders', 0) for assignment in existing_assignments)
+        idle_agents = {}
+        warehouse_deferred = {}
         
+        # Restore warehouses committed before an interruption
+        for warehouse_id, state in run['warehouses'].items():
+            idle_ids = set(state['idle_agent_ids'])
+            idle_agents[warehouse_id] = [agent for agent in warehouse_agents.get(warehouse_id, [])
+                                         if str(agent['_id']) in idle_ids]
+            warehouse_deferred[warehouse_id] = [order for order in Order.get_by_ids(state['deferred_ids'])
+                                                if order['status'] == 'pending']
+            if state.get('search'):
+                self.search_reports.append(state['search'])
+        
+        # Greedy plan for every remaining warehouse first, so each has a feasible solution
+        warehouse_plans = {}
         for warehouse_id, agents in warehouse_agents.items():
+            if warehouse_id in run['warehouses']:
+                continue
             logger.info(f"Processing warehouse {warehouse_id} with {len(agents)} agents")
             
+            warehouse = warehouses.get(warehouse_id)
+            if not warehouse:
+                logger.warning(f"Warehouse {warehouse_id} not found, skipping its agents")
+                continue
+            
+            # Very large warehouses are streamed tile by tile when they are committed
+            if Config.TILED_ALLOCATION_MIN_ORDERS:
+                pending_count = Order.count_pending(warehouse_id)
+                if pending_count >= Config.TILED_ALLOCATION_MIN_ORDERS:
+                    logger.info(f"Found {pending_count} pending orders for warehouse {warehouse_id}, "
+                                f"allocating it tile by tile")
+                    warehouse_plans[warehouse_id] = None
+                    continue
+            
             # Get pending orders for this warehouse
             pending_orders = Order.get_by_warehouse(warehouse_id)
             logger.info(f"Found {len(pending_orders)} pending orders for warehouse {warehouse_id}")
             
-            if not pending_orders:
-                continue
-            
-            # Allocate orders to agents
-            assigned_count, deferred_orders = self._allocate_orders_for_warehouse(
-                agents, pending_orders, warehouse_id
+            warehouse_plans[warehouse_id] = (
+                self.plan_warehouse(agents, pending_orders, warehouse, previous_routes)
+                if pending_orders else ([], [])
             )
+            self._extend_lease()
+        
+        # Improve each warehouse with its share of the time left, then commit it
+        for index, (warehouse_id, planned) in enumerate(warehouse_plans.items()):
+            search_budget = self._search_budget(deadline, len(warehouse_plans) - index)
+            reports_before = len(self.search_reports)
+            if planned is None:
+                assigned_count, committed, unavailable, deferred_orders, conflicts = TiledAllocator(
+                    self, warehouses[warehouse_id], warehouse_agents[warehouse_id], previous_routes, search_budget
+                ).run()
+            else:
+                plans, deferred_orders = planned
+                if len(plans) > 1 and (search_budget > 0 or Config.LOCAL_SEARCH_ITERATIONS):
+                    plans = self._improve_plans(warehouses[warehouse_id], plans, search_budget)
+                
+                assigned_count, committed, unavailable, deferred_orders, conflicts = self._commit_warehouse(
+                    warehouses[warehouse_id], warehouse_agents[warehouse_id], plans, deferred_orders
+                )
+            warm_matched = sum(assignment['warm_start_orders'] for assignment in committed)
+            total_assigned += assigned_count
+            total_warm_matched += warm_matched
+            total_conflicts += conflicts
+            
+            busy_agents = {assignment['agent_id'] for assignment in committed} | unavailable
+            idle_agents[warehouse_id] = [agent for agent in warehouse_agents[warehouse_id]
+                                         if str(agent['_id']) not in busy_agents]
+            warehouse_deferred[warehouse_id] = deferred_orders
             
+            self._extend_lease(warehouse_id, {
+                'assigned': assigned_count,
+                'warm_matched': warm_matched,
+                'idle_agent_ids': [str(agent['_id']) for agent in idle_agents[warehouse_id]],
+                'deferred_ids': [str(order['_id']) for order in deferred_orders],
+                'search': self.search_reports[-1] if len(self.search_reports) > reports_before else None
+            })
+        
+        # Offer what overloaded warehouses could not serve to idle agents nearby
+        total_rebalanced = 0
+        if Config.REBALANCE_ENABLED:
+            assignments, rehomed, warehouse_deferred = self.rebalance(
+                warehouses, idle_agents, warehouse_deferred,
+                self._search_budget(deadline, max(len(idle_agents), 1))
+            )
+            for warehouse_id, order_ids in rehomed.items():
+                Order.rehome(order_ids, warehouse_id)
+                total_rebalanced += len(order_ids)
+            assigned_count, _, conflicts = self._commit_assignments(assignments)
             total_assigned += assigned_count
-            total_deferred += len(deferred_orders)
+            total_conflicts += len(conflicts)
             
-            # Mark deferred orders
+            # Re-homed orders another run got to first stay deferred at their new warehouse
+            agent_warehouses = {str(agent['_id']): warehouse_id
+                                for warehouse_id, agents in idle_agents.items() for agent in agents}
+            for conflict in conflicts:
+                warehouse_deferred.setdefault(agent_warehouses[conflict['agent_id']], []).extend(
+                    self._still_pending(conflict['released_order_ids']))
+        
+        # Mark deferred orders
+        total_deferred = 0
+        for warehouse_id, deferred_orders in warehouse_deferred.items():
             if deferred_orders:
                 deferred_ids = [str(order['_id']) for order in deferred_orders]
-                Order.defer_orders(deferred_ids)
+                # Only orders still pending move; a re-run or retry must not count the others again
+                moved = Order.defer_orders(deferred_ids).modified_count
+                if moved:
+                    self._record_stats(PerformanceStats.record_deferrals, warehouse_id, self.today, moved)
+                total_deferred += len(deferred_orders)
                 logger.info(f"Deferred {len(deferred_orders)} orders for warehouse {warehouse_id}")
         
-        # Generate summary
-        summary = AssignmentUtils.generate_daily_summary(self.today.isoformat())
-        
-        logger.info(f"Allocation completed. Assigned: {total_assigned}, Deferred: {total_deferred}")
-        
-        return {
+        result = {
             'status': 'success',
             'date': self.today.isoformat(),
+            'run_id': self.run_id,
+            'scope': run.get('scope'),
+            'resumed': resumed,
+            'time_budget': time_budget,
+            'runtime_seconds': round(time.monotonic() - started, 3),
             'total_assigned': total_assigned,
             'total_deferred': total_deferred,
-            'summary': summary
+            'total_rebalanced': total_rebalanced,
+            'commit_conflicts': total_conflicts,
+            'local_search': self.search_summary(),
+            'route_bounds': route_bounds.stats(),
+            'route_memo': route_memo.stats(),
+            'warm_start': warm_start,
+            'warm_start_matched': total_warm_matched
         }
+        AllocationRun.complete(run['_id'], result)
+        return result
     
-    def _allocate_orders_for_warehouse(self, agents: List[Dict], 
-                                      orders: List[Dict], 
-                                      warehouse_id: str) -> Tuple[int, List[Dict]]:
-        """Allocate orders for a specific warehouse"""
-        unassigned_orders = orders.copy()
-        assigned_count = 0
+    def _extend_lease(self, warehouse_id: str = None, state: Dict = None):
+        """Checkpoint a committed warehouse (or just renew the lease); stop if another caller took the run"""
+        if not AllocationRun.checkpoint(ObjectId(self.run_id), self.owner, Config.ALLOCATION_RUN_LEASE_SECONDS,
+                                        warehouse_id, state):
+            raise RuntimeError(f"Lease on allocation run {self.run_id} was lost")
+    
+    @staticmethod
+    def _search_budget(deadline: float, warehouses_left: int) -> float:
+        """Seconds of route improvement for the next warehouse"""
+        if deadline is None:
+            return Config.LOCAL_SEARCH_TIME_BUDGET
+        return max(deadline - time.monotonic(), 0) / warehouses_left
+    
+    @staticmethod
+    def group_agents_by_warehouse(agents: List[Dict]) -> Dict[str, List[Dict]]:
+        """Group agents by their warehouse_id"""
+        warehouse_agents = {}
+        for agent in agents:
+            warehouse_id = agent['warehouse_id']
+            if warehouse_id not in warehouse_agents:
+                warehouse_agents[warehouse_id] = []
+            warehouse_agents[warehouse_id].append(agent)
+        return warehouse_agents
+    
+    def solve_warehouse(self, agents: List[Dict], orders: List[Dict], warehouse: Dict,
+                        previous_routes: Dict = None, search_budget: float = None) -> Tuple[List[Dict], List[Dict]]:
+        """Build assignment documents for one warehouse without writing anything"""
+        plans, deferred_orders = self.plan_and_improve(agents, orders, warehouse, previous_routes, search_budget)
+        return [self._build_assignment(*plan) for plan in plans], deferred_orders
+    
+    def plan_and_improve(self, agents: List[Dict], orders: List[Dict], warehouse: Dict,
+                         previous_routes: Dict = None, search_budget: float = None) -> Tuple[List[Tuple], List[Dict]]:
+        """Greedy plans for the agents, improved by the inter-route search, and the orders left over"""
+        plans, deferred_orders = self.plan_warehouse(agents, orders, warehouse, previous_routes)
+        
+        # Let routes trade stops now that every agent has one
+        if search_budget is None:
+            search_budget = Config.LOCAL_SEARCH_TIME_BUDGET
+        if len(plans) > 1 and (search_budget > 0 or Config.LOCAL_SEARCH_ITERATIONS):
+            plans = self._improve_plans(warehouse, plans, search_budget)
+        
+        return plans, deferred_orders
+    
+    def plan_warehouse(self, agents: List[Dict], orders: List[Dict], warehouse: Dict,
+                       previous_routes: Dict = None) -> Tuple[List[Tuple], List[Dict]]:
+        """Greedy plans (agent_id, orders, metrics, warm-start matches) and the orders left over"""
+        queue = DeferralQueue(orders, warehouse, self.today)
+        plans = []  # (agent_id, orders, metrics, warm-start matches)
         
         # Sort agents by name for fair distribution
         agents.sort(key=lambda x: x['name'])
+        self.agent_capacities.update((str(agent['_id']), vehicle_capacity(agent)) for agent in agents)
+        
+        # Fix every agent's order count up front from the tier-aware plan
+        targets = capacity_planner.plan_order_counts(warehouse, agents, queue.ordered())
+        
+        # Agents with a route yesterday start from their old territory
+        seeded = {}
+        if previous_routes:
+            seeded = WarmStart(previous_routes).seed(agents, queue, warehouse, targets)
         
         for agent in agents:
-            if not unassigned_orders:
-                break
-            
-            # Find optimal order set for this agent
-            optimal_orders = self._find_optimal_order_set(
-                agent, unassigned_orders, warehouse_id
-            )
+            agent_id = str(agent['_id'])
+            if agent_id in seeded:
+                plans.append((agent_id, *seeded[agent_id]))
+                continue
             
-            if optimal_orders:
-                # Create assignment
-                assignment_data = {
-                    'agent_id': str(agent['_id']),
-                    'order_ids': [str(order['_id']) for order in optimal_orders],
-                    'assignment_date': self.today.isoformat(),
-                    'total_distance': 0,  # Will be calculated below
-                    'total_time': 0,
-                    'earning_per_order': 0,
-                    'total_earning': 0,
-                    'created_at': datetime.utcnow()
-                }
-                
-                # Calculate actual route and metrics
-                can_accept, metrics = AssignmentUtils.can_agent_accept_orders(
-                    str(agent['_id']), optimal_orders
-                )
-                
-                if can_accept:
-                    assignment_data.update({
-                        'total_distance': metrics['total_distance'],
-                        'total_time': metrics['total_time'],
-                        'earning_per_order': metrics['earning_per_order'],
-                        'total_earning': metrics['total_earning']
-                    })
-                    
-                    # Save assignment
-                    Assignment.create(assignment_data)
-                    
-                    # Mark orders as assigned
-                    for order in optimal_orders:
-                        Order.assign_to_agent(str(order['_id']), str(agent['_id']))
-                        unassigned_orders.remove(order)
-                        assigned_count += 1
-                    
-                    logger.info(f"Assigned {len(optimal_orders)} orders to agent {agent['name']}")
-        
-        return assigned_count, unassigned_orders
-    
-    def _find_optimal_order_set(self, agent: Dict, 
-                               available_orders: List[Dict], 
-                               warehouse_id: str) -> List[Dict]:
-        """Find the optimal set of orders for an agent using greedy approach"""
-        best_orders = []
-        best_score = -1
-        
-        # Try different order counts to find optimal allocation
-        max_orders_to_try = min(len(available_orders), 60)  # Max 60 orders per agent
-        
-        for target_orders in range(30, 4, -1):  # Try 30, 29, 28, ..., 5 orders
-            if target_orders > len(available_orders):
+            if not queue:
                 continue
             
-            # Select closest orders to warehouse (simple heuristic)
-            warehouse = db.warehouses.find_one({'_id': warehouse_id})
-            if not warehouse:
+            target_orders = targets.get(agent_id, 0)
+            if not target_orders:
                 continue
             
-            warehouse_coords = (warehouse['latitude'], warehouse['longitude'])
+            # Route the planned order set, shrinking it only if it is infeasible
+            candidate_orders = queue.pop(target_orders)
+            optimal_orders, metrics = self._find_optimal_order_set(
+                agent, candidate_orders, warehouse, target_orders
+            )
+            used = {str(order['_id']) for order in optimal_orders}
+            queue.push([order for order in candidate_orders if str(order['_id']) not in used])
             
-            # Sort orders by distance from warehouse
-            orders_with_distance = []
-            for order in available_orders:
-                order_coords = (order['latitude'], order['longitude'])
-                distance = LocationUtils.calculate_distance(
-                    warehouse_coords[0], warehouse_coords[1],
-                    order_coords[0], order_coords[1]
-                )
-                orders_with_distance.append((order, distance))
+            if optimal_orders:
+                plans.append((agent_id, optimal_orders, metrics, 0))
+                logger.info(f"Planned {len(optimal_orders)} orders for agent {agent['name']}")
+        
+        return plans, queue.drain()
+    
+    def _improve_plans(self, warehouse: Dict, plans: List[Tuple], time_budget: float) -> List[Tuple]:
+        """Run the inter-route search and keep its result only if it is shorter"""
+        routes, metrics, report = improve_routes(
+            warehouse, [self._in_visiting_order(orders, metrics) for _, orders, metrics, _ in plans], time_budget,
+            [self.agent_capacities.get(agent_id) for agent_id, _, _, _ in plans]
+        )
+        distance_before = sum(plan[2]['total_distance'] for plan in plans)
+        distance_after = sum(m['total_distance'] for m in metrics) if metrics else distance_before
+        
+        report['warehouse_id'] = str(warehouse['_id'])
+        report['applied'] = distance_after < distance_before
+        report['distance_saved'] = round(distance_before - distance_after, 2) if report['applied'] else 0
+        self.search_reports.append(report)
+        logger.info(f"Local search for warehouse {warehouse['_id']}: {report['moves']}, "
+                    f"{report['distance_saved']} km saved in {report['seconds']}s")
+        
+        if not report['applied']:
+            return plans
+        return [(agent_id, route_orders, route_metrics, min(warm_matched, len(route_orders)))
+                for (agent_id, _, _, warm_matched), route_orders, route_metrics in zip(plans, routes, metrics)]
+    
+    @staticmethod
+    def _in_visiting_order(orders: List[Dict], metrics: Dict) -> List[Dict]:
+        """A plan's orders in its route's visiting order, when the route recorded it"""
+        if not metrics.get('sequence'):
+            return orders
+        by_id = {str(order['_id']): order for order in orders}
+        return [by_id[order_id] for order_id in metrics['sequence']]
+    
+    def search_summary(self) -> Dict:
+        """Improvement from the inter-route search across this run's warehouses"""
+        moves = {}
+        for report in self.search_reports:
+            for move, count in report['moves'].items():
+                moves[move] = moves.get(move, 0) + count
+        return {
+            'warehouses': len(self.search_reports),
+            'moves': moves,
+            'distance_saved': round(sum(report['distance_saved'] for report in self.search_reports), 2),
+            'seconds': round(sum(report['seconds'] for report in self.search_reports), 3)
+        }
+    
+    def rebalance(self, warehouses: Dict[str, Dict], idle_agents: Dict[str, List[Dict]],
+                  deferred: Dict[str, List[Dict]],
+                  search_budget: float = None) -> Tuple[List[Dict], Dict[str, List[str]], Dict[str, List[Dict]]]:
+        """Route deferred orders through idle agents at nearby warehouses.
+        
+        Warehouses with spare agents take deferred orders from other warehouses
+        within REBALANCE_RADIUS_KM (the orders themselves must be within the
+        same radius of the new warehouse) and solve them like their own, so
+        the usual route limits apply. Returns the planned assignments, the
+        order ids re-homed to each warehouse and the orders still deferred
+        per warehouse. Nothing is written.
+        """
+        remaining = {warehouse_id: list(orders) for warehouse_id, orders in deferred.items()}
+        radius = Config.REBALANCE_RADIUS_KM
+        donors = GridIndex.build([
+            (warehouses[warehouse_id]['latitude'], warehouses[warehouse_id]['longitude'], warehouse_id)
+            for warehouse_id, orders in remaining.items() if orders and warehouse_id in warehouses
+        ], cell_km=radius)
+        
+        assignments = []
+        rehomed = {}
+        if not len(donors):
+            return assignments, rehomed, remaining
+        
+        # Warehouses with the most idle agents pick first
+        spare = sorted(((warehouse_id, agents) for warehouse_id, agents in idle_agents.items()
+                        if agents and warehouse_id in warehouses), key=lambda item: -len(item[1]))
+        for warehouse_id, agents in spare:
+            warehouse = warehouses[warehouse_id]
+            latitude, longitude = warehouse['latitude'], warehouse['longitude']
+            nearby = [donor_id for _, donor_id in donors.within(latitude, longitude, radius)
+                      if donor_id != warehouse_id and remaining.get(donor_id)]
+            candidates = [order for donor_id in nearby for order in remaining[donor_id]
+                          if GridIndex.distance_km(latitude, longitude,
+                                                   order['latitude'], order['longitude']) <= radius]
+            if not candidates:
+                continue
             
-            orders_with_distance.sort(key=lambda x: x[1])
+            planned, _ = self.solve_warehouse(list(agents), candidates, warehouse, search_budget=search_budget)
+            taken = {order_id for assignment in planned for order_id in assignment['order_ids']}
+            if not taken:
+                continue
             
-            # Take the closest target_orders
-            candidate_orders = [item[0] for item in orders_with_distance[:target_orders]]
+            for donor_id in nearby:
+                remaining[donor_id] = [order for order in remaining[donor_id] if str(order['_id']) not in taken]
+            assignments.extend(planned)
+            rehomed.setdefault(warehouse_id, []).extend(taken)
+            logger.info(f"Rebalanced {len(taken)} deferred orders from {', '.join(nearby)} "
+                        f"to {len(planned)} idle agents at warehouse {warehouse_id}")
+        
+        return assignments, rehomed, remaining
+    
+    def _build_assignment(self, agent_id: str, orders: List[Dict], metrics: Dict,
+                          warm_start_orders: int = 0) -> Dict:
+        """Assignment document for a planned route, with its stops in visiting order"""
+        return {
+            'agent_id': agent_id,
+            'assignment_date': self.today.isoformat(),
+            'total_distance': metrics['total_distance'],
+            'total_time': metrics['total_time'],
+            'earning_per_order': metrics['earning_per_order'],
+            'total_earning': metrics['total_earning'],
+            'warm_start_orders': warm_start_orders,
+            **AssignmentUtils.route_fields(orders, metrics),
+            'created_at': datetime.utcnow()
+        }
+    
+    def _commit_warehouse(self, warehouse: Dict, agents: List[Dict], plans: List[Tuple],
+                          deferred_orders: List[Dict],
+                          reload_orders: Callable[[], List[Dict]] = None) -> Tuple[int, List[Dict], set, List[Dict], int]:
+        """Commit a warehouse's plans, re-planning around orders a concurrent run took.
+        
+        Agents whose route lost orders are re-planned on the warehouse's orders
+        that are still pending (or those reload_orders returns), up to
+        COMMIT_MAX_RETRIES times. Returns the orders assigned, the saved
+        assignments, the agents held by another run, the orders left to defer
+        and the number of conflicts.
+        """
+        assigned_count, committed, conflicts = self._commit_assignments(
+            [self._build_assignment(*plan) for plan in plans]
+        )
+        unavailable = {conflict['agent_id'] for conflict in conflicts if conflict['agent_taken']}
+        total_conflicts = len(conflicts)
+        
+        for attempt in range(Config.COMMIT_MAX_RETRIES):
+            retry_ids = {conflict['agent_id'] for conflict in conflicts if not conflict['agent_taken']}
+            if not retry_ids:
+                break
+            logger.info(f"Re-planning {len(retry_ids)} agents at warehouse {warehouse['_id']} "
+                        f"after commit conflicts (attempt {attempt + 1})")
+            pending_orders = reload_orders() if reload_orders else Order.get_by_warehouse(str(warehouse['_id']))
+            retry_agents = [agent for agent in agents if str(agent['_id']) in retry_ids]
+            plans, deferred_orders = (self.plan_warehouse(retry_agents, pending_orders, warehouse)
+                                      if pending_orders else ([], []))
+            count, saved, conflicts = self._commit_assignments([self._build_assignment(*plan) for plan in plans])
+            assigned_count += count
+            committed += saved
+            unavailable |= {conflict['agent_id'] for conflict in conflicts if conflict['agent_taken']}
+            total_conflicts += len(conflicts)
+        
+        # Orders released by conflicts that were not re-planned wait with the deferred ones
+        released = [order_id for conflict in conflicts for order_id in conflict['released_order_ids']]
+        if released:
+            deferred_orders = deferred_orders + self._still_pending(released)
+        return assigned_count, committed, unavailable, deferred_orders, total_conflicts
+    
+    @staticmethod
+    def _still_pending(order_ids: List[str]) -> List[Dict]:
+        return [order for order in Order.get_by_ids(order_ids) if order['status'] == 'pending'] if order_ids else []
+    
+    def _commit_assignments(self, assignments: List[Dict]) -> Tuple[int, List[Dict], List[Dict]]:
+        """Save assignments whose agent and orders can still be claimed.
+        
+        Each agent is claimed for this run, then its orders with a conditional
+        update that only takes orders still pending, so a concurrent run can
+        never assign the same order or agent twice. The assignment is saved
+        under the id its orders were claimed with only when every order was
+        claimed; otherwise the claim is rolled back and reported as a conflict
+        ({'agent_id', 'agent_taken', 'released_order_ids'}). Returns the
+        orders assigned, the saved assignments and the conflicts.
+        """
+        assigned_count = 0
+        committed = []
+        conflicts = []
+        for assignment_data in assignments:
+            agent_id = assignment_data['agent_id']
+            if not Agent.claim(agent_id, self.today, self.run_id):
+                logger.warning(f"Agent {agent_id} was allocated by another run, dropping their route")
+                conflicts.append({'agent_id': agent_id, 'agent_taken': True, 'released_order_ids': []})
+                continue
             
-            # Check if agent can handle these orders
-            can_accept, metrics = AssignmentUtils.can_agent_accept_orders(
-                str(agent['_id']), candidate_orders
-            )
+            assignment_id = ObjectId()
+            claimed = Order.claim(assignment_data['order_ids'], agent_id, assignment_id, self.run_id)
+            if len(claimed) < len(assignment_data['order_ids']):
+                Order.release_claim(assignment_id)
+                Agent.release_claim(agent_id, self.run_id)
+                logger.warning(f"{len(assignment_data['order_ids']) - len(claimed)} orders planned for agent "
+                               f"{agent_id} were taken by another run")
+                conflicts.append({'agent_id': agent_id, 'agent_taken': False, 'released_order_ids': sorted(claimed)})
+                continue
             
-            if can_accept:
-                # Calculate score (prioritize higher earnings and better utilization)
-                score = self._calculate_allocation_score(metrics)
-                
-                if score > best_score:
-                    best_score = score
-                    best_orders = candidate_orders
+            assignment_data['_id'] = assignment_id
+            assignment_data['run_id'] = self.run_id
+            assignment_data['warehouse_id'] = self.agent_warehouses.get(agent_id)
+            Assignment.create(assignment_data)
+            self._record_stats(PerformanceStats.record_assignment, assignment_data, assignment_data['warehouse_id'])
+            assigned_count += len(claimed)
+            committed.append(assignment_data)
+            logger.info(f"Assigned {len(claimed)} orders to agent {agent_id}")
         
-        return best_orders
+        return assigned_count, committed, conflicts
+    
+    def _record_stats(self, record, *args):
+        # Rollups are rebuilt at checkout, so a failed update must not fail the commit
+        try:
+            record(*args)
+        except Exception as e:
+            logger.error(f"Error updating performance rollups: {str(e)}")
     
-    def _calculate_allocation_score(self, metrics: Dict) -> float:
-        """Calculate score for an allocation based on multiple factors"""
-        # Prioritize higher earnings
-        earning_score = metrics['total_earning'] / 100  # Normalize
+    def _find_optimal_order_set(self, agent: Dict,
+                               available_orders: List[Dict],
+                               warehouse: Dict,
+                               target_orders: int) -> Tuple[List[Dict], Dict]:
+        """Take the first target_orders candidates, dropping the last until the route fits.
         
-        # Prioritize higher order count (better utilization)
-        order_score = metrics['total_orders'] / 50  # Normalize to max 50 orders
+        Orders whose delivery window the route cannot meet are skipped
+        instead, so the next candidates take their place.
         
-        # Prioritize agents hitting payment tiers
-        tier_bonus = 0
-        if metrics['total_orders'] >= Config.TIER_2_ORDERS:
-            tier_bonus = 10
-        elif metrics['total_orders'] >= Config.TIER_1_ORDERS:
-            tier_bonus = 5
+        Each prefix is screened by the route bounds on a block of one
+        distance matrix, which routing then reuses. Prefixes the bounds rule
+        out are never routed; one they prove feasible is routed once, as the
+        chosen set, and only its reloads or delivery windows can still
+        reject it.
+        """
+        target_orders = min(target_orders, len(available_orders))
+        order_count = target_orders
+        warehouse_coords = (warehouse['latitude'], warehouse['longitude'])
+        matrix = None
         
-        # Penalize excessive distance (efficiency)
-        distance_penalty = metrics['total_distance'] / Config.MAX_TRAVEL_DISTANCE_PER_DAY
+        while order_count >= Config.MIN_ORDERS_PER_AGENT:
+            candidate_orders = available_orders[:order_count]
+            delivery_coords = [(order['latitude'], order['longitude']) for order in candidate_orders]
+            if matrix is None:
+                # Every prefix of these candidates is a top-left block of their matrix
+                matrix = LocationUtils.distance_matrix([warehouse_coords] + delivery_coords)
+            candidate_matrix = matrix[:order_count + 1, :order_count + 1]
+            
+            if AssignmentUtils.prefilter(warehouse_coords, delivery_coords, candidate_matrix) is False:
+                order_count -= 1
+                continue
+            
+            can_accept, metrics = AssignmentUtils.check_route_constraints(
+                warehouse, candidate_orders, capacity=vehicle_capacity(agent), matrix=candidate_matrix
+            )
+            if can_accept:
+                if order_count < target_orders:
+                    logger.info(f"Agent {agent['name']} planned {target_orders} orders, "
+                                f"route fits {order_count}")
+                return candidate_orders, metrics
+            
+            if metrics.get('unreachable'):
+                unreachable = set(metrics['unreachable'])
+                available_orders = [order for position, order in enumerate(available_orders)
+                                    if position not in unreachable]
+                order_count = min(order_count, len(available_orders))
+                matrix = None
+            else:
+                order_count -= 1
         
-        total_score = earning_score + order_score + tier_bonus - distance_penalty
-        return total_score
+        return [], {}
 
 # Global instance
 allocation_engine = OrderAllocationEngine()
@@ -1,48 +1,48 @@
-from flask import Flask, jsonify, request, render_template
+from flask import Blueprint, Flask, jsonify, request, render_template
 from flask_cors import CORS
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 from models import Warehouse, Agent, Order, Assignment
-from allocation_engine import allocation_engine
 from scheduler import scheduler
-from seed_data import SeedDataGenerator
-from utils import AssignmentUtils
+from route_encoding import decode_polyline, delta_encode
 from database import db
+from config import Config
 from bson import ObjectId
+import serialization
+import io
 import logging
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-CORS(app)
+bp = Blueprint('dms', __name__)
 
-@app.route('/')
+@bp.route('/')
 def home():
     """Home dashboard page"""
     return render_template('dashboard.html')
 
-@app.route('/dashboard')
+@bp.route('/dashboard')
 def dashboard():
     """Dashboard page (alternative route)"""
     return render_template('dashboard.html')
 
-@app.route('/agents')
+@bp.route('/agents')
 def agents_page():
     """Agents management page"""
     return render_template('agents.html')
 
-@app.route('/orders')
+@bp.route('/orders')
 def orders_page():
     """Orders management page"""
     return render_template('orders.html')
 
-@app.route('/warehouses')
+@bp.route('/warehouses')
 def warehouses_page():
     """Warehouses management page"""
     return render_template('warehouses.html')
 
-@app.route('/api')
+@bp.route('/api')
 def api_info():
     """API information endpoint"""
     return jsonify({
@@ -55,57 +55,74 @@ def api_info():
             'GET /agents': 'List all agents',
             'GET /orders': 'List all orders',
             'POST /seed-data': 'Generate seed data',
+            'POST /api/orders/bulk': 'Bulk-load orders from NDJSON or CSV',
             'POST /check-in/<agent_id>': 'Check in agent',
-            'POST /run-allocation': 'Run order allocation manually',
+            'POST /run-allocation': 'Run order allocation manually (?distributed=1 queues it for workers)',
+            'GET /api/allocation-batches/<batch_id>': 'Progress of a distributed allocation',
+            'POST /rehome-orders': 'Move pending orders to their nearest warehouse',
+            'POST /run-archival': 'Archive finished days now',
+            'GET /api/archive/assignments': 'Archived assignments (?from=&to=&agent_id=&orders=1)',
+            'GET /api/archive/orders/<order_id>': 'An archived order',
+            'POST /api/simulate': 'Dry-run allocation with config overrides or a sweep',
             'GET /assignments/<date>': 'Get assignments for date',
+            'GET /api/routes/<date>': 'Encoded routes for date (?format=polyline|delta)',
             'GET /summary/<date>': 'Get daily summary',
+            'GET /api/stats/agents/<agent_id>': 'Agent performance by day (?from=&to=)',
+            'GET /api/stats/warehouses': 'Performance per warehouse over a range (?from=&to=)',
+            'GET /api/stats/warehouses/<warehouse_id>': 'Warehouse performance by day (?from=&to=)',
             'GET /health': 'Health check'
         }
     })
 
-@app.route('/api/warehouses')
+@bp.route('/api/warehouses')
 def get_warehouses():
     """Get all warehouses (API endpoint)"""
     try:
-        warehouses = Warehouse.get_all()
-        # Convert ObjectId to string
-        for warehouse in warehouses:
-            warehouse['_id'] = str(warehouse['_id'])
-        return jsonify({'warehouses': warehouses})
+        return jsonify({'warehouses': Warehouse.get_all()})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/agents')
+@bp.route('/api/agents')
 def get_agents():
     """Get all agents (API endpoint)"""
     try:
-        agents = Agent.get_all()
-        # Convert ObjectId to string
-        for agent in agents:
-            agent['_id'] = str(agent['_id'])
-            agent['warehouse_id'] = str(agent['warehouse_id'])
-        return jsonify({'agents': agents})
+        return jsonify({'agents': Agent.get_all()})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/orders')
+@bp.route('/api/orders')
 def get_orders():
     """Get all orders (API endpoint)"""
     try:
-        orders = Order.get_pending_orders()
-        # Convert ObjectId to string
-        for order in orders:
-            order['_id'] = str(order['_id'])
-            order['warehouse_id'] = str(order['warehouse_id'])
-            if order.get('assigned_agent_id'):
-                order['assigned_agent_id'] = str(order['assigned_agent_id'])
-        return jsonify({'orders': orders})
+        return jsonify({'orders': Order.get_pending_orders()})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/seed-data', methods=['POST'])
+@bp.route('/api/orders/bulk', methods=['POST'])
+def bulk_ingest_orders():
+    """Stream orders in as NDJSON or CSV (API endpoint).
+    
+    The format comes from ?format= or the Content-Type. The body is read row
+    by row and inserted in chunks; rejected rows are returned with their line.
+    """
+    from order_ingest import OrderIngestor, detect_format
+    try:
+        fmt = request.args.get('format') or detect_format(content_type=request.content_type)
+        if fmt is None:
+            return jsonify({'error': 'Send Content-Type application/x-ndjson or text/csv, or ?format='}), 415
+        
+        stream = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+        result = OrderIngestor(chunk_size=request.args.get('chunk_size', type=int)).ingest(stream, fmt)
+        return jsonify(result), 200 if not result['rejected'] else 207
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/seed-data', methods=['POST'])
 def generate_seed_data():
     """Generate seed data for testing"""
+    from seed_data import SeedDataGenerator
     try:
         generator = SeedDataGenerator()
         summary = generator.generate_complete_dataset()
@@ -116,7 +133,7 @@ def generate_seed_data():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/check-in/<agent_id>', methods=['POST'])
+@bp.route('/check-in/<agent_id>', methods=['POST'])
 def check_in_agent(agent_id):
     """Check in an agent"""
     try:
@@ -128,69 +145,274 @@ def check_in_agent(agent_id):
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/run-allocation', methods=['POST'])
+@bp.route('/run-allocation', methods=['POST'])
 def run_allocation():
-    """Manually trigger order allocation"""
+    """Manually trigger order allocation.
+    
+    ?warm_start=1 seeds from yesterday's routes; ?time_budget=<seconds> sets a deadline.
+    ?distributed=1 (the default with DISTRIBUTED_ALLOCATION) queues warehouse tasks for
+    the worker processes and returns the batch at once.
+    """
+    from allocation_engine import OrderAllocationEngine
+    from distributed_allocation import AllocationCoordinator
     try:
-        result = allocation_engine.run_allocation()
+        warm_start = request.args.get('warm_start')
+        if warm_start is not None:
+            warm_start = warm_start.lower() in ('1', 'true', 'yes')
+        time_budget = request.args.get('time_budget', type=float)
+        distributed = request.args.get('distributed')
+        distributed = (Config.DISTRIBUTED_ALLOCATION if distributed is None
+                       else distributed.lower() in ('1', 'true', 'yes'))
+        if distributed:
+            batch = AllocationCoordinator().enqueue(warm_start=warm_start, time_budget=time_budget)
+            return jsonify(batch), 202
+        # A fresh engine per request, so concurrent runs never share run state
+        result = OrderAllocationEngine().run_allocation(warm_start=warm_start, time_budget=time_budget)
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/assignments/<date_str>')
+@bp.route('/api/allocation-batches/<batch_id>')
+def get_allocation_batch(batch_id):
+    """Progress and totals of a distributed allocation batch"""
+    from distributed_allocation import AllocationCoordinator
+    try:
+        status = AllocationCoordinator().status(batch_id)
+        if not status['tasks']:
+            return jsonify({'error': 'Batch not found'}), 404
+        return jsonify(status)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/rehome-orders', methods=['POST'])
+def rehome_orders():
+    """Move pending orders to their nearest warehouse"""
+    from warehouse_index import warehouse_index
+    try:
+        return jsonify(warehouse_index.rehome_pending_orders())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/run-archival', methods=['POST'])
+def run_archival():
+    """Archive finished days now (?before=YYYY-MM-DD, default keeps ARCHIVE_RETAIN_DAYS)"""
+    from archival import OrderArchive
+    try:
+        before = request.args.get('before')
+        before = datetime.strptime(before, '%Y-%m-%d').date() if before else None
+        return jsonify(OrderArchive().archive(before=before))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/archive/assignments')
+def get_archived_assignments():
+    """Archived assignments for ?from=YYYY-MM-DD&to=YYYY-MM-DD (API endpoint).
+    
+    ?agent_id= limits them to one agent, ?orders=1 adds each assignment's orders.
+    """
+    from archival import OrderArchive
+    try:
+        start = request.args.get('from')
+        if not start:
+            return jsonify({'error': 'from=YYYY-MM-DD is required'}), 400
+        start = datetime.strptime(start, '%Y-%m-%d').date()
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() if request.args.get('to') else start
+        if end < start:
+            return jsonify({'error': 'to is before from'}), 400
+        with_orders = request.args.get('orders', '').lower() in ('1', 'true', 'yes')
+        assignments = OrderArchive().get_assignments(start, end, request.args.get('agent_id'), with_orders)
+        return jsonify({'from': start.isoformat(), 'to': end.isoformat(), 'assignments': assignments})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/archive/orders/<order_id>')
+def get_archived_order(order_id):
+    """An archived order by its order_id (API endpoint)"""
+    from archival import OrderArchive
+    try:
+        order = OrderArchive().find_order(order_id)
+        if order is None:
+            return jsonify({'error': 'Order not found in the archive'}), 404
+        return jsonify(order)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def _stats_range():
+    """(from, to) dates of a stats query; the 30 days up to today by default"""
+    end = request.args.get('to')
+    end = datetime.strptime(end, '%Y-%m-%d').date() if end else date.today()
+    start = request.args.get('from')
+    start = datetime.strptime(start, '%Y-%m-%d').date() if start else end - timedelta(days=29)
+    if end < start:
+        raise ValueError('to is before from')
+    return start, end
+
+@bp.route('/api/stats/agents/<agent_id>')
+def get_agent_stats(agent_id):
+    """An agent's daily performance from the rollups (?from=&to=, API endpoint)"""
+    from performance_stats import PerformanceStats
+    try:
+        return jsonify(PerformanceStats.agent_history(agent_id, *_stats_range()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/stats/warehouses/<warehouse_id>')
+def get_warehouse_stats(warehouse_id):
+    """A warehouse's daily performance from the rollups (?from=&to=, API endpoint)"""
+    from performance_stats import PerformanceStats
+    try:
+        return jsonify(PerformanceStats.warehouse_history(warehouse_id, *_stats_range()))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/stats/warehouses')
+def get_warehouse_summary():
+    """Totals and averages per warehouse over a range (?from=&to=, API endpoint)"""
+    from performance_stats import PerformanceStats
+    try:
+        start, end = _stats_range()
+        return jsonify({'from': start.isoformat(), 'to': end.isoformat(),
+                        'warehouses': PerformanceStats.warehouse_summary(start, end)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/simulate', methods=['POST'])
+def simulate_allocation():
+    """Dry-run allocation on a snapshot with config overrides (nothing is written)"""
+    from simulation import DataSnapshot, Simulator, build_scenarios
+    try:
+        payload = request.get_json(silent=True) or {}
+        scenarios = build_scenarios(payload.get('overrides', {}), payload.get('sweep', {}))
+        workers = payload.get('workers')
+        if workers is not None and (isinstance(workers, bool) or not isinstance(workers, int) or workers < 1):
+            raise ValueError("workers must be a positive integer")
+        
+        # Scenarios always run in worker processes so the overrides never touch
+        # the Config used by live allocation in this process
+        simulator = Simulator(DataSnapshot.capture(warm_start=bool(payload.get('warm_start'))))
+        results = simulator.sweep(scenarios, workers)
+        return jsonify({'scenarios': results})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/assignments/<date_str>')
 def get_assignments(date_str):
     """Get assignments for a specific date (API endpoint)"""
     try:
         assignment_date = datetime.strptime(date_str, '%Y-%m-%d').date()
         assignments = Assignment.get_by_date(assignment_date)
         
-        # Convert ObjectId to string and enrich data
+        # Enrich with agent names and order details, one query each for the whole day
+        agent_names = {str(agent['_id']): agent['name'] for agent in db.agents.find(
+            {'_id': {'$in': list({ObjectId(assignment['agent_id']) for assignment in assignments})}}, {'name': 1})}
+        orders = {str(order['_id']): order for order in db.orders.find(
+            {'_id': {'$in': [ObjectId(order_id) for assignment in assignments for order_id in assignment['order_ids']]}},
+            {'order_id': 1, 'customer_name': 1, 'delivery_address': 1})}
         for assignment in assignments:
-            assignment['_id'] = str(assignment['_id'])
-            assignment['agent_id'] = str(assignment['agent_id'])
-            
-            # Get agent details
-            agent = db.agents.find_one({'_id': ObjectId(assignment['agent_id'])})
-            if agent:
-                assignment['agent_name'] = agent['name']
-            
-            # Get order details
-            order_details = []
-            for order_id in assignment['order_ids']:
-                order = db.orders.find_one({'_id': ObjectId(order_id)})
-                if order:
-                    order_details.append({
-                        'order_id': order['order_id'],
-                        'customer_name': order['customer_name'],
-                        'delivery_address': order['delivery_address']
-                    })
-            assignment['order_details'] = order_details
+            if assignment['agent_id'] in agent_names:
+                assignment['agent_name'] = agent_names[assignment['agent_id']]
+            assignment['order_details'] = [
+                {field: orders[order_id][field] for field in ('order_id', 'customer_name', 'delivery_address')}
+                for order_id in assignment['order_ids'] if order_id in orders
+            ]
         
         return jsonify({'assignments': assignments})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/summary/<date_str>')
+@bp.route('/api/routes/<date_str>')
+def get_routes(date_str):
+    """Routes of a date, encoded for map rendering (API endpoint).
+    
+    ?format=polyline (default) returns each route as an encoded polyline,
+    ?format=delta as delta-encoded 1e-5 degree integers. Leg lengths come
+    in whole metres and ETAs in minutes after leaving the warehouse;
+    reloads are the stops that start a new trip from the warehouse.
+    ?stops=1 adds the order ids in visiting order.
+    """
+    try:
+        assignment_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+        route_format = request.args.get('format', 'polyline')
+        if route_format not in ('polyline', 'delta'):
+            return jsonify({'error': f'Unknown format {route_format}'}), 400
+        with_orders = request.args.get('stops', '').lower() in ('1', 'true', 'yes')
+        
+        routes = []
+        for assignment in Assignment.get_routes(assignment_date, with_orders):
+            route = {
+                'agent_id': str(assignment['agent_id']),
+                'distance_km': round(assignment['total_distance'], 2),
+                'legs_m': [int(round(leg * 1000)) for leg in assignment['legs_km']],
+                'eta_minutes': assignment['eta_minutes'],
+                'reloads': assignment.get('reloads', [])
+            }
+            if route_format == 'delta':
+                route['points'] = delta_encode(decode_polyline(assignment['polyline']))
+            else:
+                route['polyline'] = assignment['polyline']
+            if with_orders:
+                route['order_ids'] = assignment['order_ids']
+            routes.append(route)
+        
+        return jsonify({'date': date_str, 'format': route_format, 'routes': routes})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@bp.route('/api/summary/<date_str>')
 def get_summary(date_str):
     """Get daily summary (API endpoint)"""
+    from utils import AssignmentUtils
     try:
         summary = AssignmentUtils.generate_daily_summary(date_str)
         return jsonify(summary)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/health')
+@bp.route('/api/health')
 def health_check():
     """Health check endpoint (API endpoint)"""
     return jsonify({
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat(),
-        'scheduler_running': scheduler.scheduler.running
+        'scheduler_running': scheduler.running,
+        'scheduler_leader': scheduler.leader.is_leader
     })
 
-if __name__ == '__main__':
-    # Start the scheduler
-    scheduler.start()
+def create_app(start_scheduler: bool = None) -> Flask:
+    """Application factory.
+    
+    Each serving process builds its own app and, unless SCHEDULER_ENABLED is
+    off, starts the scheduler; the scheduler lease makes sure only one of
+    them runs the daily jobs. For several workers:
     
-    # Run the Flask app
+        gunicorn -c gunicorn.conf.py 'app:create_app()'
+    """
+    app = Flask(__name__)
+    CORS(app)
+    serialization.init_app(app)
+    app.register_blueprint(bp)
+    
+    if start_scheduler is None:
+        start_scheduler = Config.SCHEDULER_ENABLED
+    if start_scheduler:
+        scheduler.start()
+    return app
+
+if __name__ == '__main__':
+    # Run the Flask app (development server)
+    app = create_app()
     app.run(debug=True, host='0.0.0.0', port=5000)
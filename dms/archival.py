@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Nightly archival of finished days.
+
+Assignments of days that are over, and the orders delivered on them, are
+moved out of the hot assignments and orders collections into monthly
+archive collections (assignments_archive_2024_05, orders_archive_2024_05).
+The hot collections keep only the current working set: pending and
+deferred orders and the last ARCHIVE_RETAIN_DAYS days of assignments.
+Archived days stay queryable through the archive API.
+    
+    python archival.py
+    python archival.py --before 2024-05-01
+"""
+
+import argparse
+import time
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterator, List, Optional
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+def partition_name(kind: str, day: date) -> str:
+    """Archive collection holding a day's assignments or orders"""
+    return f"{kind}_archive_{day.year:04d}_{day.month:02d}"
+
+def _months(start: date, end: date) -> Iterator[date]:
+    month = start.replace(day=1)
+    while month <= end:
+        yield month
+        month = (month + timedelta(days=32)).replace(day=1)
+
+class OrderArchive:
+    """Moves finished days out of the hot collections, in batches.
+    
+    Each batch is copied into the archive before it is deleted from the hot
+    collections, and documents keep their _id, so a batch interrupted half
+    way is finished by the next run without duplicates.
+    """
+    
+    def __init__(self, batch_size: int = None, retain_days: int = None):
+        self.batch_size = batch_size or Config.ARCHIVE_BATCH_SIZE
+        self.retain_days = Config.ARCHIVE_RETAIN_DAYS if retain_days is None else retain_days
+        self._indexed = set()
+    
+    def cutoff(self, today: date = None) -> date:
+        """First day whose assignments stay in the hot collections"""
+        return (today or date.today()) - timedelta(days=max(self.retain_days - 1, 0))
+    
+    def archive(self, before: date = None) -> Dict:
+        """Archive every assignment dated before before (default: cutoff()) with its orders"""
+        from database import db
+        
+        started = time.perf_counter()
+        before = before or self.cutoff()
+        result = {'before': before.isoformat(), 'assignments': 0, 'orders': 0, 'batches': 0, 'partitions': []}
+        partitions = set()
+        while True:
+            batch = list(db.assignments.find({'assignment_date': {'$lt': before.isoformat()}})
+                         .sort('assignment_date', 1).limit(self.batch_size))
+            if not batch:
+                break
+            assignments, orders = self._archive_batch(batch, partitions)
+            result['assignments'] += assignments
+            result['orders'] += orders
+            result['batches'] += 1
+        
+        # Run and task bookkeeping of those days is of no use any more
+        result['runs_removed'] = db.allocation_runs.delete_many(
+            {'date': {'$lt': before.isoformat()}, 'status': 'completed'}).deleted_count
+        # Tasks still queued for those days will never be claimed; only one a worker holds is kept
+        result['tasks_removed'] = db.allocation_tasks.delete_many({
+            'date': {'$lt': before.isoformat()},
+            '$or': [{'status': {'$ne': 'running'}}, {'lease_until': {'$lt': datetime.utcnow()}}]
+        }).deleted_count
+        
+        result['partitions'] = sorted(partitions)
+        result['seconds'] = round(time.perf_counter() - started, 3)
+        logger.info(f"Archived {result['assignments']} assignments and {result['orders']} orders "
+                    f"dated before {before}")
+        return result
+    
+    def _archive_batch(self, assignments: List[Dict], partitions: set):
+        from database import db
+        from bson import ObjectId
+        
+        now = datetime.utcnow()
+        by_month = {}
+        for assignment in assignments:
+            month = date.fromisoformat(assignment['assignment_date'])
+            by_month.setdefault(partition_name('assignments', month), []).append(assignment)
+        
+        archived_orders = 0
+        for name, month_assignments in by_month.items():
+            month = date.fromisoformat(month_assignments[0]['assignment_date'])
+            order_dates = {}
+            for assignment in month_assignments:
+                for order_id in assignment['order_ids']:
+                    order_dates[ObjectId(order_id)] = assignment['assignment_date']
+            
+            # Only orders still held by an assignment; anything released went back to the pool
+            orders = list(db.orders.find({'_id': {'$in': list(order_dates)}, 'status': 'assigned'}))
+            for order in orders:
+                order['assignment_date'] = order_dates[order['_id']]
+                order['archived_at'] = now
+            for assignment in month_assignments:
+                assignment['archived_at'] = now
+            
+            orders_partition = partition_name('orders', month)
+            self._copy(orders_partition, orders)
+            self._copy(name, month_assignments)
+            partitions.add(name)
+            if orders:
+                partitions.add(orders_partition)
+            
+            # Orders first: a hot assignment whose orders are gone is simply archived again
+            if orders:
+                db.orders.delete_many({'_id': {'$in': [order['_id'] for order in orders]}})
+            db.assignments.delete_many({'_id': {'$in': [assignment['_id'] for assignment in month_assignments]}})
+            archived_orders += len(orders)
+        return len(assignments), archived_orders
+    
+    def _copy(self, name: str, documents: List[Dict]):
+        """Insert into an archive collection, skipping documents a previous run already copied"""
+        from database import db
+        from pymongo.errors import BulkWriteError
+        
+        if not documents:
+            return
+        collection = db.get_collection(name)
+        if name not in self._indexed:
+            if name.startswith('assignments_'):
+                collection.create_index([('assignment_date', 1), ('agent_id', 1)])
+            else:
+                collection.create_index('order_id')
+            self._indexed.add(name)
+        try:
+            collection.insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            errors = [error for error in e.details.get('writeErrors', []) if error.get('code') != 11000]
+            if errors:
+                raise
+    
+    def partitions(self, kind: str) -> List[str]:
+        """Archive collections of a kind, oldest first"""
+        from database import db
+        names = db.db.list_collection_names(filter={'name': {'$regex': f'^{kind}_archive_'}})
+        return sorted(names)
+    
+    def get_assignments(self, start: date, end: date, agent_id: str = None,
+                        with_orders: bool = False) -> List[Dict]:
+        """Archived assignments dated start to end (inclusive), optionally with their orders"""
+        from database import db
+        from bson import ObjectId
+        
+        existing = set(self.partitions('assignments'))
+        query = {'assignment_date': {'$gte': start.isoformat(), '$lte': end.isoformat()}}
+        if agent_id:
+            query['agent_id'] = agent_id
+        assignments = []
+        for month in _months(start, end):
+            name = partition_name('assignments', month)
+            if name not in existing:
+                continue
+            month_assignments = list(db.get_collection(name).find(query).sort('assignment_date', 1))
+            if with_orders and month_assignments:
+                order_ids = [ObjectId(order_id) for assignment in month_assignments
+                             for order_id in assignment['order_ids']]
+                orders = {str(order['_id']): order for order in
+                          db.get_collection(partition_name('orders', month)).find({'_id': {'$in': order_ids}})}
+                for assignment in month_assignments:
+                    assignment['orders'] = [orders[order_id] for order_id in assignment['order_ids']
+                                            if order_id in orders]
+            assignments.extend(month_assignments)
+        return assignments
+    
+    def archived_order_ids(self, order_ids: List[str]) -> set:
+        """Those of order_ids that belong to an archived order"""
+        from database import db
+        found = set()
+        for name in self.partitions('orders'):
+            found.update(order['order_id'] for order in
+                         db.get_collection(name).find({'order_id': {'$in': order_ids}}, {'order_id': 1}))
+        return found
+    
+    def find_order(self, order_id: str) -> Optional[Dict]:
+        """An archived order by its order_id, searching the newest months first"""
+        from database import db
+        for name in reversed(self.partitions('orders')):
+            order = db.get_collection(name).find_one({'order_id': order_id})
+            if order:
+                return order
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Move finished days into the archive collections')
+    parser.add_argument('--before', type=date.fromisoformat, default=None,
+                        help='Archive assignments dated before this day (default: keep ARCHIVE_RETAIN_DAYS)')
+    parser.add_argument('--batch-size', type=int, default=None, help='Assignments moved per batch')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    result = OrderArchive(batch_size=args.batch_size).archive(before=args.before)
+    print(f"Archived {result['assignments']} assignments and {result['orders']} orders dated before "
+          f"{result['before']} in {result['batches']} batches ({result['seconds']}s)")
+    for name in result['partitions']:
+        print(f"  {name}")
+
+if __name__ == "__main__":
+    main()
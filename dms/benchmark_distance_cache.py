@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the persistent distance cache.
+
+Compares, on the same set of coordinate pairs:
+  - geopy geodesic per pair (what LocationUtils uses without a cache)
+  - cache lookups on an empty file (cold), then in the same process (warm)
+  - cache lookups from a fresh process-level instance on the filled file (disk)
+  - vectorized numpy haversine over the same points
+
+The cache only pays off where it beats the vectorized computation, so the
+last column is the one to compare against.
+
+    python benchmark_distance_cache.py --points 1500 --pairs 200000 --precision 7
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+from geopy.distance import geodesic
+from distance_cache import DistanceCache
+from utils import LocationUtils
+
+def generate_points(count: int, seed: int):
+    """Delivery points clustered around a few Bangalore neighbourhoods"""
+    rng = random.Random(seed)
+    centers = [(12.9716 + rng.uniform(-0.15, 0.15), 77.5946 + rng.uniform(-0.15, 0.15)) for _ in range(25)]
+    points = []
+    for _ in range(count):
+        lat, lon = rng.choice(centers)
+        points.append((lat + rng.gauss(0, 0.01), lon + rng.gauss(0, 0.01)))
+    return points
+
+def generate_pairs(points, count: int, seed: int):
+    rng = random.Random(seed + 1)
+    return [(rng.choice(points), rng.choice(points)) for _ in range(count)]
+
+def time_lookups(cache: DistanceCache, pairs) -> float:
+    started = time.perf_counter()
+    for (lat1, lon1), (lat2, lon2) in pairs:
+        cache.distance(lat1, lon1, lat2, lon2)
+    return time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the geohash distance cache')
+    parser.add_argument('--points', type=int, default=1500)
+    parser.add_argument('--pairs', type=int, default=200000)
+    parser.add_argument('--precision', type=int, default=7)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    
+    points = generate_points(args.points, args.seed)
+    pairs = generate_pairs(points, args.pairs, args.seed)
+    path = os.path.join(tempfile.mkdtemp(), 'distance_cache.sqlite')
+    
+    results = []  # (name, seconds, distances computed, cache stats)
+    
+    started = time.perf_counter()
+    for (lat1, lon1), (lat2, lon2) in pairs:
+        geodesic((lat1, lon1), (lat2, lon2)).kilometers
+    results.append(('geodesic per pair', time.perf_counter() - started, args.pairs, None))
+    
+    cache = DistanceCache(path, precision=args.precision)
+    results.append(('cache cold', time_lookups(cache, pairs), args.pairs, cache.stats()))
+    cache.reset_stats()
+    results.append(('cache warm (in-process)', time_lookups(cache, pairs), args.pairs, cache.stats()))
+    cache.close()
+    
+    cache = DistanceCache(path, precision=args.precision)
+    results.append(('cache warm (from disk)', time_lookups(cache, pairs), args.pairs, cache.stats()))
+    cache.close()
+    
+    # The vectorized path computes the full matrix over the unique points,
+    # which covers every pair above; its per-distance cost is per matrix entry
+    started = time.perf_counter()
+    for point in points:
+        LocationUtils.distances_from(point, points)
+    results.append((f'numpy haversine {args.points}x{args.points}', time.perf_counter() - started,
+                    args.points ** 2, None))
+    
+    print(f"{args.pairs} lookups over {args.points} points, geohash precision {args.precision}\n")
+    print(f"{'method':<32} {'seconds':>9} {'us/dist':>9} {'hit rate':>9} {'entries':>9}")
+    for name, seconds, computed, stats in results:
+        per_pair = seconds / computed * 1e6
+        hit_rate = f"{stats['hit_rate']:.1%}" if stats else '-'
+        entries = stats['entries'] if stats else '-'
+        print(f"{name:<32} {seconds:>9.3f} {per_pair:>9.2f} {hit_rate:>9} {entries:>9}")
+    
+    # Quantization error against the exact geodesic distance
+    sample = pairs[:2000]
+    cache = DistanceCache(path, precision=args.precision)
+    errors = [abs(cache.distance(a[0], a[1], b[0], b[1]) - geodesic(a, b).kilometers) for a, b in sample]
+    cache.close()
+    print(f"\nQuantization error: mean {sum(errors) / len(errors) * 1000:.0f} m, max {max(errors) * 1000:.0f} m")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+HTTP load test for a running server.
+
+Each simulated user is a thread holding one keep-alive connection and
+behaving like one open page of the web interface:
+  - dashboard: loads the page, today's summary, assignments and health,
+    then polls the summary and health every 30 seconds
+  - orders: loads the page and pending orders, then polls them every 60 seconds
+  - agents: loads the page and agents, then refreshes them every 60 seconds
+Alongside them, agents check in and allocations are triggered at fixed
+rates, each followed by the reloads the page does after it.
+
+--speedup divides the polling intervals, so a few hundred threads stand
+in for many more users. Latency is counted from when the page would have
+sent the request, so a server that falls behind the polling schedule shows
+up in the percentiles instead of slowing the users down. Reports requests,
+errors (5xx and failed connections), throughput and p50/p95/p99 per route.
+
+Needs a running server and MongoDB with data (POST /seed-data). Check-ins
+and allocations change that data; set their rates to 0 for a read-only run.
+    
+    python benchmark_load.py --users dashboard=50,orders=20,agents=10 --duration 120 --speedup 10
+    python benchmark_load.py --url http://localhost:5000 --save after.json --compare before.json
+"""
+
+import argparse
+import http.client
+import json
+import random
+import statistics
+import threading
+import time
+import urllib.request
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+# Requests of each page when it loads and on every refresh, as in templates/
+PAGES = {
+    'dashboard': {
+        'load': [('GET', '/dashboard'), ('GET', '/api/summary/{date}'),
+                 ('GET', '/api/assignments/{date}'), ('GET', '/api/health')],
+        'poll': [('GET', '/api/summary/{date}'), ('GET', '/api/health')],
+        'interval': 30,
+    },
+    'orders': {
+        'load': [('GET', '/orders'), ('GET', '/api/orders')],
+        'poll': [('GET', '/api/orders')],
+        'interval': 60,
+    },
+    'agents': {
+        # No auto-refresh on this page; users press Refresh
+        'load': [('GET', '/agents'), ('GET', '/api/agents')],
+        'poll': [('GET', '/api/agents')],
+        'interval': 60,
+    },
+}
+
+CHECK_IN = [('POST', '/check-in/{agent_id}'), ('GET', '/api/agents')]
+ALLOCATION = [('POST', '/run-allocation'), ('GET', '/api/summary/{date}'), ('GET', '/api/assignments/{date}')]
+
+HEADERS = {'Accept': 'application/json, text/html', 'Accept-Encoding': 'gzip, deflate, br'}
+
+def route_label(method: str, path: str) -> str:
+    return f"{method} {path.replace('{date}', '<date>').replace('{agent_id}', '<agent_id>')}"
+
+class Recorder:
+    """Latencies and outcomes of one thread's requests, by route"""
+    
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.bytes = Counter()
+    
+    def merge(self, other: 'Recorder'):
+        for route, latencies in other.latencies.items():
+            self.latencies[route].extend(latencies)
+        for route, statuses in other.statuses.items():
+            self.statuses[route].update(statuses)
+        self.bytes.update(other.bytes)
+
+class Client:
+    """One keep-alive connection, reopened after a failure or when the server closes it"""
+    
+    def __init__(self, url: str, recorder: Recorder, timeout: float):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.recorder = recorder
+        self.timeout = timeout
+        self.connection = None
+    
+    def send(self, method: str, path: str, route: str, intended: float):
+        """Send a request due at intended (a perf_counter time) and record how it went"""
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self.connection.request(method, path, headers=HEADERS)
+            response = self.connection.getresponse()
+            body = response.read()
+        except (OSError, http.client.HTTPException):
+            self.close()
+            self.recorder.statuses[route]['failed'] += 1
+            return
+        self.recorder.latencies[route].append(time.perf_counter() - intended)
+        self.recorder.statuses[route][response.status] += 1
+        self.recorder.bytes[route] += len(body)
+        if response.will_close:
+            self.close()
+    
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+def run_requests(client: Client, requests, due: float, **values):
+    """Send requests one after the other, the first due at due"""
+    intended = due
+    for method, path in requests:
+        client.send(method, path.format(**values), route_label(method, path), intended)
+        intended = time.perf_counter()
+
+def wait_until(moment: float, stop: threading.Event) -> bool:
+    """Sleep until moment (perf_counter); False when the run is stopping"""
+    return not stop.wait(max(0.0, moment - time.perf_counter()))
+
+def browse(client: Client, page: dict, start: float, end: float, speedup: float, date: str, stop: threading.Event):
+    """One user with page open from start to end"""
+    due = start
+    requests = page['load']
+    while due < end and wait_until(due, stop):
+        run_requests(client, requests, due, date=date)
+        requests = page['poll']
+        due += page['interval'] / speedup
+    client.close()
+
+def repeat_at_rate(client: Client, per_minute: float, start: float, end: float, stop: threading.Event, action):
+    """Call action(due) at per_minute random (Poisson) times from start to end"""
+    due = start + random.expovariate(per_minute / 60)
+    while due < end and wait_until(due, stop):
+        action(due)
+        due += random.expovariate(per_minute / 60)
+    client.close()
+
+def fetch_agent_ids(url: str, timeout: float):
+    """Ids of the agents to check in"""
+    try:
+        with urllib.request.urlopen(f'{url}/api/agents', timeout=timeout) as response:
+            return [agent['_id'] for agent in json.load(response)['agents']]
+    except OSError as e:
+        raise SystemExit(f'GET {url}/api/agents failed ({e}); is the server running?')
+
+def percentile(values, fraction: float) -> float:
+    """Linear-interpolated percentile of sorted values"""
+    position = (len(values) - 1) * fraction
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+def summarize(recorder: Recorder, seconds: float) -> dict:
+    """Per-route counts, throughput and latency percentiles in milliseconds"""
+    routes = {}
+    everything = []
+    for route in sorted(recorder.statuses):
+        latencies = sorted(recorder.latencies[route])
+        everything.extend(latencies)
+        statuses = recorder.statuses[route]
+        routes[route] = dict(
+            requests=sum(statuses.values()),
+            errors=sum(count for status, count in statuses.items() if status == 'failed' or status >= 500),
+            statuses={str(status): count for status, count in sorted(statuses.items(), key=str)},
+            rps=round(sum(statuses.values()) / seconds, 2),
+            kb_per_response=round(recorder.bytes[route] / max(len(latencies), 1) / 1024, 1),
+            **latency_stats(latencies)
+        )
+    everything.sort()
+    total = dict(
+        requests=sum(route['requests'] for route in routes.values()),
+        errors=sum(route['errors'] for route in routes.values()),
+        rps=round(sum(route['requests'] for route in routes.values()) / seconds, 2),
+        **latency_stats(everything)
+    )
+    return {'routes': routes, 'total': total}
+
+def latency_stats(latencies) -> dict:
+    if not latencies:
+        return dict(p50=None, p95=None, p99=None, max=None, mean=None)
+    return dict(
+        p50=round(percentile(latencies, 0.50) * 1000, 2),
+        p95=round(percentile(latencies, 0.95) * 1000, 2),
+        p99=round(percentile(latencies, 0.99) * 1000, 2),
+        max=round(latencies[-1] * 1000, 2),
+        mean=round(statistics.fmean(latencies) * 1000, 2)
+    )
+
+def milliseconds(value) -> str:
+    return '-' if value is None else f'{value:.1f}'
+
+def print_report(summary: dict):
+    print(f"{'route':<36}{'requests':>9}{'errors':>8}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    rows = list(summary['routes'].items()) + [('all', summary['total'])]
+    for route, stats in rows:
+        print(f"{route:<36}{stats['requests']:>9}{stats['errors']:>8}{stats['rps']:>8.1f}"
+              f"{milliseconds(stats['p50']):>9}{milliseconds(stats['p95']):>9}"
+              f"{milliseconds(stats['p99']):>9}{milliseconds(stats['max']):>9}")
+
+def print_comparison(summary: dict, baseline: dict):
+    """Throughput and percentiles against a saved run, as change relative to it"""
+    print(f"\nAgainst {baseline['saved_at']} ({baseline['options']['users']}):")
+    print(f"{'route':<36}" + ''.join(f"{key:>17}" for key in ('rps', 'p50 ms', 'p95 ms', 'p99 ms')))
+    rows = [(route, stats, baseline['routes'].get(route)) for route, stats in summary['routes'].items()]
+    rows.append(('all', summary['total'], baseline['total']))
+    for route, stats, before in rows:
+        if before is None:
+            continue
+        cells = []
+        for key in ('rps', 'p50', 'p95', 'p99'):
+            if stats[key] is None or not before[key]:
+                cells.append(f"{'-':>17}")
+            else:
+                change = (stats[key] - before[key]) / before[key] * 100
+                cells.append(f"{milliseconds(stats[key]):>10} {change:>+5.0f}%")
+        print(f"{route:<36}{''.join(cells)}")
+
+def parse_users(value: str) -> dict:
+    """'dashboard=50,orders=20' -> {'dashboard': 50, 'orders': 20}"""
+    users = {}
+    for part in value.split(','):
+        page, _, count = part.partition('=')
+        if page.strip() not in PAGES:
+            raise argparse.ArgumentTypeError(f"Unknown page {page!r}, expected one of {', '.join(PAGES)}")
+        users[page.strip()] = int(count)
+    return users
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the web interface and API of a running server')
+    parser.add_argument('--url', default='http://localhost:5000', help='Server to load')
+    parser.add_argument('--users', type=parse_users, default='dashboard=20,orders=10,agents=5',
+                        help='Open pages per page type, e.g. dashboard=50,orders=20,agents=10')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds of load')
+    parser.add_argument('--ramp-up', type=float, default=10, help='Seconds over which users open their page')
+    parser.add_argument('--speedup', type=float, default=1, help='Divides the pages\' polling intervals')
+    parser.add_argument('--check-ins', type=float, default=30, help='Agent check-ins per minute (0 disables)')
+    parser.add_argument('--allocations', type=float, default=0.5, help='Allocation runs triggered per minute (0 disables)')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds before a request counts as failed')
+    parser.add_argument('--save', help='Write the results to this JSON file')
+    parser.add_argument('--compare', help='A JSON file saved by an earlier run to compare against')
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    
+    random.seed(args.seed)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    date = datetime.now(timezone.utc).date().isoformat()  # what the dashboard asks for
+    agent_ids = fetch_agent_ids(args.url, args.timeout) if args.check_ins > 0 else []
+    
+    stop = threading.Event()
+    recorders = []
+    threads = []
+    start = time.perf_counter() + 0.5
+    end = start + args.duration
+    
+    def add_thread(target, *target_args):
+        recorder = Recorder()
+        recorders.append(recorder)
+        client = Client(args.url, recorder, args.timeout)
+        threads.append(threading.Thread(target=target, args=(client, *target_args), daemon=True))
+        return client
+    
+    for page, count in args.users.items():
+        for _ in range(count):
+            add_thread(browse, PAGES[page], start + random.uniform(0, args.ramp_up), end,
+                       args.speedup, date, stop)
+    if agent_ids:
+        client = add_thread(repeat_at_rate, args.check_ins, start, end, stop,
+                            lambda due: run_requests(client, CHECK_IN, due, agent_id=random.choice(agent_ids)))
+    if args.allocations > 0:
+        allocator = add_thread(repeat_at_rate, args.allocations, start, end, stop,
+                               lambda due: run_requests(allocator, ALLOCATION, due, date=date))
+    
+    print(f"{sum(args.users.values())} users on {args.url} for {args.duration:.0f}s "
+          f"(polling {args.speedup:g}x faster, {args.check_ins:g} check-ins and "
+          f"{args.allocations:g} allocations per minute)\n")
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in threads:
+            thread.join()
+    seconds = min(time.perf_counter(), end) - start
+    
+    merged = Recorder()
+    for recorder in recorders:
+        merged.merge(recorder)
+    summary = summarize(merged, seconds)
+    print_report(summary)
+    if baseline is not None:
+        print_comparison(summary, baseline)
+    
+    if args.save:
+        options = dict(vars(args), users=','.join(f'{page}={count}' for page, count in args.users.items()))
+        summary = dict(saved_at=datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                       url=args.url, seconds=round(seconds, 2), options=options, **summary)
+        with open(args.save, 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"\nSaved to {args.save}")
+
+if __name__ == "__main__":
+    main()
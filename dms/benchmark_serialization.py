@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Benchmark for API response serialization and compression.
+
+Builds /api/orders and /api/assignments payloads of realistic documents
+(ObjectIds, naive UTC datetimes, stored routes) and times turning them into
+a response body:
+  - before: converting ObjectId fields to str in a loop, then Flask's
+    default JSON provider (the standard library json, keys sorted)
+  - serialization.dumps with orjson, and with its standard library fallback
+  - gzip and brotli (when installed) of the encoded body, with the bytes
+    that go over the wire
+
+No MongoDB server is needed; the documents are generated.
+    
+    python benchmark_serialization.py --orders 20000 --assignments 500
+"""
+
+import argparse
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+from route_encoding import encode_polyline
+import serialization
+
+def make_orders(count: int, warehouses: int = 10):
+    warehouse_ids = [ObjectId() for _ in range(warehouses)]
+    created = datetime(2024, 5, 1, 6, 0)
+    return [{
+        '_id': ObjectId(),
+        'order_id': f'ORD{index:07d}',
+        'customer_name': random.choice(['Aarav Sharma', 'Priya Nair', 'Rohan Gupta', 'Ananya Iyer']),
+        'customer_phone': f'+91-{random.randint(9000000000, 9999999999)}',
+        'delivery_address': f'{random.randint(1, 999)}, {random.choice(["MG Road", "Indiranagar", "Koramangala"])}, Bangalore',
+        'latitude': 12.9716 + random.uniform(-0.2, 0.2),
+        'longitude': 77.5946 + random.uniform(-0.2, 0.2),
+        'warehouse_id': random.choice(warehouse_ids),
+        'order_date': '2024-05-01',
+        'status': 'pending',
+        'assigned_agent_id': None,
+        'defer_count': 0,
+        'created_at': created + timedelta(seconds=index)
+    } for index in range(count)]
+
+def make_assignments(count: int, stops: int = 40):
+    assignments = []
+    for _ in range(count):
+        route = [(12.9716 + random.uniform(-0.2, 0.2), 77.5946 + random.uniform(-0.2, 0.2)) for _ in range(stops + 1)]
+        assignments.append({
+            '_id': ObjectId(),
+            'agent_id': str(ObjectId()),
+            'agent_name': 'Vikram Reddy',
+            'assignment_date': '2024-05-01',
+            'order_ids': [str(ObjectId()) for _ in range(stops)],
+            'total_distance': random.uniform(40, 120),
+            'total_time': random.uniform(2, 6),
+            'earning_per_order': 42,
+            'total_earning': 42 * stops,
+            'legs_km': [round(random.uniform(0.2, 4), 3) for _ in range(stops)],
+            'eta_minutes': [round(minute * 4.5, 1) for minute in range(1, stops + 1)],
+            'reloads': [20],
+            'polyline': encode_polyline(route),
+            'order_details': [{'order_id': f'ORD{index:07d}', 'customer_name': 'Priya Nair',
+                               'delivery_address': '221, Indiranagar, Bangalore'} for index in range(stops)],
+            'created_at': datetime(2024, 5, 1, 7, 0, 3)
+        })
+    return assignments
+
+def convert_by_hand(documents, fields):
+    """What the handlers used to do before encoding"""
+    for document in documents:
+        document['_id'] = str(document['_id'])
+        for field in fields:
+            if document.get(field):
+                document[field] = str(document[field])
+    return documents
+
+def timed(function, repeat: int):
+    """(median seconds, last result) of repeat calls"""
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - started)
+    return statistics.median(times), result
+
+def bench_payload(name: str, key: str, documents, id_fields, repeat: int):
+    app = Flask(__name__)
+    default = DefaultJSONProvider(app)
+    fast = serialization.orjson
+    
+    def before():
+        copies = convert_by_hand([dict(document) for document in documents], id_fields)
+        return default.dumps({key: copies}).encode('utf-8')
+    
+    def after():
+        return serialization.dumps({key: [dict(document) for document in documents]})
+    
+    def fallback():
+        serialization.orjson = None
+        try:
+            return after()
+        finally:
+            serialization.orjson = fast
+    
+    print(f"\n{name}: {len(documents)} documents")
+    base_seconds, body = timed(before, repeat)
+    print(f"  {'before (str loop + Flask json)':34s} {base_seconds * 1000:8.1f} ms  {len(body) / 1e6:6.2f} MB")
+    encoders = [('after (orjson)', after)] if fast is not None else []
+    encoders.append(('after (json fallback)', fallback))
+    for label, encode in encoders:
+        seconds, body = timed(encode, repeat)
+        print(f"  {label:34s} {seconds * 1000:8.1f} ms  {len(body) / 1e6:6.2f} MB  "
+              f"{base_seconds / seconds:5.1f}x")
+    
+    for encoding, compress in serialization.ENCODERS.items():
+        seconds, compressed = timed(lambda: compress(body), repeat)
+        print(f"  {encoding:34s} {seconds * 1000:8.1f} ms  {len(compressed) / 1e6:6.2f} MB  "
+              f"{len(body) / len(compressed):5.1f}x smaller")
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark API response encoding and compression')
+    parser.add_argument('--orders', type=int, default=20000, help='Orders in the /api/orders payload')
+    parser.add_argument('--assignments', type=int, default=500, help='Assignments in the /api/assignments payload')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    
+    random.seed(7)
+    print(f"orjson {'installed' if serialization.orjson is not None else 'not installed'}, "
+          f"brotli {'installed' if serialization.brotli is not None else 'not installed'}")
+    bench_payload('/api/orders', 'orders', make_orders(args.orders),
+                  ('warehouse_id', 'assigned_agent_id'), args.repeat)
+    bench_payload('/api/assignments/<date>', 'assignments', make_assignments(args.assignments),
+                  ('agent_id',), args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark for process startup.
+
+Every scenario runs in a fresh interpreter, so nothing is already imported
+or connected, and is repeated to report the median:
+  - importing database (what the check_*.py scripts load) and models
+  - importing app, then building it with create_app() without the scheduler
+  - the first request after that (GET /api and GET /api/health), which pays
+    for anything the routes load on first use
+  - the whole process, including interpreter shutdown, which has to stop
+    any MongoDB client threads started along the way
+
+No MongoDB server is needed; none of the measured steps queries it.
+    
+    python benchmark_startup.py --repeat 7
+    python benchmark_startup.py --top 15
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SCENARIOS = {
+    'import database': "import database",
+    'import models': "import models",
+    'import app': "import app",
+    'create_app': "import app\n__mark__()\napp.create_app(start_scheduler=False)",
+    'first GET /api': ("import app\nclient = app.create_app(start_scheduler=False).test_client()\n__mark__()\n"
+                       "assert client.get('/api').status_code == 200"),
+    'first GET /api/health': ("import app\nclient = app.create_app(start_scheduler=False).test_client()\n"
+                              "__mark__()\nassert client.get('/api/health').status_code == 200"),
+}
+
+# Times the code after the last __mark__() (or all of it) and the modules it loaded
+RUNNER = """
+import json, sys, time
+marks = [time.perf_counter()]
+before = [len(sys.modules)]
+def __mark__():
+    marks[0] = time.perf_counter()
+    before[0] = len(sys.modules)
+exec(compile({code!r}, '<scenario>', 'exec'))
+print(json.dumps({{'seconds': time.perf_counter() - marks[0], 'modules': len(sys.modules) - before[0]}}))
+"""
+
+def run_scenario(code: str):
+    """(step seconds, modules loaded by the step, whole process seconds)"""
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', RUNNER.format(code=code)], cwd=HERE,
+                            capture_output=True, text=True, check=True).stdout
+    total = time.perf_counter() - started
+    result = json.loads(output.strip().splitlines()[-1])
+    return result['seconds'], result['modules'], total
+
+def slowest_imports(module: str, count: int):
+    """Modules with the largest cumulative import time, from python -X importtime"""
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'], cwd=HERE,
+                            capture_output=True, text=True).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.startswith(' ' * 4):
+            # Only a module's own top-level imports, one level down
+            continue
+        rows.append((int(cumulative) / 1e6, name.strip()))
+    return sorted(rows, reverse=True)[:count]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark import and first-request latency')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--top', type=int, default=0, help='Also list the slowest imports under app')
+    args = parser.parse_args()
+    
+    print(f"{'scenario':<24}{'step':>10}{'modules':>10}{'process':>10}")
+    for name, code in SCENARIOS.items():
+        runs = [run_scenario(code) for _ in range(args.repeat)]
+        step = statistics.median(run[0] for run in runs)
+        modules = runs[-1][1]
+        process = statistics.median(run[2] for run in runs)
+        print(f"{name:<24}{step * 1000:>8.1f}ms{modules:>10}{process * 1000:>8.1f}ms")
+    
+    if args.top:
+        print("\nSlowest imports under app (cumulative):")
+        for seconds, module in slowest_imports('app', args.top):
+            print(f"  {seconds * 1000:>8.1f}ms  {module}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+from typing import List, Dict
+from utils import LocationUtils
+from trips import vehicle_capacity
+from config import Config
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+class CapacityPlanner:
+    """Fixes each agent's target order count for a warehouse before routing.
+    
+    Agents take consecutive slices of the candidate order list. For every
+    slice start and size the planner estimates the route length from the
+    radial distances of the slice. Routes are open paths ending at their
+    last stop: out to the nearest stop, then through the annulus the slice
+    covers. The path combines the sweep around the ring (its mean
+    circumference less the expected largest angular gap between stops,
+    which an open path skips) with the Beardwood-Halton-Hammersley term
+    over the annulus area, less one of the closed tour's n edges. On
+    uniform random slices this is within about 10% of the nearest-neighbour
+    route on average at every slice size. An agent whose vehicle carries
+    fewer orders than the slice drives back to the warehouse and out again
+    before each further trip, about twice the slice's mean radial distance
+    plus RELOAD_MINUTES.
+    A dynamic programme over agents then picks the counts that serve the
+    most orders and, among those, pay the least.
+    """
+    
+    BHH_CONSTANT = 0.7124  # tour length ~ c * sqrt(n * area) for random points
+    SERVED_ORDER_VALUE = 1000  # outweighs any payout difference between plans
+    
+    def plan_order_counts(self, warehouse: Dict, agents: List[Dict],
+                          orders: List[Dict]) -> Dict[str, int]:
+        """Return {agent_id: target order count} for orders in candidate order"""
+        if not agents or not orders:
+            return {}
+        
+        radial = LocationUtils.distances_from(
+            (warehouse['latitude'], warehouse['longitude']),
+            [(order['latitude'], order['longitude']) for order in orders]
+        )
+        counts = self._solve(radial, [vehicle_capacity(agent) for agent in agents])
+        plan = {str(agent['_id']): count for agent, count in zip(agents, counts)}
+        
+        tiers = self.tier_breakdown(counts)
+        logger.info(f"Capacity plan for warehouse {warehouse['_id']}: "
+                    f"{sum(counts)}/{len(orders)} orders, tiers {tiers}")
+        return plan
+    
+    @staticmethod
+    def payout_curve(max_orders: int) -> np.ndarray:
+        """Total daily payout for an agent carrying 0..max_orders orders"""
+        counts = np.arange(max_orders + 1)
+        rates = np.where(counts >= Config.TIER_2_ORDERS, Config.TIER_2_PAYMENT,
+                         np.where(counts >= Config.TIER_1_ORDERS, Config.TIER_1_PAYMENT,
+                                  Config.DEFAULT_PAYMENT))
+        return counts * rates
+    
+    def route_cost_curves(self, radial: np.ndarray, max_orders: int, capacity: int = None) -> np.ndarray:
+        """Estimated open route km for taking k orders starting at position s.
+        
+        Returns an (n + 1, max_orders + 1) array; row s is the cost curve of an
+        agent whose slice starts at s and its np.diff is the marginal cost of
+        each extra order. Slices running past the end of the list are inf.
+        With a capacity, the km of the returns to the warehouse to reload are
+        included.
+        """
+        n = len(radial)
+        padded = np.concatenate([radial, np.full(max_orders, np.nan)])
+        windows = np.lib.stride_tricks.sliding_window_view(padded, max_orders)[:n + 1]
+        
+        nearest = np.fmin.accumulate(windows, axis=1)
+        farthest = np.fmax.accumulate(windows, axis=1)
+        sizes = np.arange(1, max_orders + 1)
+        # Expected largest gap between n uniform angles is H(n) / n of the circle
+        sweep = np.pi * (nearest + farthest) * (1 - np.cumsum(1 / sizes) / sizes)
+        annulus = np.pi * (farthest ** 2 - nearest ** 2)
+        area = self.BHH_CONSTANT * np.sqrt(sizes * annulus) * (sizes - 1) / sizes
+        cost = nearest + np.hypot(sweep, area)
+        if capacity:
+            mean = np.cumsum(windows, axis=1) / sizes
+            cost = cost + 2 * mean * self.reloads(sizes, capacity)
+        
+        # A window is only valid if every slot in it is a real order
+        valid = np.cumsum(np.isnan(windows), axis=1) == 0
+        cost = np.where(valid, cost, np.inf)
+        return np.hstack([np.zeros((n + 1, 1)), cost])
+    
+    @staticmethod
+    def reloads(sizes: np.ndarray, capacity: int = None) -> np.ndarray:
+        """Returns to the warehouse needed to deliver each of sizes orders"""
+        if not capacity:
+            return np.zeros_like(sizes)
+        return np.maximum(sizes - 1, 0) // capacity
+    
+    def _values(self, radial: np.ndarray, max_orders: int, capacity: int = None) -> np.ndarray:
+        """Objective of taking k orders from position s; inf where the route would break a limit"""
+        sizes = np.arange(max_orders + 1)
+        route_km = self.route_cost_curves(radial, max_orders, capacity)
+        route_hours = (route_km * Config.MINUTES_PER_KM + self.reloads(sizes, capacity) * Config.RELOAD_MINUTES) / 60
+        payout = self.payout_curve(max_orders)
+        
+        feasible = ((route_km <= Config.MAX_TRAVEL_DISTANCE_PER_DAY) &
+                    (route_hours <= Config.MAX_WORKING_HOURS_PER_DAY) &
+                    (payout >= Config.MIN_DAILY_EARNING) &
+                    (sizes >= Config.MIN_ORDERS_PER_AGENT))
+        feasible[:, 0] = True
+        return np.where(feasible, payout - self.SERVED_ORDER_VALUE * sizes, np.inf)
+    
+    def _solve(self, radial: np.ndarray, capacities: List[int]) -> List[int]:
+        """Dynamic programme over agents (given by their vehicle capacities); state is orders consumed so far"""
+        n = len(radial)
+        max_orders = min(Config.MAX_ORDERS_PER_AGENT, n)
+        values = {}
+        
+        best = np.full(n + 1, np.inf)
+        best[0] = 0
+        choices = []
+        for capacity in capacities:
+            if capacity not in values:
+                values[capacity] = self._values(radial, max_orders, capacity)
+            value = values[capacity]
+            new_best = np.full(n + 1, np.inf)
+            choice = np.zeros(n + 1, dtype=int)
+            for k in range(max_orders + 1):
+                candidate = best[:n + 1 - k] + value[:n + 1 - k, k]
+                improved = candidate < new_best[k:]
+                new_best[k:] = np.where(improved, candidate, new_best[k:])
+                choice[k:] = np.where(improved, k, choice[k:])
+            best = new_best
+            choices.append(choice)
+        
+        # Walk back from the cheapest end state to recover each agent's count
+        consumed = int(np.argmin(best))
+        counts = []
+        for choice in reversed(choices):
+            count = int(choice[consumed])
+            counts.append(count)
+            consumed -= count
+        return counts[::-1]
+    
+    @staticmethod
+    def tier_of(count: int) -> str:
+        """Payment tier reached with count orders in a day"""
+        if count >= Config.TIER_2_ORDERS:
+            return 'TIER_2'
+        if count >= Config.TIER_1_ORDERS:
+            return 'TIER_1'
+        return 'DEFAULT'
+    
+    @staticmethod
+    def tier_breakdown(counts: List[int]) -> Dict[str, int]:
+        """Number of agents planned into each payment tier"""
+        tiers = {'DEFAULT': 0, 'TIER_1': 0, 'TIER_2': 0}
+        for count in counts:
+            if count > 0:
+                tiers[CapacityPlanner.tier_of(count)] += 1
+        return tiers
+
+# Global instance
+capacity_planner = CapacityPlanner()
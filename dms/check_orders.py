@@ -4,7 +4,6 @@ import sys
 sys.path.append('/home/rayan/Desktop/projects/assignment')
 
 from database import db
-from bson import ObjectId
 
 print("=== CHECKING ORDERS IN DATABASE ===")
 
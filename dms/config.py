@@ -7,10 +7,99 @@ class Config:
     MONGODB_URI = os.getenv('MONGODB_URI', 'mongodb://localhost:27017/')
     DB_NAME = os.getenv('DB_NAME', 'delivery_management')
     
+    # Persistent distance cache (disabled unless a path is given)
+    DISTANCE_CACHE_PATH = os.getenv('DISTANCE_CACHE_PATH')
+    DISTANCE_CACHE_PRECISION = int(os.getenv('DISTANCE_CACHE_PRECISION', 7))  # geohash length, 7 = ~150m cells
+    DISTANCE_CACHE_MAX_ENTRIES = int(os.getenv('DISTANCE_CACHE_MAX_ENTRIES', 500000))
+    # Road network distances, opt-in: used instead of straight-line only when this file exists (none is shipped)
+    # Road network distances (used instead of straight-line when the file exists)
+    ROAD_NETWORK_PATH = os.getenv('ROAD_NETWORK_PATH',
+                                  os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'road_network.osm'))
+    
     # Business constraints
     MAX_WORKING_HOURS_PER_DAY = 15  # hours (very relaxed for demo)
     MAX_TRAVEL_DISTANCE_PER_DAY = 200  # km (very relaxed for demo)
     MINUTES_PER_KM = 3  # travel time per km (faster travel for demo)
+    MIN_ORDERS_PER_AGENT = 5  # smallest order set worth routing
+    MAX_ORDERS_PER_AGENT = 60  # hard cap per agent per day
+    DEFERRAL_AGING_PER_DAY = 1  # priority levels a waiting order gains per day
+    
+    # Delivery time windows: window_start / window_end ("HH:MM") and service_minutes on orders
+    SHIFT_START = os.getenv('SHIFT_START', '09:00')  # agents leave the warehouse at this time
+    DEFAULT_SERVICE_MINUTES = 0  # minutes at each stop for orders without service_minutes
+    
+    # Vehicle capacity: orders carried out of the warehouse per trip; longer routes reload there in between
+    VEHICLE_CAPACITY = {'two_wheeler': 20, 'three_wheeler': 45, 'van': 120}
+    DEFAULT_VEHICLE_TYPE = os.getenv('DEFAULT_VEHICLE_TYPE', 'two_wheeler')  # for agents without a vehicle_type
+    RELOAD_MINUTES = 10  # at the warehouse between two trips
+    
+    # Warm start: seed each agent's route from their previous day's stops
+    WARM_START_ENABLED = os.getenv('WARM_START_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    WARM_START_MATCH_RADIUS_KM = 1.5  # max distance from a previous stop to inherit an order
+    
+    # Cross-warehouse rebalancing of deferred orders to idle agents nearby
+    REBALANCE_ENABLED = os.getenv('REBALANCE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    REBALANCE_RADIUS_KM = 10  # max distance between warehouses and from the new warehouse to the order
+    
+    # Inter-route local search after the per-agent selection
+    LOCAL_SEARCH_TIME_BUDGET = 2.0  # seconds per warehouse, 0 disables
+    LOCAL_SEARCH_ITERATIONS = 0  # stops tried per warehouse instead of a time budget (repeatable runs), 0 = use the time budget
+    LOCAL_SEARCH_NEIGHBOURS = 12  # nearest stops tried as move partners
+    LOCAL_SEARCH_RUPEES_PER_KM = 5  # weighs route km against tier payouts
+    
+    # What-if simulation
+    SIMULATION_MAX_SCENARIOS = 64  # scenarios one sweep may run
+    SIMULATION_SEARCH_ITERATIONS = 1500  # LOCAL_SEARCH_ITERATIONS in simulations (about the time budget's worth), so runs repeat exactly
+    
+    # Memo of routed order sets (reused across shrinking prefixes and what-if runs)
+    ROUTE_MEMO_MAX_ENTRIES = 5000
+    
+    # Wall-clock budget for one allocation run; improvement stops when it runs out
+    ALLOCATION_TIME_BUDGET = float(os.getenv('ALLOCATION_TIME_BUDGET', 0))  # seconds, 0 = no deadline
+    
+    # Nearest-warehouse routing of incoming and pending orders
+    WAREHOUSE_AUTO_ROUTE = os.getenv('WAREHOUSE_AUTO_ROUTE', 'true').lower() in ('1', 'true', 'yes')
+    WAREHOUSE_SERVICE_RADIUS_KM = 50  # orders further from every warehouse are rejected
+    REHOME_MIN_GAIN_KM = 1.0  # a given warehouse is kept unless another is this much closer
+    WAREHOUSE_INDEX_TTL = 300  # seconds before the in-memory warehouse index is reloaded
+    
+    # Tiled allocation of very large warehouses: read and solved one group of tiles at a time
+    TILED_ALLOCATION_MIN_ORDERS = int(os.getenv('TILED_ALLOCATION_MIN_ORDERS', 10000))  # pending orders, 0 disables
+    TILE_KM = 2.0  # side of a grid tile
+    TILE_MAX_ORDERS = 2000  # neighbouring tiles are grouped up to this many orders, the unit solved at once
+    TILE_WORKERS = int(os.getenv('TILE_WORKERS', 1))  # processes solving tile groups in parallel
+    TILE_STITCH_SHARE = 0.25  # share of a tile group's search budget spent stitching it to the previous one
+    
+    # Bulk order ingestion
+    INGEST_CHUNK_SIZE = 1000  # orders per insert_many call
+    INGEST_MAX_ERRORS = 1000  # per-row errors kept in one response
+    
+    # API responses: text bodies of this size or more are brotli- (when installed) or gzip-compressed
+    COMPRESS_RESPONSES = os.getenv('COMPRESS_RESPONSES', 'true').lower() in ('1', 'true', 'yes')
+    COMPRESS_MIN_BYTES = 1024  # smaller bodies gain little over the header overhead
+    GZIP_LEVEL = 6
+    BROTLI_QUALITY = 5  # 11 is for static files; 4-6 is fast enough per response
+    
+    # Concurrent allocation runs
+    ALLOCATION_RUN_LEASE_SECONDS = 300  # a run not checkpointed for this long can be taken over
+    COMMIT_MAX_RETRIES = 2  # re-plans of a warehouse after its orders were taken by another run
+    
+    # Distributed allocation: warehouse tasks in a MongoDB queue, solved by worker processes
+    DISTRIBUTED_ALLOCATION = os.getenv('DISTRIBUTED_ALLOCATION', 'false').lower() in ('1', 'true', 'yes')
+    TASK_LEASE_SECONDS = 120  # a task whose worker stops heartbeating is reclaimed after this long
+    TASK_HEARTBEAT_SECONDS = 20
+    TASK_MAX_ATTEMPTS = 3  # claims of one task before it is marked failed
+    TASK_POLL_SECONDS = 2  # idle workers look for new tasks this often
+    
+    # Nightly archival of finished days into monthly archive collections
+    ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    ARCHIVE_RETAIN_DAYS = 1  # days of assignments, today included, kept in the hot collections
+    ARCHIVE_BATCH_SIZE = 500  # assignments moved per batch
+    
+    # Scheduled jobs run in the one process holding the scheduler lease
+    SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    LEADER_LEASE_SECONDS = 30  # a leader that stops renewing is replaced after this long
+    LEADER_RENEW_SECONDS = 10  # how often every process renews or competes for the lease
     
     # Payment tiers
     MIN_DAILY_EARNING = 50  # rupees (reduced from 500 for demo)
@@ -1,10 +1,43 @@
-from pymongo import MongoClient
+import threading
 from config import Config
 
 class Database:
+    """MongoDB handle whose client is created on first use.
+    
+    Importing this module opens nothing, so scripts and processes that never
+    query the database do not start a client (or wait for its threads to
+    stop on exit).
+    """
+    
     def __init__(self):
-        self.client = MongoClient(Config.MONGODB_URI)
-        self.db = self.client[Config.DB_NAME]
+        self._client = None
+        self._db = None
+        self._lock = threading.Lock()
+    
+    @property
+    def client(self):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    from pymongo import MongoClient
+                    client = MongoClient(Config.MONGODB_URI)
+                    self._db = client[Config.DB_NAME]
+                    self._client = client
+        return self._client
+    
+    @property
+    def db(self):
+        if self._db is None:
+            self.client
+        return self._db
+    
+    def close(self):
+        """Close the client; the next query creates a new one"""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+            self._client = None
+            self._db = None
     
     def get_collection(self, collection_name):
         return self.db[collection_name]
@@ -25,6 +58,26 @@ class Database:
     @property
     def assignments(self):
         return self.db.assignments
+    
+    @property
+    def allocation_runs(self):
+        return self.db.allocation_runs
+    
+    @property
+    def allocation_tasks(self):
+        return self.db.allocation_tasks
+    
+    @property
+    def agent_daily_stats(self):
+        return self.db.agent_daily_stats
+    
+    @property
+    def warehouse_daily_stats(self):
+        return self.db.warehouse_daily_stats
+    
+    @property
+    def leases(self):
+        return self.db.leases
 
 # Global database instance
 db = Database()
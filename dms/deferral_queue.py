@@ -0,0 +1,89 @@
+from datetime import date
+from typing import List, Dict
+from utils import LocationUtils
+from config import Config
+import heapq
+
+class DeferralQueue:
+    """Heap of one warehouse's pending orders, most overdue first.
+    
+    An order's priority grows with how often it has been deferred and how
+    many days old it is, so orders that missed earlier runs are served ahead
+    of fresh ones. Within a priority level the orders closest to the
+    warehouse come first.
+    """
+    
+    def __init__(self, orders: List[Dict], warehouse: Dict, today: date):
+        distances = LocationUtils.distances_from(
+            (warehouse['latitude'], warehouse['longitude']),
+            [(order['latitude'], order['longitude']) for order in orders]
+        )
+        self._keys = {}
+        self._queued = set()
+        self._heap = []
+        for seq, (order, distance) in enumerate(zip(orders, distances)):
+            key = (-self.priority(order, today), float(distance), seq)
+            order_id = str(order['_id'])
+            self._keys[order_id] = key
+            self._queued.add(order_id)
+            self._heap.append((key, order))
+        heapq.heapify(self._heap)
+    
+    @staticmethod
+    def priority(order: Dict, today: date) -> int:
+        """Priority level from defer count plus aging since the order date"""
+        defer_count = order.get('defer_count', 0)
+        age_days = 0
+        if order.get('order_date'):
+            age_days = max((today - date.fromisoformat(order['order_date'])).days, 0)
+        return defer_count + int(age_days * Config.DEFERRAL_AGING_PER_DAY)
+    
+    def __len__(self):
+        return len(self._queued)
+    
+    def __contains__(self, order_id: str):
+        return order_id in self._queued
+    
+    def ordered(self) -> List[Dict]:
+        """All queued orders in the sequence they would be popped"""
+        result = []
+        seen = set()
+        for key, order in sorted(self._heap, key=lambda entry: entry[0]):
+            order_id = str(order['_id'])
+            if order_id in self._queued and order_id not in seen:
+                seen.add(order_id)
+                result.append(order)
+        return result
+    
+    def rank(self, order: Dict) -> tuple:
+        """Sort key of an order; lower keys are popped first"""
+        return self._keys[str(order['_id'])]
+    
+    def pop(self, count: int) -> List[Dict]:
+        """Remove and return the next count orders"""
+        popped = []
+        while self._heap and len(popped) < count:
+            _, order = heapq.heappop(self._heap)
+            order_id = str(order['_id'])
+            # Entries removed out of order are dropped lazily here
+            if order_id in self._queued:
+                self._queued.discard(order_id)
+                popped.append(order)
+        return popped
+    
+    def remove(self, orders: List[Dict]):
+        """Take specific orders out of the queue without popping"""
+        for order in orders:
+            self._queued.discard(str(order['_id']))
+    
+    def push(self, orders: List[Dict]):
+        """Return orders that were popped but not assigned to the queue"""
+        for order in orders:
+            order_id = str(order['_id'])
+            if order_id not in self._queued:
+                self._queued.add(order_id)
+                heapq.heappush(self._heap, (self._keys[order_id], order))
+    
+    def drain(self) -> List[Dict]:
+        """Remove and return everything left in the queue"""
+        return self.pop(len(self._queued))
@@ -0,0 +1,238 @@
+import atexit
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, Optional, Tuple
+from geopy.distance import geodesic
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+@lru_cache(maxsize=131072)
+def geohash_encode(latitude: float, longitude: float, precision: int) -> str:
+    """Encode a coordinate as a geohash cell of the given length"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    cell = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(cell) < precision:
+        value_range, value = (lon_range, longitude) if even else (lat_range, latitude)
+        mid = (value_range[0] + value_range[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            value_range[0] = mid
+        else:
+            bits = bits << 1
+            value_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            cell.append(GEOHASH_ALPHABET[bits])
+            bits = 0
+            bit_count = 0
+    return ''.join(cell)
+
+@lru_cache(maxsize=131072)
+def geohash_center(cell: str) -> Tuple[float, float]:
+    """Center coordinate of a geohash cell"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in cell:
+        bits = GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            value_range = lon_range if even else lat_range
+            mid = (value_range[0] + value_range[1]) / 2
+            if (bits >> shift) & 1:
+                value_range[0] = mid
+            else:
+                value_range[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+def cell_diagonal_km(precision: int) -> float:
+    """Upper bound on the diagonal of a geohash cell of the given length"""
+    lat_bits = 5 * precision // 2
+    lon_bits = 5 * precision - lat_bits
+    km_per_degree = 111.32  # at the equator, where cells are widest
+    return km_per_degree * ((180 / 2 ** lat_bits) ** 2 + (360 / 2 ** lon_bits) ** 2) ** 0.5
+
+class DistanceCache:
+    """Persistent cell-pair distance cache backed by a local SQLite file.
+    
+    Coordinates are quantized to geohash cells and the distance between two
+    cells is the geodesic distance between their centers, so the result is
+    the same whether it is computed or read back. Reads go through SQLite's
+    memory-mapped I/O with an in-process dict in front; new pairs and LRU
+    timestamps are written in batches. When the table grows past max_entries
+    the least recently used pairs are evicted.
+    """
+    
+    FLUSH_THRESHOLD = 5000
+    MMAP_BYTES = 256 * 1024 * 1024
+    
+    def __init__(self, path: str, precision: int = 7, max_entries: int = 500000):
+        self.path = path
+        self.precision = precision
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._memory = {}
+        self._pending = {}
+        self._touched = set()
+        self._flush_at = self.FLUSH_THRESHOLD
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self._entries = 0
+    
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite handles must not cross a fork, so each process opens its own
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(f'PRAGMA mmap_size={self.MMAP_BYTES}')
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS distances '
+                '(pair TEXT PRIMARY KEY, km REAL NOT NULL, last_used INTEGER NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS idx_distances_last_used ON distances(last_used)')
+            self._entries = self._conn.execute('SELECT COUNT(*) FROM distances').fetchone()[0]
+            self._pid = os.getpid()
+        return self._conn
+    
+    def _pair(self, lat1: float, lon1: float, lat2: float, lon2: float) -> Optional[str]:
+        cell_a = geohash_encode(lat1, lon1, self.precision)
+        cell_b = geohash_encode(lat2, lon2, self.precision)
+        if cell_a == cell_b:
+            return None
+        return f'{cell_a}|{cell_b}' if cell_a < cell_b else f'{cell_b}|{cell_a}'
+    
+    def distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+        """Distance in km between the cells containing the two points"""
+        pair = self._pair(lat1, lon1, lat2, lon2)
+        if pair is None:
+            # Same cell: the cell size is below the cache's resolution
+            return geodesic((lat1, lon1), (lat2, lon2)).kilometers
+        
+        km = self._memory.get(pair)
+        if km is not None:
+            # Under the lock: a flush iterates and replaces _touched
+            with self._lock:
+                self.hits += 1
+                self._touched.add(pair)
+            return km
+        
+        with self._lock:
+            row = self._connection().execute(
+                'SELECT km FROM distances WHERE pair = ?', (pair,)
+            ).fetchone()
+            if row is not None:
+                km = row[0]
+                self.hits += 1
+                self._touched.add(pair)
+            else:
+                cell_a, cell_b = pair.split('|')
+                km = geodesic(geohash_center(cell_a), geohash_center(cell_b)).kilometers
+                self.misses += 1
+                self._pending[pair] = km
+            self._memory[pair] = km
+            
+            if len(self._pending) + len(self._touched) >= self._flush_at:
+                try:
+                    self._flush_locked()
+                except sqlite3.Error as e:
+                    # Kept buffered; try again once another FLUSH_THRESHOLD pairs have come in
+                    self._flush_at = len(self._pending) + len(self._touched) + self.FLUSH_THRESHOLD
+                    logger.warning(f"Distance cache flush failed, keeping {len(self._pending)} pairs buffered: {e}")
+        return km
+    
+    def flush(self):
+        """Write buffered pairs and LRU timestamps, then evict if over capacity"""
+        with self._lock:
+            self._flush_locked()
+    
+    def _flush_locked(self):
+        if not self._pending and not self._touched:
+            return
+        
+        conn = self._connection()
+        now = int(time.time())
+        entries = self._entries
+        # The buffers are only cleared once the transaction commits, so a failed write (a locked
+        # database) rolls back and leaves them for the next flush
+        with conn:
+            if self._pending:
+                # Another process may have stored some of these pairs already; only new rows count
+                before = conn.total_changes
+                conn.executemany(
+                    'INSERT OR IGNORE INTO distances (pair, km, last_used) VALUES (?, ?, ?)',
+                    [(pair, km, now) for pair, km in self._pending.items()]
+                )
+                entries += conn.total_changes - before
+            if self._touched:
+                conn.executemany(
+                    'UPDATE distances SET last_used = ? WHERE pair = ?',
+                    [(now, pair) for pair in self._touched]
+                )
+            
+            evicted = 0
+            if entries > self.max_entries:
+                # Evict down to 90% so eviction does not run on every flush
+                evicted = entries - int(self.max_entries * 0.9)
+                conn.execute(
+                    'DELETE FROM distances WHERE pair IN '
+                    '(SELECT pair FROM distances ORDER BY last_used LIMIT ?)', (evicted,)
+                )
+                entries = conn.execute('SELECT COUNT(*) FROM distances').fetchone()[0]
+        
+        self._entries = entries
+        self._pending = {}
+        self._touched = set()
+        self._flush_at = self.FLUSH_THRESHOLD
+        if evicted:
+            logger.info(f"Distance cache evicted {evicted} least recently used pairs")
+        if len(self._memory) > self.max_entries:
+            self._memory.clear()
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+            'entries': self._entries + len(self._pending),
+            'precision': self.precision
+        }
+    
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+    
+    def close(self):
+        self.flush()
+        if self._conn is not None and self._pid == os.getpid():
+            self._conn.close()
+        self._conn = None
+
+_distance_cache = None
+
+def get_distance_cache() -> Optional[DistanceCache]:
+    """Shared cache instance, or None when DISTANCE_CACHE_PATH is not set"""
+    global _distance_cache
+    if _distance_cache is None and Config.DISTANCE_CACHE_PATH:
+        _distance_cache = DistanceCache(
+            Config.DISTANCE_CACHE_PATH,
+            precision=Config.DISTANCE_CACHE_PRECISION,
+            max_entries=Config.DISTANCE_CACHE_MAX_ENTRIES
+        )
+        atexit.register(_distance_cache.close)
+    return _distance_cache
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+"""
+Distributed allocation through a task queue in MongoDB.
+
+The coordinator splits the checked-in agents' warehouses into tasks and
+queues them in the allocation_tasks collection. Any number of worker
+processes, on any machine with access to the database, claim tasks under
+a lease, run the allocation for the task's warehouses and report the
+result. A task whose worker dies is reclaimed once its lease expires.
+    
+    python distributed_allocation.py worker --processes 4
+    python distributed_allocation.py enqueue --wait
+    python distributed_allocation.py status <batch_id>
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import date
+from typing import Dict, List
+from spatial_index import GridIndex
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fields of a run_allocation result kept on the task
+RESULT_FIELDS = ('status', 'message', 'run_id', 'resumed', 'runtime_seconds', 'total_assigned',
+                 'total_deferred', 'total_rebalanced', 'commit_conflicts', 'warm_start_matched')
+TOTAL_FIELDS = ('total_assigned', 'total_deferred', 'total_rebalanced', 'commit_conflicts')
+
+class AllocationCoordinator:
+    """Queues a day's allocation as warehouse tasks and follows their progress"""
+    
+    @staticmethod
+    def cluster(warehouses: Dict[str, Dict], radius_km: float) -> List[List[str]]:
+        """Group warehouses that are within radius_km of each other, directly or in a chain.
+        
+        Rebalancing only moves orders between warehouses this close, so each
+        group can be allocated on its own without losing any rebalancing.
+        """
+        parent = {warehouse_id: warehouse_id for warehouse_id in warehouses}
+        
+        def find(warehouse_id):
+            while parent[warehouse_id] != warehouse_id:
+                parent[warehouse_id] = parent[parent[warehouse_id]]
+                warehouse_id = parent[warehouse_id]
+            return warehouse_id
+        
+        if radius_km > 0:
+            index = GridIndex.build([(warehouse['latitude'], warehouse['longitude'], warehouse_id)
+                                     for warehouse_id, warehouse in warehouses.items()], cell_km=radius_km)
+            for warehouse_id, warehouse in warehouses.items():
+                for _, other_id in index.within(warehouse['latitude'], warehouse['longitude'], radius_km):
+                    parent[find(other_id)] = find(warehouse_id)
+        
+        groups = {}
+        for warehouse_id in warehouses:
+            groups.setdefault(find(warehouse_id), []).append(warehouse_id)
+        # Largest groups first, so the longest tasks start earliest
+        return sorted((sorted(group) for group in groups.values()), key=len, reverse=True)
+    
+    def enqueue(self, task_date: date = None, warm_start: bool = None, time_budget: float = None) -> Dict:
+        """Queue one task per group of warehouses with checked-in agents"""
+        from models import Agent, Warehouse, AllocationTask
+        
+        task_date = task_date or date.today()
+        warehouse_ids = {agent['warehouse_id'] for agent in Agent.get_checked_in_agents()}
+        warehouses = {}
+        for warehouse_id in warehouse_ids:
+            warehouse = Warehouse.get_by_id(warehouse_id)
+            if warehouse:
+                warehouses[warehouse_id] = warehouse
+        
+        expired = AllocationTask.expire_before(task_date).modified_count
+        if expired:
+            logger.warning(f"Expired {expired} unfinished allocation tasks of earlier days")
+        
+        radius = Config.REBALANCE_RADIUS_KM if Config.REBALANCE_ENABLED else 0
+        groups = self.cluster(warehouses, radius)
+        batch_id = uuid.uuid4().hex
+        AllocationTask.enqueue(batch_id, task_date, groups, {'warm_start': warm_start, 'time_budget': time_budget})
+        logger.info(f"Queued allocation batch {batch_id}: {len(groups)} tasks over {len(warehouses)} warehouses")
+        return {'batch_id': batch_id, 'date': task_date.isoformat(), 'tasks': len(groups),
+                'warehouses': len(warehouses)}
+    
+    def status(self, batch_id: str) -> Dict:
+        """Task counts by status and the totals of the finished tasks"""
+        from models import AllocationTask
+        
+        AllocationTask.fail_abandoned(Config.TASK_MAX_ATTEMPTS)
+        tasks = AllocationTask.get_batch(batch_id)
+        counts = {'queued': 0, 'running': 0, 'done': 0, 'failed': 0}
+        totals = {field: 0 for field in TOTAL_FIELDS}
+        failures = []
+        for task in tasks:
+            counts[task['status']] = counts.get(task['status'], 0) + 1
+            if task['status'] == 'done':
+                for field in TOTAL_FIELDS:
+                    totals[field] += task['result'].get(field, 0)
+            elif task['status'] == 'failed':
+                failures.append({'warehouse_ids': task['warehouse_ids'], 'error': task.get('error')})
+        return {
+            'batch_id': batch_id,
+            'tasks': len(tasks),
+            'finished': bool(tasks) and counts['queued'] + counts['running'] == 0,
+            **counts,
+            **totals,
+            'failures': failures
+        }
+    
+    def wait(self, batch_id: str, timeout: float = None) -> Dict:
+        """Poll until every task is done or failed (or the timeout passes)"""
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            status = self.status(batch_id)
+            if status['finished'] or (deadline and time.monotonic() >= deadline):
+                return status
+            time.sleep(Config.TASK_POLL_SECONDS)
+
+class AllocationWorker:
+    """Claims queued allocation tasks and runs them until stopped"""
+    
+    def __init__(self, worker_id: str = None):
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+    
+    def run(self, exit_when_idle: bool = False, max_tasks: int = None) -> int:
+        """Process tasks; returns how many were processed"""
+        from models import AllocationTask
+        
+        processed = 0
+        while max_tasks is None or processed < max_tasks:
+            # Only today's tasks; the date is read each time so a worker running past midnight moves on
+            task = AllocationTask.claim(self.worker_id, Config.TASK_LEASE_SECONDS, Config.TASK_MAX_ATTEMPTS,
+                                        date.today())
+            if task is None:
+                if exit_when_idle:
+                    break
+                time.sleep(Config.TASK_POLL_SECONDS)
+                continue
+            self.process(task)
+            processed += 1
+        return processed
+    
+    def process(self, task: Dict):
+        """Run one task's allocation while heartbeating its lease, then report the outcome"""
+        from models import AllocationTask
+        from allocation_engine import OrderAllocationEngine
+        
+        logger.info(f"Worker {self.worker_id} took task {task['_id']} "
+                    f"(warehouses {', '.join(task['warehouse_ids'])}, attempt {task['attempts']})")
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(task['_id'], stop), daemon=True)
+        heartbeat.start()
+        try:
+            engine = OrderAllocationEngine(today=date.fromisoformat(task['date']))
+            options = task.get('options') or {}
+            # A retried task's previous worker died holding the run; resume it rather than start another
+            result = engine.run_allocation(warm_start=options.get('warm_start'),
+                                           time_budget=options.get('time_budget'),
+                                           warehouse_ids=task['warehouse_ids'],
+                                           take_over=task['attempts'] > 1)
+        except Exception as e:
+            logger.error(f"Task {task['_id']} failed: {str(e)}")
+            AllocationTask.fail(task['_id'], self.worker_id, str(e), Config.TASK_MAX_ATTEMPTS)
+            return
+        finally:
+            stop.set()
+            heartbeat.join()
+        
+        if not AllocationTask.complete(task['_id'], self.worker_id,
+                                       {field: result[field] for field in RESULT_FIELDS if field in result}):
+            # Its lease ran out and another worker reclaimed it; the commits were still safe
+            logger.warning(f"Task {task['_id']} was reclaimed before worker {self.worker_id} finished it")
+    
+    def _heartbeat(self, task_id, stop: threading.Event):
+        from models import AllocationTask
+        while not stop.wait(Config.TASK_HEARTBEAT_SECONDS):
+            try:
+                if not AllocationTask.heartbeat(task_id, self.worker_id, Config.TASK_LEASE_SECONDS):
+                    logger.warning(f"Lost the lease on task {task_id}")
+                    return
+            except Exception as e:
+                logger.error(f"Error heartbeating task {task_id}: {str(e)}")
+
+def _worker_process(exit_when_idle: bool):
+    logging.basicConfig(level=logging.INFO)
+    AllocationWorker().run(exit_when_idle=exit_when_idle)
+
+def main():
+    parser = argparse.ArgumentParser(description='Distributed allocation through a MongoDB task queue')
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    worker = commands.add_parser('worker', help='Claim and run allocation tasks')
+    worker.add_argument('--processes', type=int, default=1, help='Worker processes on this machine')
+    worker.add_argument('--exit-when-idle', action='store_true', help='Stop once the queue is empty')
+    
+    enqueue = commands.add_parser('enqueue', help="Queue today's allocation as warehouse tasks")
+    enqueue.add_argument('--warm-start', action='store_true', help="Seed agents from their previous day's routes")
+    enqueue.add_argument('--time-budget', type=float, default=None, help='Seconds per task')
+    enqueue.add_argument('--wait', action='store_true', help='Wait for the workers and print the totals')
+    
+    status = commands.add_parser('status', help='Progress of a queued batch')
+    status.add_argument('batch_id')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    coordinator = AllocationCoordinator()
+    if args.command == 'worker':
+        if args.processes == 1:
+            _worker_process(args.exit_when_idle)
+            return
+        # Fresh interpreters, so no process inherits another's MongoDB connections
+        context = multiprocessing.get_context('spawn')
+        processes = [context.Process(target=_worker_process, args=(args.exit_when_idle,))
+                     for _ in range(args.processes)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+    elif args.command == 'enqueue':
+        batch = coordinator.enqueue(warm_start=args.warm_start or None, time_budget=args.time_budget)
+        print(json.dumps(batch, indent=2))
+        if args.wait:
+            print(json.dumps(coordinator.wait(batch['batch_id']), indent=2))
+    else:
+        print(json.dumps(coordinator.status(args.batch_id), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,21 @@
+# Production serving: gunicorn -c gunicorn.conf.py 'app:create_app()'
+#
+# Every worker builds its own app (the app is not preloaded, so MongoDB
+# clients are created after the fork) and starts the scheduler; the
+# scheduler lease in MongoDB lets only one of them run the daily jobs.
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = int(os.getenv('GUNICORN_THREADS', 2))
+# Allocation and simulation requests can run for minutes
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 600))
+preload_app = False
+accesslog = '-'
+
+def worker_exit(server, worker):
+    # Hand the scheduler lease over at once instead of waiting for it to expire
+    from scheduler import scheduler
+    if scheduler.running:
+        scheduler.stop()
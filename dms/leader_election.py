@@ -0,0 +1,118 @@
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+class LeaderLease:
+    """Leader election through one lease document in the leases collection.
+    
+    Every process competes for the lease named name; the holder renews it
+    well within LEADER_LEASE_SECONDS. If the holder dies its lease expires
+    and the next process to call acquire() takes over. Scheduled jobs are
+    also recorded per day in the lease document when they start and when
+    they finish, so a job cannot run twice on the same day even across a
+    change of leader, and one its leader abandoned half way is run again.
+    """
+    
+    def __init__(self, name: str, lease_seconds: float = None):
+        self.name = name
+        self.lease_seconds = lease_seconds or Config.LEADER_LEASE_SECONDS
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._expires_at = None
+        self.runs = {}
+    
+    @property
+    def is_leader(self) -> bool:
+        return self._expires_at is not None and datetime.utcnow() < self._expires_at
+    
+    def acquire(self) -> bool:
+        """Take the lease if it is free or expired, or renew it if held; True when leader"""
+        from database import db
+        from pymongo.errors import DuplicateKeyError
+        
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.lease_seconds)
+        was_leader = self.is_leader
+        try:
+            lease = db.leases.find_one_and_update(
+                {'_id': self.name, '$or': [{'holder': self.holder}, {'expires_at': {'$lt': now}}]},
+                {'$set': {'holder': self.holder, 'expires_at': expires_at, 'renewed_at': now}},
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # The document exists and someone else holds an unexpired lease
+            lease = False
+        
+        if lease is False:
+            if was_leader:
+                logger.warning(f"Lost the {self.name} lease")
+            self._expires_at = None
+            return False
+        
+        self._expires_at = expires_at
+        self.runs = (lease or {}).get('jobs') or {}
+        if not was_leader:
+            logger.info(f"Acquired the {self.name} lease as {self.holder}")
+        return True
+    
+    def holder_expires_at(self):
+        """When the lease of whoever holds it runs out (naive UTC), None if nobody ever took it"""
+        from database import db
+        lease = db.leases.find_one({'_id': self.name}, {'expires_at': 1})
+        return lease.get('expires_at') if lease else None
+    
+    def release(self):
+        """Give the lease up so another process can take over at once"""
+        from database import db
+        if self._expires_at is None:
+            return
+        db.leases.update_one({'_id': self.name, 'holder': self.holder},
+                             {'$set': {'expires_at': datetime.utcnow()}})
+        self._expires_at = None
+        logger.info(f"Released the {self.name} lease")
+    
+    def claim_run(self, job_id: str, run_key: str) -> bool:
+        """Record that the leader starts job_id for run_key (e.g. the date); False if it already ran.
+        
+        A run of another holder that started over a lease period ago and
+        never finished was abandoned (its leader died or lost the lease half
+        way) and can be claimed again.
+        """
+        from database import db
+        now = datetime.utcnow()
+        job = f'jobs.{job_id}'
+        result = db.leases.update_one(
+            {
+                '_id': self.name,
+                'holder': self.holder,
+                'expires_at': {'$gt': now},
+                '$or': [
+                    {f'{job}.key': {'$ne': run_key}},
+                    {f'{job}.finished_at': None, f'{job}.holder': {'$ne': self.holder},
+                     f'{job}.started_at': {'$lt': now - timedelta(seconds=self.lease_seconds)}}
+                ]
+            },
+            {'$set': {job: {'key': run_key, 'holder': self.holder, 'started_at': now, 'finished_at': None}}}
+        )
+        return result.modified_count == 1
+    
+    def finish_run(self, job_id: str, run_key: str):
+        """Record that this process's run of job_id for run_key finished"""
+        from database import db
+        job = f'jobs.{job_id}'
+        db.leases.update_one(
+            {'_id': self.name, f'{job}.key': run_key, f'{job}.holder': self.holder},
+            {'$set': {f'{job}.finished_at': datetime.utcnow()}}
+        )
+    
+    def abandoned_runs(self, run_key: str):
+        """Jobs started for run_key by another holder over a lease period ago and never finished,
+        as of the last acquire()"""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+        return [job_id for job_id, run in self.runs.items()
+                if run.get('key') == run_key and run.get('finished_at') is None
+                and run.get('holder') != self.holder and run.get('started_at') and run['started_at'] < cutoff]
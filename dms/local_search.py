@@ -0,0 +1,336 @@
+import math
+import time
+from typing import Callable, List, Dict, Tuple
+import numpy as np
+from utils import LocationUtils, AssignmentUtils
+from capacity_planner import CapacityPlanner
+from time_windows import TimeWindows, has_windows
+import trips
+from config import Config
+import routing
+import logging
+
+logger = logging.getLogger(__name__)
+
+class InterRouteSearch:
+    """Moves stops between the routes of one warehouse to lower total cost.
+    
+    Works on a distance matrix whose index 0 is the warehouse. Three moves
+    are tried for every stop against its nearest stops on other routes:
+    relocate (move the stop next to its neighbour), swap (exchange the two
+    stops) and 2-opt* (cut both routes and exchange their tails). Each move
+    is scored by delta evaluation from prefix sums, so nothing is re-routed
+    to evaluate it. Cost is route km at LOCAL_SEARCH_RUPEES_PER_KM plus the
+    tier payout, so moves can push an agent across a tier threshold when
+    that pays for itself. Every route must stay within the daily limits,
+    and with windows every stop within its delivery window, checked in
+    O(1) against each route's forward time slack.
+    
+    A route longer than its vehicle's capacity is driven as several trips;
+    its length is then that of the best split into trips (trips.split_trips),
+    worked out only for moves whose path length, a lower bound of it, passes.
+    Such a move's windows are replayed with its reloads, since the O(1)
+    check does without them.
+    """
+    
+    EPSILON = 1e-9
+    
+    def __init__(self, matrix: np.ndarray, routes: List[List[int]], neighbours: int = None,
+                 windows: TimeWindows = None, capacities: List[int] = None):
+        self.matrix = matrix
+        self.routes = [list(route) for route in routes]
+        self.windows = windows
+        self.capacities = list(capacities) if capacities is not None else [None] * len(self.routes)
+        self.payout = CapacityPlanner.payout_curve(
+            max(Config.MAX_ORDERS_PER_AGENT, max(len(route) for route in routes)) + 1
+        )
+        self.max_km = min(Config.MAX_TRAVEL_DISTANCE_PER_DAY,
+                          Config.MAX_WORKING_HOURS_PER_DAY * 60 / Config.MINUTES_PER_KM)
+        self.reload_km = Config.RELOAD_MINUTES / Config.MINUTES_PER_KM  # km that could be driven while reloading
+        self.moves = {'relocate': 0, 'swap': 0, '2opt*': 0}
+        
+        stops = np.array([stop for route in self.routes for stop in route])
+        k = min(neighbours or Config.LOCAL_SEARCH_NEIGHBOURS, len(stops) - 1)
+        # Nearest stops by the distance in either direction
+        sub = matrix[np.ix_(stops, stops)]
+        sub = np.minimum(sub, sub.T)
+        np.fill_diagonal(sub, np.inf)
+        nearest = np.argpartition(sub, k - 1, axis=1)[:, :k] if k > 0 else np.zeros((len(stops), 0), dtype=int)
+        self.neighbours = {int(stop): [int(stops[j]) for j in sorted(row, key=lambda j: sub[i, j])]
+                           for i, (stop, row) in enumerate(zip(stops, nearest))}
+        
+        self.where = {}
+        self.prefix = [None] * len(self.routes)
+        self.lengths = [0.0] * len(self.routes)
+        self.schedules = [None] * len(self.routes)
+        for r in range(len(self.routes)):
+            self._refresh(r)
+    
+    def _refresh(self, r: int):
+        """Recompute positions, prefix lengths and the length with reloads of route r"""
+        route = self.routes[r]
+        for i, stop in enumerate(route):
+            self.where[stop] = (r, i)
+        legs = self.matrix[[routing.DEPOT] + route[:-1], route] if route else np.zeros(0)
+        self.prefix[r] = np.cumsum(legs)
+        self.lengths[r], _ = self._measure(r, route, self.path_length(r))
+        if self.windows is not None:
+            self.schedules[r] = self.windows.schedule(route)
+    
+    def _measure(self, r: int, route: List[int], path_length: float) -> Tuple[float, List[int]]:
+        """(km, reload positions) of route driven by route r's vehicle"""
+        if not trips.needs_reloads(len(route), self.capacities[r]):
+            return path_length, []
+        reloads, length = trips.split_trips(self.matrix, route, self.capacities[r])
+        return length, reloads
+    
+    def path_length(self, r: int) -> float:
+        """Length of route r as one path, which the move deltas work on"""
+        return float(self.prefix[r][-1]) if self.routes[r] else 0.0
+    
+    def length(self, r: int) -> float:
+        return self.lengths[r]
+    
+    def cost(self, length: float, count: int) -> float:
+        return Config.LOCAL_SEARCH_RUPEES_PER_KM * length + self.payout[count]
+    
+    def feasible(self, length: float, count: int, reloads: int = 0) -> bool:
+        return (length <= self.max_km and
+                length + reloads * self.reload_km <= Config.MAX_WORKING_HOURS_PER_DAY * 60 / Config.MINUTES_PER_KM and
+                Config.MIN_ORDERS_PER_AGENT <= count <= Config.MAX_ORDERS_PER_AGENT and
+                self.payout[count] >= Config.MIN_DAILY_EARNING)
+    
+    def total_cost(self) -> float:
+        return sum(self.cost(self.length(r), len(route)) for r, route in enumerate(self.routes))
+    
+    def run(self, time_budget: float, iterations: int = 0) -> List[List[int]]:
+        """Apply improving moves until none is left or the budget runs out.
+        
+        With iterations, the budget is that many stops tried instead of
+        time_budget seconds, so the same routes always come out.
+        """
+        deadline = math.inf if iterations else time.perf_counter() + time_budget
+        tries = 0
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            for stop in list(self.where):
+                if time.perf_counter() >= deadline or (iterations and tries >= iterations):
+                    return self.routes
+                tries += 1
+                if self._improve(stop):
+                    improved = True
+        return self.routes
+    
+    def _improve(self, u: int) -> bool:
+        """Apply the first improving move between u and one of its neighbours"""
+        for v in self.neighbours[u]:
+            r1, i = self.where[u]
+            r2, j = self.where[v]
+            if r1 == r2:
+                continue
+            if (self._try_relocate(r1, i, r2, j + 1) or self._try_relocate(r1, i, r2, j) or
+                    self._try_swap(r1, i, r2, j) or self._try_two_opt_star(r1, i, r2, j)):
+                return True
+        return False
+    
+    def _d(self, a, b) -> float:
+        return 0.0 if b is None else float(self.matrix[a, b])
+    
+    def _around(self, r: int, i: int):
+        route = self.routes[r]
+        previous = route[i - 1] if i > 0 else routing.DEPOT
+        following = route[i + 1] if i + 1 < len(route) else None
+        return previous, following
+    
+    def _fits(self, head: int, i: int, stop, tail: int, j: int) -> bool:
+        """Whether routes[head][:i + 1], then stop, then routes[tail][j:] keeps every window"""
+        return self.windows is None or self.windows.fits(self.routes[head], self.schedules[head], i, stop,
+                                                         self.routes[tail], self.schedules[tail], j)
+    
+    def _apply(self, move: str, r1: int, r2: int, route1: List[int], route2: List[int]):
+        self.routes[r1] = route1
+        self.routes[r2] = route2
+        self._refresh(r1)
+        self._refresh(r2)
+        self.moves[move] += 1
+    
+    def _accept(self, r1: int, length1: float, count1: int, r2: int, length2: float, count2: int,
+                candidates: Callable[[], Tuple[List[int], List[int]]]) -> bool:
+        """Whether the routes candidates() builds, whose path lengths are given, lower the cost.
+        
+        Reloads only add km, so a move that fails on path lengths is
+        rejected before its routes are built and split into trips.
+        """
+        if not (self.feasible(length1, count1) and self.feasible(length2, count2)):
+            return False
+        before = (self.cost(self.length(r1), len(self.routes[r1])) +
+                  self.cost(self.length(r2), len(self.routes[r2])))
+        if self.cost(length1, count1) + self.cost(length2, count2) >= before - self.EPSILON:
+            return False
+        if not (trips.needs_reloads(count1, self.capacities[r1]) or trips.needs_reloads(count2, self.capacities[r2])):
+            return True
+        
+        route1, route2 = candidates()
+        length1, reloads1 = self._measure(r1, route1, length1)
+        length2, reloads2 = self._measure(r2, route2, length2)
+        return (self.feasible(length1, count1, len(reloads1)) and self.feasible(length2, count2, len(reloads2)) and
+                self.cost(length1, count1) + self.cost(length2, count2) < before - self.EPSILON and
+                self._keeps_windows(route1, reloads1) and self._keeps_windows(route2, reloads2))
+    
+    def _keeps_windows(self, route: List[int], reloads: List[int]) -> bool:
+        return self.windows is None or not reloads or self.windows.feasible(route, reloads)
+    
+    def _try_relocate(self, r1: int, i: int, r2: int, position: int) -> bool:
+        """Move the stop at r1[i] to index position of r2"""
+        route1, route2 = self.routes[r1], self.routes[r2]
+        u = route1[i]
+        previous, following = self._around(r1, i)
+        removed = self.path_length(r1) - self._d(previous, u) - self._d(u, following) + self._d(previous, following)
+        
+        before = route2[position - 1] if position > 0 else routing.DEPOT
+        after = route2[position] if position < len(route2) else None
+        inserted = self.path_length(r2) + self._d(before, u) + self._d(u, after) - self._d(before, after)
+        
+        def moved():
+            return route1[:i] + route1[i + 1:], route2[:position] + [u] + route2[position:]
+        
+        if not self._accept(r1, removed, len(route1) - 1, r2, inserted, len(route2) + 1, moved):
+            return False
+        if not (self._fits(r1, i - 1, None, r1, i + 1) and self._fits(r2, position - 1, u, r2, position)):
+            return False
+        self._apply('relocate', r1, r2, *moved())
+        return True
+    
+    def _try_swap(self, r1: int, i: int, r2: int, j: int) -> bool:
+        """Exchange r1[i] and r2[j]"""
+        route1, route2 = self.routes[r1], self.routes[r2]
+        u, v = route1[i], route2[j]
+        p1, f1 = self._around(r1, i)
+        p2, f2 = self._around(r2, j)
+        length1 = self.path_length(r1) - self._d(p1, u) - self._d(u, f1) + self._d(p1, v) + self._d(v, f1)
+        length2 = self.path_length(r2) - self._d(p2, v) - self._d(v, f2) + self._d(p2, u) + self._d(u, f2)
+        
+        def swapped():
+            return route1[:i] + [v] + route1[i + 1:], route2[:j] + [u] + route2[j + 1:]
+        
+        if not self._accept(r1, length1, len(route1), r2, length2, len(route2), swapped):
+            return False
+        if not (self._fits(r1, i - 1, v, r1, i + 1) and self._fits(r2, j - 1, u, r2, j + 1)):
+            return False
+        self._apply('swap', r1, r2, *swapped())
+        return True
+    
+    def _try_two_opt_star(self, r1: int, i: int, r2: int, j: int) -> bool:
+        """Cut after r1[i] and before r2[j], then exchange the tails"""
+        route1, route2 = self.routes[r1], self.routes[r2]
+        u, v = route1[i], route2[j]
+        prefix1, prefix2 = self.prefix[r1], self.prefix[r2]
+        
+        # r1 keeps its head up to u, then drives to v and on through r2's tail
+        length1 = float(prefix1[i]) + self._d(u, v) + self.path_length(r2) - float(prefix2[j])
+        # r2 keeps its head before v, then continues with r1's tail after u
+        head2 = route2[j - 1] if j > 0 else routing.DEPOT
+        length2 = float(prefix2[j - 1]) if j > 0 else 0.0
+        if i + 1 < len(route1):
+            length2 += self._d(head2, route1[i + 1]) + self.path_length(r1) - float(prefix1[i + 1])
+        
+        def exchanged():
+            return route1[:i + 1] + route2[j:], route2[:j] + route1[i + 1:]
+        
+        count1 = i + 1 + len(route2) - j
+        count2 = j + len(route1) - i - 1
+        if not self._accept(r1, length1, count1, r2, length2, count2, exchanged):
+            return False
+        if not (self._fits(r1, i, None, r2, j) and self._fits(r2, j - 1, None, r1, i + 1)):
+            return False
+        self._apply('2opt*', r1, r2, *exchanged())
+        return True
+
+def improve_routes(warehouse: Dict, routes: List[List[Dict]], time_budget: float = None,
+                   capacities: List[int] = None) -> Tuple[List[List[Dict]], List[Dict], Dict]:
+    """Run the inter-route search over one warehouse's planned order sets.
+    
+    Returns the order sets in driving order, their route metrics and a
+    report of the improvement measured on the matrix. If a searched route
+    fails the route check (the matrix and the route distance can disagree
+    right at a limit), the original order sets come back with metrics of
+    None. capacities are the vehicle capacities of the routes' agents, None
+    where unlimited. With windows, an order set's own order is the starting
+    sequence when it keeps every window.
+    """
+    time_budget = Config.LOCAL_SEARCH_TIME_BUDGET if time_budget is None else time_budget
+    started = time.perf_counter()
+    
+    orders = [order for route in routes for order in route]
+    points = [(warehouse['latitude'], warehouse['longitude'])] + \
+             [(order['latitude'], order['longitude']) for order in orders]
+    matrix = LocationUtils.distance_matrix(points)
+    
+    windows = TimeWindows.for_orders(matrix, orders) if has_windows(orders) else None
+    capacities = capacities or [None] * len(routes)
+    
+    def km(sequence: List[int], capacity: int) -> float:
+        return trips.split_trips(matrix, sequence, capacity)[1]
+    
+    def keeps_windows(sequence: List[int], capacity: int) -> bool:
+        return windows.feasible(sequence, trips.split_trips(matrix, sequence, capacity)[0])
+    
+    # Matrix index i + 1 is orders[i]
+    sequences = []
+    offset = 1
+    for route, capacity in zip(routes, capacities):
+        stops = list(range(offset, offset + len(route)))
+        if windows is not None:
+            if keeps_windows(stops, capacity):
+                # The order set's own visiting order already keeps every window
+                sequences.append(stops)
+            else:
+                sequence, unplaced = windows.sequence(stops)
+                sequences.append(sequence + unplaced)
+        else:
+            sequences.append(routing.nearest_neighbour(matrix, stops))
+        offset += len(route)
+    
+    search = InterRouteSearch(matrix, sequences, windows=windows, capacities=capacities)
+    cost_before = search.total_cost()
+    distance_before = sum(search.length(r) for r in range(len(sequences)))
+    sequences = search.run(time_budget, Config.LOCAL_SEARCH_ITERATIONS)
+    
+    tidied = []
+    for sequence, capacity in zip(sequences, capacities):
+        feasible = None
+        if windows is not None:
+            feasible = lambda candidate, capacity=capacity: keeps_windows(candidate, capacity)
+        shorter = routing.two_opt(matrix, sequence, feasible=feasible)
+        # A shorter path is not always shorter once split into trips
+        tidied.append(shorter if km(shorter, capacity) <= km(sequence, capacity) else sequence)
+    sequences = tidied
+    
+    improved_routes = []
+    improved_metrics = []
+    for sequence, capacity in zip(sequences, capacities):
+        route_orders = [orders[stop - 1] for stop in sequence]
+        route = [points[0]] + [points[stop] for stop in sequence]
+        can_accept, metrics = AssignmentUtils.check_route_constraints(warehouse, route_orders, route, capacity)
+        if not can_accept:
+            # The matrix and the route distance disagree near a limit
+            improved_routes = None
+            break
+        improved_routes.append(route_orders)
+        improved_metrics.append(metrics)
+    
+    distance_after = [km(sequence, capacity) for sequence, capacity in zip(sequences, capacities)]
+    report = {
+        'moves': search.moves,
+        'distance_before': round(distance_before, 2),
+        'distance_after': round(sum(distance_after), 2),
+        'cost_before': round(cost_before, 2),
+        'cost_after': round(sum(search.cost(length, len(sequence))
+                                for length, sequence in zip(distance_after, sequences)), 2),
+        'seconds': round(time.perf_counter() - started, 3),
+        'applied': improved_routes is not None
+    }
+    if improved_routes is None:
+        return routes, None, report
+    return improved_routes, improved_metrics, report
@@ -1,5 +1,5 @@
-from datetime import datetime, date
-from typing import List, Dict, Optional
+from datetime import datetime, date, timedelta
+from typing import List, Dict, Optional, Tuple
 from database import db
 from bson import ObjectId
 
@@ -22,7 +22,10 @@ class Warehouse:
     
     @classmethod
     def create(cls, warehouse_data):
-        return db.warehouses.insert_one(warehouse_data)
+        from warehouse_index import warehouse_index
+        result = db.warehouses.insert_one(warehouse_data)
+        warehouse_index.invalidate()
+        return result
     
     @classmethod
     def get_all(cls):
@@ -33,10 +36,13 @@ class Warehouse:
         return db.warehouses.find_one({'_id': ObjectId(warehouse_id)})
 
 class Agent:
-    def __init__(self, name: str, warehouse_id: str, phone: str):
+    def __init__(self, name: str, warehouse_id: str, phone: str,
+                 vehicle_type: str = None, capacity: int = None):
         self.name = name
         self.warehouse_id = warehouse_id
         self.phone = phone
+        self.vehicle_type = vehicle_type  # None drives DEFAULT_VEHICLE_TYPE
+        self.capacity = capacity  # orders per trip, overrides the vehicle type's
         self.is_checked_in = False
         self.checked_in_at = None
         self.created_at = datetime.utcnow()
@@ -46,6 +52,8 @@ class Agent:
             'name': self.name,
             'warehouse_id': self.warehouse_id,
             'phone': self.phone,
+            'vehicle_type': self.vehicle_type,
+            'capacity': self.capacity,
             'is_checked_in': self.is_checked_in,
             'checked_in_at': self.checked_in_at,
             'created_at': self.created_at
@@ -75,6 +83,28 @@ class Agent:
             }
         )
     
+    @classmethod
+    def claim(cls, agent_id, assignment_date: date, run_id: str) -> bool:
+        """Reserve an agent for one allocation run on a date; False if another run holds them"""
+        result = db.agents.update_one(
+            {
+                '_id': ObjectId(agent_id),
+                '$or': [
+                    {'allocated_date': {'$ne': assignment_date.isoformat()}},
+                    {'allocated_run_id': run_id}
+                ]
+            },
+            {'$set': {'allocated_date': assignment_date.isoformat(), 'allocated_run_id': run_id}}
+        )
+        return result.matched_count == 1
+    
+    @classmethod
+    def release_claim(cls, agent_id, run_id: str):
+        return db.agents.update_one(
+            {'_id': ObjectId(agent_id), 'allocated_run_id': run_id},
+            {'$set': {'allocated_date': None, 'allocated_run_id': None}}
+        )
+    
     @classmethod
     def check_out_all(cls):
         return db.agents.update_many(
@@ -90,7 +120,8 @@ class Agent:
 class Order:
     def __init__(self, order_id: str, customer_name: str, customer_phone: str, 
                  delivery_address: str, latitude: float, longitude: float, 
-                 warehouse_id: str, order_date: date = None):
+                 warehouse_id: str, order_date: date = None, window_start: str = None,
+                 window_end: str = None, service_minutes: float = None):
         self.order_id = order_id
         self.customer_name = customer_name
         self.customer_phone = customer_phone
@@ -99,9 +130,13 @@ class Order:
         self.longitude = longitude
         self.warehouse_id = warehouse_id
         self.order_date = order_date or date.today()
+        self.window_start = window_start  # "HH:MM", None = any time
+        self.window_end = window_end
+        self.service_minutes = service_minutes  # None = DEFAULT_SERVICE_MINUTES
         self.status = 'pending'  # pending, assigned, delivered, deferred
         self.assigned_agent_id = None
         self.assigned_at = None
+        self.defer_count = 0
         self.created_at = datetime.utcnow()
     
     def to_dict(self):
@@ -114,28 +149,104 @@ class Order:
             'longitude': self.longitude,
             'warehouse_id': self.warehouse_id,
             'order_date': self.order_date.isoformat() if self.order_date else None,
+            'window_start': self.window_start,
+            'window_end': self.window_end,
+            'service_minutes': self.service_minutes,
             'status': self.status,
             'assigned_agent_id': self.assigned_agent_id,
             'assigned_at': self.assigned_at,
+            'defer_count': self.defer_count,
             'created_at': self.created_at
         }
     
     @classmethod
     def create(cls, order_data):
+        cls.ensure_order_id_index()
         return db.orders.insert_one(order_data)
     
+    @classmethod
+    def insert_many(cls, orders: List[Dict]):
+        cls.ensure_order_id_index()
+        # Unordered, so one bad document does not stop the rest of the chunk
+        return db.orders.insert_many(orders, ordered=False)
+    
+    @classmethod
+    def existing_order_ids(cls, order_ids: List[str]) -> set:
+        """Those of order_ids already taken, by an order in the hot collection or the archive"""
+        from archival import OrderArchive
+        # Hot first: archival copies an order before deleting it, so one moved in between is still found
+        existing = {order['order_id'] for order in db.orders.find({'order_id': {'$in': order_ids}}, {'order_id': 1})}
+        remaining = [order_id for order_id in order_ids if order_id not in existing]
+        return existing | (OrderArchive().archived_order_ids(remaining) if remaining else set())
+    
     @classmethod
     def get_pending_orders(cls):
         return list(db.orders.find({'status': 'pending'}))
     
+    @classmethod
+    def iter_pending(cls, fields: Dict = None):
+        """Cursor over pending orders, optionally limited to some fields"""
+        return db.orders.find({'status': 'pending'}, fields)
+    
     @classmethod
     def get_by_warehouse(cls, warehouse_id):
         return list(db.orders.find({'warehouse_id': warehouse_id, 'status': 'pending'}))
     
+    @classmethod
+    def count_pending(cls, warehouse_id) -> int:
+        return db.orders.count_documents({'warehouse_id': warehouse_id, 'status': 'pending'})
+    
+    @classmethod
+    def tile_counts(cls, warehouse_id, tile_lat: float, tile_lon: float) -> Dict[Tuple[int, int], int]:
+        """Pending orders of a warehouse per (row, column) tile of tile_lat x tile_lon degrees"""
+        rows = db.orders.aggregate([
+            {'$match': {'warehouse_id': warehouse_id, 'status': 'pending'}},
+            {'$group': {
+                '_id': {'row': {'$floor': {'$divide': ['$latitude', tile_lat]}},
+                        'column': {'$floor': {'$divide': ['$longitude', tile_lon]}}},
+                'orders': {'$sum': 1}
+            }}
+        ])
+        return {(int(row['_id']['row']), int(row['_id']['column'])): row['orders'] for row in rows}
+    
+    @classmethod
+    def iter_pending_in_box(cls, warehouse_id, south: float, west: float, north: float, east: float):
+        """Cursor over a warehouse's pending orders inside a bounding box (edges included)"""
+        cls.ensure_tile_index()
+        return db.orders.find({
+            'warehouse_id': warehouse_id,
+            'status': 'pending',
+            'latitude': {'$gte': south, '$lte': north},
+            'longitude': {'$gte': west, '$lte': east}
+        })
+    
+    _tile_index = False
+    
+    @classmethod
+    def ensure_tile_index(cls):
+        if not cls._tile_index:
+            db.orders.create_index([('warehouse_id', 1), ('status', 1), ('latitude', 1), ('longitude', 1)])
+            cls._tile_index = True
+    
+    _order_id_index = False
+    
+    @classmethod
+    def ensure_order_id_index(cls):
+        """Unique order_id, so concurrent loads cannot both insert one (orders without it are exempt)"""
+        if not cls._order_id_index:
+            db.orders.create_index('order_id', unique=True,
+                                   partialFilterExpression={'order_id': {'$type': 'string'}})
+            cls._order_id_index = True
+    
+    @classmethod
+    def get_by_ids(cls, order_ids):
+        return list(db.orders.find({'_id': {'$in': [ObjectId(oid) for oid in order_ids]}}))
+    
     @classmethod
     def assign_to_agent(cls, order_id, agent_id):
+        # Only a pending order can be assigned, so two writers cannot both take it
         return db.orders.update_one(
-            {'_id': ObjectId(order_id)},
+            {'_id': ObjectId(order_id), 'status': 'pending'},
             {
                 '$set': {
                     'status': 'assigned',
@@ -145,14 +256,100 @@ class Order:
             }
         )
     
+    @classmethod
+    def claim(cls, order_ids, agent_id, assignment_id, run_id: str) -> set:
+        """Assign the orders that are still pending to an assignment; returns the ids claimed.
+        
+        The status condition makes each order's claim atomic, so orders taken
+        by a concurrent run are left alone and missing from the result.
+        """
+        object_ids = [ObjectId(oid) for oid in order_ids]
+        db.orders.update_many(
+            {'_id': {'$in': object_ids}, 'status': 'pending'},
+            {
+                '$set': {
+                    'status': 'assigned',
+                    'assigned_agent_id': agent_id,
+                    'assigned_at': datetime.utcnow(),
+                    'assignment_id': assignment_id,
+                    'assignment_run_id': run_id
+                }
+            }
+        )
+        return {str(order['_id']) for order in db.orders.find(
+            {'_id': {'$in': object_ids}, 'assignment_id': assignment_id}, {'_id': 1}
+        )}
+    
+    @classmethod
+    def release_claim(cls, assignment_id):
+        """Return the orders claimed for an assignment that was not created to the pending pool"""
+        return db.orders.update_many(
+            {'assignment_id': assignment_id, 'status': 'assigned'},
+            {
+                '$set': {
+                    'status': 'pending',
+                    'assigned_agent_id': None,
+                    'assigned_at': None,
+                    'assignment_id': None,
+                    'assignment_run_id': None
+                }
+            }
+        )
+    
+    @classmethod
+    def release_orphans(cls, run_id: str, assignment_ids: List):
+        """Release orders a run claimed for assignments it never created (it was interrupted)"""
+        return db.orders.update_many(
+            {'assignment_run_id': run_id, 'status': 'assigned', 'assignment_id': {'$nin': assignment_ids}},
+            {
+                '$set': {
+                    'status': 'pending',
+                    'assigned_agent_id': None,
+                    'assigned_at': None,
+                    'assignment_id': None,
+                    'assignment_run_id': None
+                }
+            }
+        )
+    
     @classmethod
     def defer_orders(cls, order_ids):
+        now = datetime.utcnow()
         return db.orders.update_many(
-            {'_id': {'$in': [ObjectId(oid) for oid in order_ids]}},
+            {'_id': {'$in': [ObjectId(oid) for oid in order_ids]}, 'status': 'pending'},
             {
                 '$set': {
                     'status': 'deferred',
                     'assigned_agent_id': None,
+                    'assigned_at': None,
+                    'last_deferred_at': now
+                },
+                '$inc': {'defer_count': 1}
+            }
+        )
+    
+    @classmethod
+    def rehome(cls, order_ids, warehouse_id):
+        """Move pending orders to another warehouse, remembering the one they were placed at"""
+        return db.orders.update_many(
+            {'_id': {'$in': [ObjectId(oid) for oid in order_ids]}, 'status': 'pending'},
+            [{
+                '$set': {
+                    'home_warehouse_id': {'$ifNull': ['$home_warehouse_id', '$warehouse_id']},
+                    'warehouse_id': warehouse_id
+                }
+            }]
+        )
+    
+    @classmethod
+    def release_deferred(cls):
+        """Return deferred orders to the pending pool, keeping their defer history"""
+        return db.orders.update_many(
+            {'status': 'deferred'},
+            {
+                '$set': {
+                    'status': 'pending',
+                    'assigned_agent_id': None,
                     'assigned_at': None
                 }
             }
@@ -199,9 +396,229 @@ class Assignment:
     def get_by_date(cls, assignment_date: date):
         return list(db.assignments.find({'assignment_date': assignment_date.isoformat()}))
     
+    @classmethod
+    def ids_for_run(cls, run_id: str) -> List:
+        return [assignment['_id'] for assignment in db.assignments.find({'run_id': run_id}, {'_id': 1})]
+    
+    @classmethod
+    def get_routes(cls, assignment_date: date, with_orders: bool = False):
+        """Stored routes of a date, without the rest of each assignment"""
+        fields = {'agent_id': 1, 'polyline': 1, 'legs_km': 1, 'eta_minutes': 1, 'reloads': 1, 'total_distance': 1}
+        if with_orders:
+            fields['order_ids'] = 1
+        return list(db.assignments.find({
+            'assignment_date': assignment_date.isoformat(),
+            'polyline': {'$exists': True}
+        }, fields))
+    
+    @classmethod
+    def get_by_agents(cls, agent_ids: List[str], assignment_date: date):
+        return list(db.assignments.find({
+            'agent_id': {'$in': agent_ids},
+            'assignment_date': assignment_date.isoformat()
+        }))
+    
     @classmethod
     def get_by_agent(cls, agent_id: str, assignment_date: date):
         return db.assignments.find_one({
             'agent_id': agent_id,
             'assignment_date': assignment_date.isoformat()
         })
+
+class AllocationRun:
+    """Checkpoint of one day's allocation run, used to resume an interrupted run.
+    
+    A run is held under a lease by one caller (owner) at a time. The lease is
+    extended at every checkpoint and given up when the caller stops early,
+    so a second caller never works on the same run concurrently. scope is
+    None for a run over all warehouses, or the warehouse ids of one task of
+    a distributed allocation.
+    """
+    
+    @classmethod
+    def get_open(cls, run_date: date, owner: str, lease_seconds: float, scope: str = None,
+                 take_over: bool = False):
+        """Take over an unfinished run of the date and scope whose lease is free or expired.
+        
+        With take_over the lease is ignored: the caller knows the holder is
+        gone (a distributed task reclaimed after its worker died), and the
+        holder, if still alive, stops at its next checkpoint.
+        """
+        from pymongo import ReturnDocument
+        now = datetime.utcnow()
+        query = {'date': run_date.isoformat(), 'scope': scope, 'status': 'running'}
+        if not take_over:
+            query['$or'] = [{'owner': None}, {'lease_until': {'$lt': now}}]
+        return db.allocation_runs.find_one_and_update(
+            query,
+            {'$set': {'owner': owner, 'lease_until': now + timedelta(seconds=lease_seconds), 'updated_at': now}},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    @classmethod
+    def start(cls, run_date: date, time_budget: float, owner: str, lease_seconds: float, scope: str = None):
+        now = datetime.utcnow()
+        run = {
+            'date': run_date.isoformat(),
+            'scope': scope,
+            'status': 'running',
+            'time_budget': time_budget,
+            'warehouses': {},
+            'owner': owner,
+            'lease_until': now + timedelta(seconds=lease_seconds),
+            'started_at': now,
+            'updated_at': now
+        }
+        run['_id'] = db.allocation_runs.insert_one(run).inserted_id
+        return run
+    
+    @classmethod
+    def checkpoint(cls, run_id, owner: str, lease_seconds: float, warehouse_id: str = None,
+                   state: Dict = None) -> bool:
+        """Record a warehouse as committed and extend the lease; False if the lease was lost"""
+        now = datetime.utcnow()
+        update = {'lease_until': now + timedelta(seconds=lease_seconds), 'updated_at': now}
+        if warehouse_id is not None:
+            update[f'warehouses.{warehouse_id}'] = state
+        result = db.allocation_runs.update_one({'_id': run_id, 'owner': owner}, {'$set': update})
+        return result.matched_count == 1
+    
+    @classmethod
+    def release(cls, run_id, owner: str):
+        """Give up the lease so the run can be resumed at once"""
+        return db.allocation_runs.update_one(
+            {'_id': run_id, 'owner': owner},
+            {'$set': {'owner': None, 'lease_until': None, 'updated_at': datetime.utcnow()}}
+        )
+    
+    @classmethod
+    def complete(cls, run_id, result: Dict):
+        now = datetime.utcnow()
+        return db.allocation_runs.update_one(
+            {'_id': run_id},
+            {'$set': {'status': 'completed', 'result': result, 'owner': None,
+                      'completed_at': now, 'updated_at': now}}
+        )
+
+class AllocationTask:
+    """One warehouse set of a distributed allocation, queued for worker processes.
+    
+    Workers claim a task under a lease and keep it alive with heartbeats. A
+    task whose lease expired (its worker died) can be claimed again, up to
+    max_attempts claims in all.
+    """
+    
+    @classmethod
+    def enqueue(cls, batch_id: str, task_date: date, warehouse_groups: List[List[str]], options: Dict):
+        now = datetime.utcnow()
+        tasks = [{
+            'batch_id': batch_id,
+            'date': task_date.isoformat(),
+            'warehouse_ids': warehouse_ids,
+            'options': options,
+            'status': 'queued',
+            'attempts': 0,
+            'worker': None,
+            'lease_until': None,
+            'created_at': now,
+            'updated_at': now
+        } for warehouse_ids in warehouse_groups]
+        return db.allocation_tasks.insert_many(tasks) if tasks else None
+    
+    @classmethod
+    def claim(cls, worker: str, lease_seconds: float, max_attempts: int, task_date: date):
+        """Take task_date's oldest queued task, or a running one whose lease expired.
+        
+        Tasks of other days are never claimed: they would commit that day's
+        pending orders under the other day's date.
+        """
+        from pymongo import ReturnDocument
+        now = datetime.utcnow()
+        return db.allocation_tasks.find_one_and_update(
+            {
+                'date': task_date.isoformat(),
+                '$or': [
+                    {'status': 'queued'},
+                    {'status': 'running', 'lease_until': {'$lt': now}}
+                ],
+                'attempts': {'$lt': max_attempts}
+            },
+            {
+                '$set': {
+                    'status': 'running',
+                    'worker': worker,
+                    'lease_until': now + timedelta(seconds=lease_seconds),
+                    'started_at': now,
+                    'updated_at': now
+                },
+                '$inc': {'attempts': 1}
+            },
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    @classmethod
+    def heartbeat(cls, task_id, worker: str, lease_seconds: float) -> bool:
+        """Extend a task's lease; False if the task was reclaimed by another worker"""
+        now = datetime.utcnow()
+        result = db.allocation_tasks.update_one(
+            {'_id': task_id, 'worker': worker, 'status': 'running'},
+            {'$set': {'lease_until': now + timedelta(seconds=lease_seconds), 'updated_at': now}}
+        )
+        return result.matched_count == 1
+    
+    @classmethod
+    def complete(cls, task_id, worker: str, result: Dict) -> bool:
+        now = datetime.utcnow()
+        update = db.allocation_tasks.update_one(
+            {'_id': task_id, 'worker': worker, 'status': 'running'},
+            {'$set': {'status': 'done', 'result': result, 'lease_until': None,
+                      'finished_at': now, 'updated_at': now}}
+        )
+        return update.matched_count == 1
+    
+    @classmethod
+    def fail(cls, task_id, worker: str, error: str, max_attempts: int):
+        """Put a task back in the queue, or mark it failed once its attempts are used up"""
+        return db.allocation_tasks.update_one(
+            {'_id': task_id, 'worker': worker, 'status': 'running'},
+            [{
+                '$set': {
+                    'status': {'$cond': [{'$lt': ['$attempts', max_attempts]}, 'queued', 'failed']},
+                    'error': error,
+                    'worker': None,
+                    'lease_until': None,
+                    'updated_at': datetime.utcnow()
+                }
+            }]
+        )
+    
+    @classmethod
+    def fail_abandoned(cls, max_attempts: int):
+        """Mark tasks whose last allowed attempt was abandoned as failed"""
+        now = datetime.utcnow()
+        return db.allocation_tasks.update_many(
+            {'status': 'running', 'lease_until': {'$lt': now}, 'attempts': {'$gte': max_attempts}},
+            {'$set': {'status': 'failed', 'error': 'Worker lease expired on the last attempt',
+                      'lease_until': None, 'updated_at': now}}
+        )
+    
+    @classmethod
+    def expire_before(cls, task_date: date):
+        """Mark tasks of days before task_date that no worker holds as failed"""
+        now = datetime.utcnow()
+        return db.allocation_tasks.update_many(
+            {
+                'date': {'$lt': task_date.isoformat()},
+                '$or': [
+                    {'status': 'queued'},
+                    {'status': 'running', 'lease_until': {'$lt': now}}
+                ]
+            },
+            {'$set': {'status': 'failed', 'error': f'Expired unfinished on {task_date.isoformat()}',
+                      'worker': None, 'lease_until': None, 'updated_at': now}}
+        )
+    
+    @classmethod
+    def get_batch(cls, batch_id: str):
+        return list(db.allocation_tasks.find({'batch_id': batch_id}))
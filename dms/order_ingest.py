@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""
+Bulk order ingestion from NDJSON or CSV.
+
+Rows are read one at a time, routed to their nearest warehouse (or checked
+against the warehouse they name) and written in unordered chunks, so
+memory stays flat however large the input is. Bad rows are reported by
+line number and never stop the rest of the batch.
+    
+    python order_ingest.py orders.ndjson
+    python order_ingest.py orders.csv --chunk-size 2000
+    cat orders.ndjson | python order_ingest.py - --format ndjson
+"""
+
+import argparse
+import csv
+import io
+import json
+import math
+import sys
+from datetime import date, datetime
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import Config
+from warehouse_index import warehouse_index
+from time_windows import clock_minutes
+import logging
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ('ndjson', 'csv')
+REQUIRED_FIELDS = ('order_id', 'latitude', 'longitude')
+OPTIONAL_FIELDS = ('customer_name', 'customer_phone', 'delivery_address')
+
+def detect_format(name: str = None, content_type: str = None) -> Optional[str]:
+    """ndjson or csv from a file name or a Content-Type header"""
+    if content_type:
+        content_type = content_type.split(';')[0].strip().lower()
+        if content_type in ('application/x-ndjson', 'application/ndjson', 'application/jsonl',
+                            'application/json'):
+            return 'ndjson'
+        if content_type in ('text/csv', 'application/csv'):
+            return 'csv'
+    if name:
+        name = name.lower()
+        if name.endswith(('.ndjson', '.jsonl')):
+            return 'ndjson'
+        if name.endswith('.csv'):
+            return 'csv'
+    return None
+
+def iter_rows(stream: io.TextIOBase, fmt: str) -> Iterator[Tuple[int, Optional[Dict], Optional[str]]]:
+    """(line number, row, parse error) for every record in the stream"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row, None
+        return
+    
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, f'Invalid JSON: {e}'
+            continue
+        if not isinstance(row, dict):
+            yield line_number, None, 'Row is not a JSON object'
+            continue
+        yield line_number, row, None
+
+class OrderIngestor:
+    """Validates order rows and writes them with chunked unordered insert_many.
+    
+    Warehouses come from the in-memory warehouse index, reloaded once per
+    ingestor, so validation never queries the database. With
+    WAREHOUSE_AUTO_ROUTE each order goes to its nearest warehouse (a given
+    warehouse_id is kept unless another is clearly closer); without it
+    warehouse_id is required and only checked. order_ids already stored (or
+    repeated within a chunk) are rejected, which makes re-sending a batch
+    after a failure safe.
+    """
+    
+    def __init__(self, chunk_size: int = None, max_errors: int = None, auto_route: bool = None):
+        self.chunk_size = chunk_size or Config.INGEST_CHUNK_SIZE
+        self.max_errors = Config.INGEST_MAX_ERRORS if max_errors is None else max_errors
+        self.auto_route = Config.WAREHOUSE_AUTO_ROUTE if auto_route is None else auto_route
+        warehouse_index.refresh()
+    
+    def validate(self, row: Dict) -> Tuple[Optional[Dict], Optional[str]]:
+        """Order document for a row, or the reason it was rejected"""
+        missing = [field for field in REQUIRED_FIELDS if row.get(field) in (None, '')]
+        if missing:
+            return None, f"Missing {', '.join(missing)}"
+        
+        try:
+            latitude = float(row['latitude'])
+            longitude = float(row['longitude'])
+        except (TypeError, ValueError):
+            return None, 'Coordinates are not numbers'
+        if not (math.isfinite(latitude) and math.isfinite(longitude)):
+            return None, 'Coordinates are not finite'
+        if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+            return None, f'Coordinates ({latitude}, {longitude}) out of range'
+        
+        warehouse_id = str(row['warehouse_id']) if row.get('warehouse_id') not in (None, '') else None
+        if self.auto_route:
+            warehouse_id, error = warehouse_index.route(latitude, longitude, warehouse_id)
+            if error is not None:
+                return None, error
+        elif warehouse_id is None:
+            return None, 'Missing warehouse_id'
+        elif warehouse_id not in warehouse_index:
+            return None, f'Unknown warehouse_id {warehouse_id}'
+        
+        order_date = row.get('order_date') or date.today().isoformat()
+        try:
+            order_date = date.fromisoformat(str(order_date)).isoformat()
+        except ValueError:
+            return None, f'Invalid order_date {order_date}'
+        
+        window, error = self._window(row)
+        if error is not None:
+            return None, error
+        
+        order = {'order_id': str(row['order_id'])}
+        for field in OPTIONAL_FIELDS:
+            order[field] = str(row[field]) if row.get(field) not in (None, '') else ''
+        order.update({
+            'latitude': latitude,
+            'longitude': longitude,
+            'warehouse_id': warehouse_id,
+            'order_date': order_date,
+            **window,
+            'status': 'pending',
+            'assigned_agent_id': None,
+            'assigned_at': None,
+            'defer_count': 0,
+            'created_at': datetime.utcnow()
+        })
+        return order, None
+    
+    @staticmethod
+    def _window(row: Dict) -> Tuple[Optional[Dict], Optional[str]]:
+        """Delivery window fields of a row (all optional), or why they are invalid"""
+        window = {}
+        for field in ('window_start', 'window_end'):
+            value = row.get(field)
+            if value in (None, ''):
+                window[field] = None
+                continue
+            try:
+                minutes = clock_minutes(value)
+            except ValueError:
+                return None, f'Invalid {field} {value}, expected HH:MM'
+            window[field] = f"{int(minutes) // 60:02d}:{int(minutes) % 60:02d}"
+        if window['window_start'] and window['window_end'] and window['window_start'] > window['window_end']:
+            return None, f"Window {window['window_start']}-{window['window_end']} ends before it starts"
+        
+        service = row.get('service_minutes')
+        if service in (None, ''):
+            window['service_minutes'] = None
+        else:
+            try:
+                window['service_minutes'] = float(service)
+            except (TypeError, ValueError):
+                return None, f'Invalid service_minutes {service}'
+            if not (math.isfinite(window['service_minutes']) and window['service_minutes'] >= 0):
+                return None, f'Invalid service_minutes {service}'
+        return window, None
+    
+    def ingest(self, stream: io.TextIOBase, fmt: str) -> Dict:
+        """Validate and insert every row of the stream; returns counts and per-row errors"""
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown format {fmt}, expected one of {', '.join(FORMATS)}")
+        
+        result = {'received': 0, 'inserted': 0, 'rejected': 0, 'routed': 0,
+                  'errors': [], 'errors_truncated': False}
+        chunk = []  # (line number, order)
+        for line_number, row, error in iter_rows(stream, fmt):
+            result['received'] += 1
+            if error is None:
+                order, error = self.validate(row)
+            if error is not None:
+                self._reject(result, line_number, error)
+                continue
+            # Only rows that named a warehouse and were placed at another one
+            given = row.get('warehouse_id')
+            if given not in (None, '') and order['warehouse_id'] != str(given):
+                result['routed'] += 1
+            chunk.append((line_number, order))
+            if len(chunk) >= self.chunk_size:
+                self._flush(chunk, result)
+                chunk = []
+        if chunk:
+            self._flush(chunk, result)
+        
+        logger.info(f"Ingested {result['inserted']} of {result['received']} orders, "
+                    f"{result['rejected']} rejected")
+        return result
+    
+    def _reject(self, result: Dict, line_number: int, error: str):
+        result['rejected'] += 1
+        # Only the first max_errors are kept, so a bad file cannot grow the response
+        if len(result['errors']) < self.max_errors:
+            result['errors'].append({'line': line_number, 'error': error})
+        else:
+            result['errors_truncated'] = True
+    
+    def _flush(self, chunk: List[Tuple[int, Dict]], result: Dict):
+        from models import Order
+        from pymongo.errors import BulkWriteError
+        
+        # Fast path only: the unique index on order_id rejects what another load inserts meanwhile
+        existing = Order.existing_order_ids([order['order_id'] for _, order in chunk])
+        pending = []
+        for line_number, order in chunk:
+            if order['order_id'] in existing:
+                self._reject(result, line_number, f"Duplicate order_id {order['order_id']}")
+            else:
+                existing.add(order['order_id'])
+                pending.append((line_number, order))
+        if not pending:
+            return
+        
+        try:
+            inserted = Order.insert_many([order for _, order in pending])
+            result['inserted'] += len(inserted.inserted_ids)
+        except BulkWriteError as e:
+            details = e.details
+            result['inserted'] += details.get('nInserted', 0)
+            for write_error in details.get('writeErrors', []):
+                line_number, order = pending[write_error['index']]
+                if write_error.get('code') == 11000:
+                    self._reject(result, line_number, f"Duplicate order_id {order['order_id']}")
+                else:
+                    self._reject(result, line_number, write_error.get('errmsg', 'Write failed'))
+
+def main():
+    parser = argparse.ArgumentParser(description='Bulk-load orders from NDJSON or CSV')
+    parser.add_argument('path', help="Input file, or - for stdin")
+    parser.add_argument('--format', choices=FORMATS, help='Input format (default: from the file extension)')
+    parser.add_argument('--chunk-size', type=int, default=None, help='Orders per insert_many call')
+    args = parser.parse_args()
+    
+    fmt = args.format or detect_format(name=args.path)
+    if fmt is None:
+        parser.error('Cannot tell the format from the file name, pass --format')
+    
+    logging.basicConfig(level=logging.INFO)
+    ingestor = OrderIngestor(chunk_size=args.chunk_size)
+    if args.path == '-':
+        result = ingestor.ingest(io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline=''), fmt)
+    else:
+        with open(args.path, encoding='utf-8', newline='') as f:
+            result = ingestor.ingest(f, fmt)
+    
+    print(f"Received: {result['received']}  Inserted: {result['inserted']}  Rejected: {result['rejected']}  "
+          f"Routed to another warehouse: {result['routed']}")
+    for error in result['errors']:
+        print(f"  line {error['line']}: {error['error']}")
+    if result['errors_truncated']:
+        print(f"  ... only the first {len(result['errors'])} errors are shown")
+
+if __name__ == "__main__":
+    main()
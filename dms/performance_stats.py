@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Per-agent and per-warehouse daily performance rollups.
+
+agent_daily_stats holds one document per agent per day and
+warehouse_daily_stats one per warehouse per day. Both are updated as
+assignments are committed, and rebuilt from the day's assignments at
+checkout. Range queries read a few small documents per day instead of
+scanning assignments, and the rollups outlive archival of the assignments.
+    
+    python performance_stats.py --rebuild 2024-05-01 --to 2024-05-31
+"""
+
+import argparse
+from datetime import date, datetime, timedelta
+from typing import Dict, List
+from capacity_planner import CapacityPlanner
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+TIERS = ('DEFAULT', 'TIER_1', 'TIER_2')
+SUM_FIELDS = ('assignments', 'orders', 'distance_km', 'time_hours', 'earnings')
+
+def _days(start: date, end: date) -> List[str]:
+    return [(start + timedelta(days=offset)).isoformat() for offset in range((end - start).days + 1)]
+
+def _totals(rows: List[Dict], fields) -> Dict:
+    return {field: round(sum(row.get(field, 0) for row in rows), 2) for field in fields}
+
+class PerformanceStats:
+    """Incrementally maintained daily rollups and the range queries answered from them"""
+    
+    _indexed = False
+    
+    @classmethod
+    def _ensure_indexes(cls):
+        from database import db
+        if not cls._indexed:
+            db.agent_daily_stats.create_index([('agent_id', 1), ('date', 1)])
+            db.warehouse_daily_stats.create_index([('warehouse_id', 1), ('date', 1)])
+            db.warehouse_daily_stats.create_index('date')
+            cls._indexed = True
+    
+    @staticmethod
+    def _tier_expression(orders):
+        return {'$switch': {'branches': [
+            {'case': {'$gte': [orders, Config.TIER_2_ORDERS]}, 'then': 'TIER_2'},
+            {'case': {'$gte': [orders, Config.TIER_1_ORDERS]}, 'then': 'TIER_1'}
+        ], 'default': 'DEFAULT'}}
+    
+    @classmethod
+    def record_assignment(cls, assignment: Dict, warehouse_id: str):
+        """Add a committed assignment to its agent's and warehouse's rollups of the day"""
+        from database import db
+        from pymongo import ReturnDocument
+        
+        cls._ensure_indexes()
+        day = assignment['assignment_date']
+        orders = len(assignment['order_ids'])
+        now = datetime.utcnow()
+        added = {
+            'assignments': 1,
+            'orders': orders,
+            'distance_km': assignment.get('total_distance', 0),
+            'time_hours': assignment.get('total_time', 0),
+            'earnings': assignment.get('total_earning', 0)
+        }
+        # A pipeline update, so the tier is worked out from the day's running order total. The
+        # tier before it is kept on the document, so the tier move is read off this one atomic update
+        agent = db.agent_daily_stats.find_one_and_update(
+            {'_id': f"{assignment['agent_id']}:{day}"},
+            [
+                {'$set': {'previous_tier': {'$ifNull': ['$tier', None]}}},
+                {'$set': {
+                    'agent_id': assignment['agent_id'],
+                    'warehouse_id': warehouse_id,
+                    'date': day,
+                    **{field: {'$add': [{'$ifNull': [f'${field}', 0]}, value]} for field, value in added.items()},
+                    'updated_at': now
+                }},
+                {'$set': {'tier': cls._tier_expression('$orders')}}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        
+        # The agent's first assignment of the day adds an agent-day to the warehouse;
+        # a later one can move the agent up a tier
+        increments = dict(added)
+        if agent['previous_tier'] is None:
+            increments['agents'] = 1
+            increments[f"tiers.{agent['tier']}"] = 1
+        elif agent['previous_tier'] != agent['tier']:
+            increments[f"tiers.{agent['previous_tier']}"] = -1
+            increments[f"tiers.{agent['tier']}"] = 1
+        db.warehouse_daily_stats.update_one(
+            {'_id': f'{warehouse_id}:{day}'},
+            {'$set': {'warehouse_id': warehouse_id, 'date': day, 'updated_at': now}, '$inc': increments},
+            upsert=True
+        )
+    
+    @classmethod
+    def record_deferrals(cls, warehouse_id: str, day: date, count: int):
+        """Add count orders moved from pending to deferred; callers pass only orders that actually moved"""
+        from database import db
+        
+        cls._ensure_indexes()
+        db.warehouse_daily_stats.update_one(
+            {'_id': f'{warehouse_id}:{day.isoformat()}'},
+            {'$set': {'warehouse_id': warehouse_id, 'date': day.isoformat(), 'updated_at': datetime.utcnow()},
+             '$inc': {'deferred': count}},
+            upsert=True
+        )
+    
+    @classmethod
+    def rebuild_day(cls, day: date) -> Dict:
+        """Recompute a day's rollups from its assignments (deferral counts are kept).
+        
+        Run at checkout, this corrects anything the incremental updates
+        missed, such as assignments created by hand or a run that stopped
+        between saving an assignment and updating the rollups.
+        """
+        from database import db
+        from models import Agent
+        from pymongo import UpdateOne
+        
+        cls._ensure_indexes()
+        day = day.isoformat()
+        agent_warehouses = {str(agent['_id']): agent['warehouse_id'] for agent in Agent.get_all()}
+        rows = db.assignments.aggregate([
+            {'$match': {'assignment_date': day}},
+            {'$group': {
+                '_id': '$agent_id',
+                'warehouse_id': {'$last': '$warehouse_id'},
+                'assignments': {'$sum': 1},
+                'orders': {'$sum': {'$size': '$order_ids'}},
+                'distance_km': {'$sum': '$total_distance'},
+                'time_hours': {'$sum': '$total_time'},
+                'earnings': {'$sum': '$total_earning'}
+            }}
+        ])
+        
+        now = datetime.utcnow()
+        agent_updates = []
+        rollup_ids = []
+        warehouses = {}
+        for row in rows:
+            agent_id = row.pop('_id')
+            warehouse_id = row.pop('warehouse_id') or agent_warehouses.get(agent_id)
+            tier = CapacityPlanner.tier_of(row['orders'])
+            rollup_ids.append(f'{agent_id}:{day}')
+            agent_updates.append(UpdateOne(
+                {'_id': rollup_ids[-1]},
+                {'$set': {'agent_id': agent_id, 'warehouse_id': warehouse_id, 'date': day,
+                          'tier': tier, **row, 'updated_at': now}},
+                upsert=True
+            ))
+            warehouse = warehouses.setdefault(warehouse_id, {
+                **{field: 0 for field in SUM_FIELDS}, 'agents': 0, 'tiers': {name: 0 for name in TIERS}
+            })
+            for field in SUM_FIELDS:
+                warehouse[field] += row[field]
+            warehouse['agents'] += 1
+            warehouse['tiers'][tier] += 1
+        
+        db.agent_daily_stats.delete_many({'date': day, '_id': {'$nin': rollup_ids}})
+        if agent_updates:
+            db.agent_daily_stats.bulk_write(agent_updates, ordered=False)
+        # Warehouses without assignments that day keep only their deferrals
+        db.warehouse_daily_stats.update_many(
+            {'date': day, 'warehouse_id': {'$nin': list(warehouses)}},
+            {'$set': {**{field: 0 for field in SUM_FIELDS}, 'agents': 0,
+                      'tiers': {name: 0 for name in TIERS}, 'updated_at': now}}
+        )
+        for warehouse_id, totals in warehouses.items():
+            db.warehouse_daily_stats.update_one(
+                {'_id': f'{warehouse_id}:{day}'},
+                {'$set': {'warehouse_id': warehouse_id, 'date': day, **totals, 'updated_at': now}},
+                upsert=True
+            )
+        logger.info(f"Rebuilt {day} rollups: {len(agent_updates)} agents, {len(warehouses)} warehouses")
+        return {'date': day, 'agents': len(agent_updates), 'warehouses': len(warehouses)}
+    
+    @classmethod
+    def agent_history(cls, agent_id: str, start: date, end: date) -> Dict:
+        """An agent's days from start to end (inclusive) and their totals"""
+        from database import db
+        
+        days = list(db.agent_daily_stats.find(
+            {'agent_id': agent_id, 'date': {'$gte': start.isoformat(), '$lte': end.isoformat()}},
+            {'_id': 0, 'updated_at': 0, 'previous_tier': 0}
+        ).sort('date', 1))
+        totals = _totals(days, SUM_FIELDS)
+        return {
+            'agent_id': agent_id,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'days_worked': len(days),
+            **totals,
+            'avg_orders_per_day': round(totals['orders'] / len(days), 2) if days else 0,
+            'tier_days': {name: sum(1 for day in days if day['tier'] == name) for name in TIERS},
+            'days': days
+        }
+    
+    @classmethod
+    def warehouse_history(cls, warehouse_id: str, start: date, end: date) -> Dict:
+        """A warehouse's days from start to end (inclusive) and their totals"""
+        from database import db
+        
+        days = list(db.warehouse_daily_stats.find(
+            {'warehouse_id': warehouse_id, 'date': {'$gte': start.isoformat(), '$lte': end.isoformat()}},
+            {'_id': 0, 'updated_at': 0}
+        ).sort('date', 1))
+        totals = _totals(days, SUM_FIELDS + ('agents', 'deferred'))
+        return {
+            'warehouse_id': warehouse_id,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            **totals,
+            'avg_orders_per_agent': round(totals['orders'] / totals['agents'], 2) if totals['agents'] else 0,
+            'tiers': {name: sum(day.get('tiers', {}).get(name, 0) for day in days) for name in TIERS},
+            'days': days
+        }
+    
+    @classmethod
+    def warehouse_summary(cls, start: date, end: date) -> List[Dict]:
+        """Totals per warehouse from start to end (inclusive), e.g. average orders per agent"""
+        from database import db
+        
+        rows = db.warehouse_daily_stats.aggregate([
+            {'$match': {'date': {'$gte': start.isoformat(), '$lte': end.isoformat()}}},
+            {'$group': {
+                '_id': '$warehouse_id',
+                'days': {'$sum': 1},
+                'agent_days': {'$sum': {'$ifNull': ['$agents', 0]}},
+                'deferred': {'$sum': {'$ifNull': ['$deferred', 0]}},
+                **{field: {'$sum': {'$ifNull': [f'${field}', 0]}} for field in SUM_FIELDS},
+                **{f'tier_{name}': {'$sum': {'$ifNull': [f'$tiers.{name}', 0]}} for name in TIERS}
+            }},
+            {'$sort': {'_id': 1}}
+        ])
+        summary = []
+        for row in rows:
+            summary.append({
+                'warehouse_id': row['_id'],
+                'days': row['days'],
+                'agent_days': row['agent_days'],
+                **{field: round(row[field], 2) for field in SUM_FIELDS},
+                'deferred': row['deferred'],
+                'avg_orders_per_agent': round(row['orders'] / row['agent_days'], 2) if row['agent_days'] else 0,
+                'avg_orders_per_day': round(row['orders'] / row['days'], 2),
+                'tiers': {name: row[f'tier_{name}'] for name in TIERS}
+            })
+        return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='Rebuild daily performance rollups from assignments')
+    parser.add_argument('--rebuild', type=date.fromisoformat, required=True, help='First day to rebuild')
+    parser.add_argument('--to', type=date.fromisoformat, default=None, help='Last day (default: same day)')
+    args = parser.parse_args()
+    
+    logging.basicConfig(level=logging.INFO)
+    for day in _days(args.rebuild, args.to or args.rebuild):
+        result = PerformanceStats.rebuild_day(date.fromisoformat(day))
+        print(f"{result['date']}: {result['agents']} agents, {result['warehouses']} warehouses")
+
+if __name__ == "__main__":
+    main()
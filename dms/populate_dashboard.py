@@ -57,12 +57,12 @@ for i, agent in enumerate(agents):
         # Create assignment
         assignment_data = {
             'agent_id': agent_id,
-            'order_ids': [str(order['_id']) for order in feasible_orders],
             'assignment_date': date.today().isoformat(),
             'total_distance': metrics['total_distance'],
             'total_time': metrics['total_time'],
             'earning_per_order': metrics['earning_per_order'],
             'total_earning': metrics['total_earning'],
+            **AssignmentUtils.route_fields(feasible_orders, metrics),
             'created_at': datetime.utcnow()
         }
         
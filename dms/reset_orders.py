@@ -4,20 +4,12 @@ import sys
 sys.path.append('/home/rayan/Desktop/projects/assignment')
 
 from database import db
+from models import Order
 
 print("=== RESETTING DEFERRED ORDERS TO PENDING ===")
 
-# Reset all deferred orders to pending
-result = db.orders.update_many(
-    {'status': 'deferred'},
-    {
-        '$set': {
-            'status': 'pending',
-            'assigned_agent_id': None,
-            'assigned_at': None
-        }
-    }
-)
+# Reset all deferred orders to pending (defer counts are kept for aging)
+result = Order.release_deferred()
 
 print(f"Reset {result.modified_count} orders from deferred to pending")
 
@@ -0,0 +1,453 @@
+import heapq
+import json
+import os
+import pickle
+import time
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from spatial_index import GridIndex
+from config import Config
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+class RoadNetwork:
+    """Road graph with a contraction hierarchy for shortest-path distances.
+    
+    Loads a local OSM XML extract (.osm) or a JSON graph, keeps the largest
+    strongly connected component and contracts it once; the hierarchy is
+    pickled next to the source file so later loads skip preprocessing.
+    Many-to-many queries use the bucket method: one upward search per
+    target fills buckets, one upward search per source scans them. Matrices
+    are cached per scope (one per warehouse) and only grow by the new nodes.
+    
+    JSON graphs look like {"nodes": [[lat, lon], ...],
+    "edges": [[u, v], [u, v, km], ...], "directed": false}; edges without a
+    length use the straight-line distance between their nodes.
+    """
+    
+    DRIVABLE_HIGHWAYS = {
+        'motorway', 'trunk', 'primary', 'secondary', 'tertiary', 'unclassified',
+        'residential', 'living_street', 'service', 'road',
+        'motorway_link', 'trunk_link', 'primary_link', 'secondary_link', 'tertiary_link'
+    }
+    HIERARCHY_VERSION = 1
+    WITNESS_SETTLE_LIMIT = 60
+    MAX_SCOPES = 32
+    MAX_SCOPE_NODES = 6000
+    QUERY_BLOCK = 256
+    
+    def __init__(self, latitudes: np.ndarray, longitudes: np.ndarray,
+                 up_forward: List[List[Tuple[int, float]]],
+                 up_backward: List[List[Tuple[int, float]]]):
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        self._up_forward = up_forward
+        self._up_backward = up_backward
+        self._index = GridIndex.build(
+            [(lat, lon, node) for node, (lat, lon) in enumerate(zip(latitudes, longitudes))],
+            cell_km=0.5
+        )
+        self._scopes = OrderedDict()
+        self.source = None  # (path, mtime) of the file it was loaded from
+        self.queries = 0
+        self.cached_queries = 0
+    
+    def __len__(self):
+        return len(self.latitudes)
+    
+    # Loading
+    
+    @classmethod
+    def load(cls, path: str) -> 'RoadNetwork':
+        """Load a graph file, reusing its precomputed hierarchy when up to date"""
+        hierarchy_path = path + '.ch.pkl'
+        if (os.path.exists(hierarchy_path) and
+                os.path.getmtime(hierarchy_path) >= os.path.getmtime(path)):
+            with open(hierarchy_path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('version') == cls.HIERARCHY_VERSION:
+                logger.info(f"Loaded road network hierarchy from {hierarchy_path}")
+                network = cls(data['latitudes'], data['longitudes'], data['up_forward'], data['up_backward'])
+                network.source = (path, os.path.getmtime(path))
+                return network
+        
+        started = time.perf_counter()
+        if path.endswith('.json'):
+            latitudes, longitudes, edges = cls._parse_json(path)
+        else:
+            latitudes, longitudes, edges = cls._parse_osm(path)
+        latitudes, longitudes, edges = cls._largest_component(latitudes, longitudes, edges)
+        up_forward, up_backward = cls._contract(len(latitudes), edges)
+        logger.info(f"Built road network hierarchy for {len(latitudes)} nodes, {len(edges)} edges "
+                    f"in {time.perf_counter() - started:.1f}s")
+        
+        with open(hierarchy_path, 'wb') as f:
+            pickle.dump({
+                'version': cls.HIERARCHY_VERSION,
+                'latitudes': latitudes,
+                'longitudes': longitudes,
+                'up_forward': up_forward,
+                'up_backward': up_backward
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        network = cls(latitudes, longitudes, up_forward, up_backward)
+        network.source = (path, os.path.getmtime(path))
+        return network
+    
+    @staticmethod
+    def _parse_json(path: str):
+        with open(path) as f:
+            data = json.load(f)
+        nodes = np.asarray(data['nodes'], dtype=float)
+        latitudes, longitudes = nodes[:, 0], nodes[:, 1]
+        directed = data.get('directed', False)
+        edges = []
+        for edge in data['edges']:
+            u, v = int(edge[0]), int(edge[1])
+            km = float(edge[2]) if len(edge) > 2 else GridIndex.distance_km(
+                latitudes[u], longitudes[u], latitudes[v], longitudes[v])
+            edges.append((u, v, km))
+            if not directed:
+                edges.append((v, u, km))
+        return latitudes, longitudes, edges
+    
+    @classmethod
+    def _parse_osm(cls, path: str):
+        coords = {}
+        ways = []
+        for _, element in ET.iterparse(path, events=('end',)):
+            if element.tag == 'node':
+                coords[element.get('id')] = (float(element.get('lat')), float(element.get('lon')))
+                element.clear()
+            elif element.tag == 'way':
+                tags = {tag.get('k'): tag.get('v') for tag in element.iter('tag')}
+                if tags.get('highway') in cls.DRIVABLE_HIGHWAYS:
+                    refs = [nd.get('ref') for nd in element.iter('nd')]
+                    oneway = tags.get('oneway')
+                    if oneway == '-1':
+                        refs.reverse()
+                    one_direction = oneway in ('yes', 'true', '1', '-1') or tags.get('junction') == 'roundabout'
+                    ways.append((refs, one_direction))
+                element.clear()
+        
+        node_ids = {}
+        latitudes = []
+        longitudes = []
+        
+        def node_index(ref):
+            if ref not in node_ids:
+                node_ids[ref] = len(latitudes)
+                latitudes.append(coords[ref][0])
+                longitudes.append(coords[ref][1])
+            return node_ids[ref]
+        
+        edges = []
+        for refs, one_direction in ways:
+            refs = [ref for ref in refs if ref in coords]
+            for a, b in zip(refs, refs[1:]):
+                u, v = node_index(a), node_index(b)
+                km = GridIndex.distance_km(latitudes[u], longitudes[u], latitudes[v], longitudes[v])
+                edges.append((u, v, km))
+                if not one_direction:
+                    edges.append((v, u, km))
+        return np.asarray(latitudes), np.asarray(longitudes), edges
+    
+    @staticmethod
+    def _largest_component(latitudes, longitudes, edges):
+        """Keep only the largest strongly connected component (Kosaraju, iterative)"""
+        n = len(latitudes)
+        forward = [[] for _ in range(n)]
+        backward = [[] for _ in range(n)]
+        for u, v, _ in edges:
+            forward[u].append(v)
+            backward[v].append(u)
+        
+        visited = [False] * n
+        finish_order = []
+        for root in range(n):
+            if visited[root]:
+                continue
+            visited[root] = True
+            stack = [(root, iter(forward[root]))]
+            while stack:
+                node, neighbours = stack[-1]
+                for nxt in neighbours:
+                    if not visited[nxt]:
+                        visited[nxt] = True
+                        stack.append((nxt, iter(forward[nxt])))
+                        break
+                else:
+                    stack.pop()
+                    finish_order.append(node)
+        
+        component = [-1] * n
+        sizes = []
+        for root in reversed(finish_order):
+            if component[root] != -1:
+                continue
+            label = len(sizes)
+            component[root] = label
+            stack = [root]
+            size = 0
+            while stack:
+                node = stack.pop()
+                size += 1
+                for prev in backward[node]:
+                    if component[prev] == -1:
+                        component[prev] = label
+                        stack.append(prev)
+            sizes.append(size)
+        
+        largest = int(np.argmax(sizes))
+        keep = np.asarray(component) == largest
+        remap = np.cumsum(keep) - 1
+        kept_edges = [(int(remap[u]), int(remap[v]), km) for u, v, km in edges if keep[u] and keep[v]]
+        if keep.sum() < n:
+            logger.info(f"Road network: kept {int(keep.sum())} of {n} nodes in the largest component")
+        return latitudes[keep], longitudes[keep], kept_edges
+    
+    # Contraction hierarchy
+    
+    @classmethod
+    def _contract(cls, n: int, edges):
+        outgoing = [dict() for _ in range(n)]
+        incoming = [dict() for _ in range(n)]
+        for u, v, km in edges:
+            if u != v and km < outgoing[u].get(v, float('inf')):
+                outgoing[u][v] = km
+                incoming[v][u] = km
+        
+        def witness_distances(source, skip, targets, limit):
+            """Bounded Dijkstra over the remaining graph avoiding skip; stops once targets settle"""
+            dist = {source: 0.0}
+            heap = [(0.0, source)]
+            remaining = len(targets)
+            settled = 0
+            while heap and settled < cls.WITNESS_SETTLE_LIMIT:
+                d, node = heapq.heappop(heap)
+                if d > limit:
+                    break
+                if d > dist[node]:
+                    continue
+                settled += 1
+                if node in targets:
+                    remaining -= 1
+                    if not remaining:
+                        break
+                for nxt, km in outgoing[node].items():
+                    if nxt == skip:
+                        continue
+                    nd = d + km
+                    if nd < dist.get(nxt, float('inf')):
+                        dist[nxt] = nd
+                        heapq.heappush(heap, (nd, nxt))
+            return dist
+        
+        def shortcuts_for(node):
+            shortcuts = []
+            for u, to_node in incoming[node].items():
+                via = {w: to_node + km for w, km in outgoing[node].items() if w != u}
+                if not via:
+                    continue
+                dist = witness_distances(u, node, via, max(via.values()))
+                for w, km in via.items():
+                    if dist.get(w, float('inf')) > km:
+                        shortcuts.append((u, w, km))
+            return shortcuts
+        
+        contracted_neighbours = [0] * n
+        # (priority, shortcuts) per node, cleared when its neighbourhood changes
+        evaluated = [None] * n
+        
+        def priority(node):
+            if evaluated[node] is None:
+                shortcuts = shortcuts_for(node)
+                edge_difference = len(shortcuts) - len(incoming[node]) - len(outgoing[node])
+                evaluated[node] = (edge_difference + contracted_neighbours[node], shortcuts)
+            return evaluated[node]
+        
+        heap = [(priority(node)[0], node) for node in range(n)]
+        heapq.heapify(heap)
+        up_forward = [[] for _ in range(n)]
+        up_backward = [[] for _ in range(n)]
+        
+        while heap:
+            _, node = heapq.heappop(heap)
+            # Lazy update: re-evaluate and put back if no longer the cheapest
+            current, shortcuts = priority(node)
+            if heap and current > heap[0][0]:
+                heapq.heappush(heap, (current, node))
+                continue
+            
+            for u, w, km in shortcuts:
+                if km < outgoing[u].get(w, float('inf')):
+                    outgoing[u][w] = km
+                    incoming[w][u] = km
+                    evaluated[u] = evaluated[w] = None
+            
+            # Every remaining neighbour is contracted later, so these are upward edges
+            up_forward[node] = list(outgoing[node].items())
+            up_backward[node] = list(incoming[node].items())
+            for u in incoming[node]:
+                del outgoing[u][node]
+                contracted_neighbours[u] += 1
+                evaluated[u] = None
+            for w in outgoing[node]:
+                del incoming[w][node]
+                contracted_neighbours[w] += 1
+                evaluated[w] = None
+            outgoing[node] = {}
+            incoming[node] = {}
+        
+        return up_forward, up_backward
+    
+    @staticmethod
+    def _upward_search(source: int, graph) -> Dict[int, float]:
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        done = set()
+        while heap:
+            d, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            for nxt, km in graph[node]:
+                nd = d + km
+                if nd < dist.get(nxt, float('inf')):
+                    dist[nxt] = nd
+                    heapq.heappush(heap, (nd, nxt))
+        return dist
+    
+    @staticmethod
+    def _as_arrays(dist: Dict[int, float]) -> Tuple[np.ndarray, np.ndarray]:
+        return (np.fromiter(dist.keys(), dtype=np.int64, count=len(dist)),
+                np.fromiter(dist.values(), dtype=float, count=len(dist)))
+    
+    def node_matrix(self, sources: List[int], targets: List[int]) -> np.ndarray:
+        """Shortest-path km between graph nodes, shape (len(sources), len(targets)).
+        
+        The target side is processed in blocks: the backward upward searches
+        of a block form a dense (meeting node x target) table, and each
+        source's forward search is a single min-plus reduction against it.
+        """
+        forward = [self._as_arrays(self._upward_search(source, self._up_forward)) for source in sources]
+        matrix = np.empty((len(sources), len(targets)))
+        row_of = np.full(len(self), -1, dtype=np.int64)
+        
+        for start in range(0, len(targets), self.QUERY_BLOCK):
+            block = targets[start:start + self.QUERY_BLOCK]
+            backward = [self._as_arrays(self._upward_search(target, self._up_backward)) for target in block]
+            if not backward:
+                continue
+            reached = np.unique(np.concatenate([nodes for nodes, _ in backward]))
+            row_of[reached] = np.arange(len(reached))
+            
+            # The extra last row stays inf; unreached nodes (row -1) land on it
+            table = np.full((len(reached) + 1, len(block)), np.inf)
+            for j, (nodes, kms) in enumerate(backward):
+                table[row_of[nodes], j] = kms
+            
+            for i, (nodes, kms) in enumerate(forward):
+                matrix[i, start:start + len(block)] = (kms[:, None] + table[row_of[nodes]]).min(axis=0)
+            row_of[reached] = -1
+        return matrix
+    
+    # Coordinate queries
+    
+    def snap(self, coords: List[Tuple[float, float]]) -> Tuple[np.ndarray, np.ndarray]:
+        """Nearest graph node for each coordinate and the straight-line km to it"""
+        nodes = np.empty(len(coords), dtype=int)
+        offsets = np.empty(len(coords))
+        for i, (lat, lon) in enumerate(coords):
+            km, node = self._index.nearest(lat, lon, 1)[0]
+            nodes[i] = node
+            offsets[i] = km
+        return nodes, offsets
+    
+    def _scope_matrix(self, scope, nodes: np.ndarray) -> Tuple[np.ndarray, Dict[int, int]]:
+        """Square matrix over the scope's nodes, extended with any new ones"""
+        cached = self._scopes.get(scope)
+        if cached is not None:
+            self._scopes.move_to_end(scope)
+            known, matrix = cached
+            new_nodes = [int(node) for node in set(nodes.tolist()) if node not in known]
+            if not new_nodes:
+                self.cached_queries += 1
+                return matrix, known
+            if len(known) + len(new_nodes) > self.MAX_SCOPE_NODES:
+                cached = None
+        
+        if cached is None:
+            known, matrix = {}, np.zeros((0, 0))
+            new_nodes = [int(node) for node in set(nodes.tolist())]
+        
+        old_nodes = list(known)
+        all_nodes = old_nodes + new_nodes
+        size = len(all_nodes)
+        grown = np.empty((size, size))
+        grown[:len(old_nodes), :len(old_nodes)] = matrix
+        grown[len(old_nodes):, :] = self.node_matrix(new_nodes, all_nodes)
+        grown[:len(old_nodes), len(old_nodes):] = self.node_matrix(old_nodes, new_nodes)
+        known = {node: i for i, node in enumerate(all_nodes)}
+        
+        self._scopes[scope] = (known, grown)
+        while len(self._scopes) > self.MAX_SCOPES:
+            self._scopes.popitem(last=False)
+        return grown, known
+    
+    def distance_matrix(self, origins: List[Tuple[float, float]],
+                        destinations: List[Tuple[float, float]], scope=None) -> np.ndarray:
+        """Road km between coordinates, including the legs to and from the road.
+        
+        Queries with the same scope (normally a warehouse) share a cached
+        node matrix, so repeated route checks only pay for new stops.
+        """
+        self.queries += 1
+        origin_nodes, origin_offsets = self.snap(origins)
+        destination_nodes, destination_offsets = self.snap(destinations)
+        
+        if scope is None:
+            road = self.node_matrix(origin_nodes.tolist(), destination_nodes.tolist())
+        else:
+            matrix, known = self._scope_matrix(scope, np.concatenate([origin_nodes, destination_nodes]))
+            rows = np.asarray([known[node] for node in origin_nodes.tolist()], dtype=int)
+            cols = np.asarray([known[node] for node in destination_nodes.tolist()], dtype=int)
+            road = matrix[np.ix_(rows, cols)]
+        
+        result = road + origin_offsets[:, None] + destination_offsets[None, :]
+        
+        # Points snapped to the same node are closer to each other than to the road
+        same_node = origin_nodes[:, None] == destination_nodes[None, :]
+        if same_node.any():
+            for i, j in zip(*np.nonzero(same_node)):
+                result[i, j] = GridIndex.distance_km(origins[i][0], origins[i][1],
+                                                     destinations[j][0], destinations[j][1])
+        return result
+    
+    def distance(self, lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+        return float(self.distance_matrix([(lat1, lon1)], [(lat2, lon2)])[0, 0])
+    
+    def stats(self) -> Dict:
+        return {
+            'nodes': len(self),
+            'queries': self.queries,
+            'cached_queries': self.cached_queries,
+            'scopes': len(self._scopes)
+        }
+
+_road_network = None
+_road_network_checked = False
+
+def get_road_network() -> Optional[RoadNetwork]:
+    """Shared road network, or None when no graph file is configured or present"""
+    global _road_network, _road_network_checked
+    if not _road_network_checked:
+        _road_network_checked = True
+        path = Config.ROAD_NETWORK_PATH
+        if path and os.path.exists(path):
+            _road_network = RoadNetwork.load(path)
+        elif path and os.getenv('ROAD_NETWORK_PATH'):
+            logger.warning(f"Road network file {path} not found, using straight-line distances")
+    return _road_network
@@ -0,0 +1,101 @@
+from typing import Dict, Optional, Tuple
+import numpy as np
+from config import Config
+
+def mst_weight(matrix: np.ndarray) -> float:
+    """Minimum spanning tree weight over all points of a distance matrix (Prim)"""
+    n = len(matrix)
+    if n < 2:
+        return 0.0
+    # A one-way matrix is bounded from below by its cheaper direction
+    symmetric = np.minimum(matrix, matrix.T)
+    in_tree = np.zeros(n, dtype=bool)
+    in_tree[0] = True
+    best = symmetric[0].copy()
+    total = 0.0
+    for _ in range(n - 1):
+        candidates = np.where(in_tree, np.inf, best)
+        nearest = int(np.argmin(candidates))
+        total += float(candidates[nearest])
+        in_tree[nearest] = True
+        best = np.minimum(best, symmetric[nearest])
+    return total
+
+def open_route_bounds(matrix: np.ndarray) -> Tuple[float, float]:
+    """Lower and upper bound on any open route from index 0 through all other points.
+    
+    Lower: the route is a spanning path, so it is at least the MST weight,
+    and it must reach the farthest stop, so it is at least that radial
+    distance. Upper: by the triangle inequality each leg a -> b is at most
+    a -> warehouse -> b, so any visiting order (nearest neighbour included)
+    is at most the sum of all outbound and return radials minus the return
+    of the last stop.
+    """
+    if len(matrix) < 2:
+        return 0.0, 0.0
+    outbound = matrix[0, 1:]
+    inbound = matrix[1:, 0]
+    lower = max(mst_weight(matrix), float(outbound.max()))
+    upper = float(outbound.sum() + inbound.sum() - inbound.min())
+    return lower, upper
+
+class RouteBounds:
+    """Settles route feasibility from distance bounds before any routing.
+    
+    decide() returns False when even the lower bound breaks the distance or
+    time limit (or the order count cannot reach the minimum earning), True
+    when the upper bound is within them, and None when only routing can
+    tell. Bounds are widened by the error between the matrix and the
+    distance the route check will use.
+    """
+    
+    def __init__(self):
+        self.reset_stats()
+    
+    def reset_stats(self):
+        self.checked = 0
+        self.pruned = 0
+        self.proven_feasible = 0
+    
+    @staticmethod
+    def limit_km() -> float:
+        """Longest route allowed by both the distance and the working-time limit"""
+        return min(Config.MAX_TRAVEL_DISTANCE_PER_DAY,
+                   Config.MAX_WORKING_HOURS_PER_DAY * 60 / Config.MINUTES_PER_KM)
+    
+    def decide(self, matrix: np.ndarray, earning: float,
+               tolerance: float = 0.0, leg_slack_km: float = 0.0) -> Optional[bool]:
+        """Decide feasibility from the warehouse-first matrix of a candidate set.
+        
+        tolerance is the relative error of the matrix against the route
+        distance, leg_slack_km an absolute error per leg.
+        """
+        self.checked += 1
+        if earning < Config.MIN_DAILY_EARNING:
+            self.pruned += 1
+            return False
+        
+        lower, upper = open_route_bounds(matrix)
+        legs = len(matrix) - 1
+        lower = lower * (1 - tolerance) - legs * leg_slack_km
+        upper = upper * (1 + tolerance) + legs * leg_slack_km
+        
+        limit = self.limit_km()
+        if lower > limit:
+            self.pruned += 1
+            return False
+        if upper <= limit:
+            self.proven_feasible += 1
+            return True
+        return None
+    
+    def stats(self) -> Dict:
+        return {
+            'checked': self.checked,
+            'pruned': self.pruned,
+            'proven_feasible': self.proven_feasible,
+            'routed_undecided': self.checked - self.pruned - self.proven_feasible
+        }
+
+# Global instance
+route_bounds = RouteBounds()
@@ -0,0 +1,59 @@
+from typing import List, Tuple
+
+Point = Tuple[float, float]
+
+# 5 decimal places is about a metre, the precision map SDKs expect for polylines
+POLYLINE_PRECISION = 5
+
+def _to_ints(points: List[Point], precision: int) -> List[Tuple[int, int]]:
+    factor = 10 ** precision
+    return [(int(round(lat * factor)), int(round(lon * factor))) for lat, lon in points]
+
+def delta_encode(points: List[Point], precision: int = POLYLINE_PRECISION) -> List[int]:
+    """Flat [lat, lon, dlat, dlon, ...] integers scaled by 10**precision.
+    
+    The first point is absolute and every later pair is the offset from the
+    previous point, so neighbouring stops cost a few digits each.
+    """
+    encoded = []
+    previous = (0, 0)
+    for point in _to_ints(points, precision):
+        encoded.append(point[0] - previous[0])
+        encoded.append(point[1] - previous[1])
+        previous = point
+    return encoded
+
+def delta_decode(values: List[int], precision: int = POLYLINE_PRECISION) -> List[Point]:
+    factor = 10 ** precision
+    points = []
+    lat = lon = 0
+    for i in range(0, len(values) - 1, 2):
+        lat += values[i]
+        lon += values[i + 1]
+        points.append((lat / factor, lon / factor))
+    return points
+
+def _encode_value(value: int) -> str:
+    value = ~(value << 1) if value < 0 else value << 1
+    chunks = []
+    while value >= 0x20:
+        chunks.append(chr((0x20 | (value & 0x1f)) + 63))
+        value >>= 5
+    chunks.append(chr(value + 63))
+    return ''.join(chunks)
+
+def encode_polyline(points: List[Point], precision: int = POLYLINE_PRECISION) -> str:
+    """Encoded polyline (Google's algorithm) of the points, in order"""
+    return ''.join(_encode_value(value) for value in delta_encode(points, precision))
+
+def decode_polyline(text: str, precision: int = POLYLINE_PRECISION) -> List[Point]:
+    values = []
+    value = shift = 0
+    for char in text:
+        byte = ord(char) - 63
+        value |= (byte & 0x1f) << shift
+        shift += 5
+        if byte < 0x20:
+            values.append(~(value >> 1) if value & 1 else value >> 1)
+            value = shift = 0
+    return delta_decode(values, precision)
@@ -0,0 +1,152 @@
+import hashlib
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Hashable, List, Tuple
+from config import Config
+
+Point = Tuple[float, float]
+DistanceFn = Callable[[Point, Point], float]
+
+@lru_cache(maxsize=262144)
+def order_hash(order_id: str) -> int:
+    """64-bit hash of one order id; a set's fingerprint is the XOR of these"""
+    return int.from_bytes(hashlib.blake2b(order_id.encode(), digest_size=8).digest(), 'big')
+
+class RouteMemo:
+    """LRU memo of routed order sets, keyed by warehouse, its location, distance provider and order-id set.
+    
+    An entry keeps the stop sequence and its leg lengths. These depend on
+    where the stops are and on what measures the distances between them
+    (a road network file, the distance cache or geodesic), not on Config
+    limits, so checks under different limits (what-if runs) reuse it. Set
+    fingerprints are XORs of per-order hashes, so the set with
+    one order removed is one XOR away. A set one order larger than a
+    memoized set is built by inserting the new order where it adds the
+    least distance; a set one order smaller drops that order from the
+    memoized route. A warehouse that moves, or a change of distance
+    provider, starts a fresh set of entries.
+    """
+    
+    def __init__(self, max_entries: int = None):
+        self.max_entries = max_entries or Config.ROUTE_MEMO_MAX_ENTRIES
+        self._entries = OrderedDict()  # ((warehouse_id, point, provider), fingerprint) -> (ids, sequence, legs)
+        self._latest = {}  # (warehouse_id, point, provider) -> key of the last entry stored
+        self.reset_stats()
+    
+    def reset_stats(self):
+        self.hits = 0
+        self.extended = 0
+        self.shrunk = 0
+        self.misses = 0
+    
+    @staticmethod
+    def fingerprint(order_ids) -> int:
+        value = 0
+        for order_id in order_ids:
+            value ^= order_hash(order_id)
+        return value
+    
+    def route(self, warehouse_id: str, warehouse_point: Point, stops: Dict[str, Point],
+              build: Callable[[], List[str]], distance: DistanceFn,
+              provider: Hashable = None) -> Tuple[List[str], List[float]]:
+        """Stop sequence and leg lengths for the order ids in stops.
+        
+        build() routes the set from scratch and is only called when neither
+        the set nor a neighbouring set is memoized. provider names what
+        distance measures with; entries are only reused under the same one.
+        """
+        ids = frozenset(stops)
+        fingerprint = self.fingerprint(ids)
+        # Legs depend on where the warehouse is, not only which one it is, and on how they were measured
+        depot = (warehouse_id, tuple(warehouse_point), provider)
+        key = (depot, fingerprint)
+        
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == ids:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return list(entry[1]), list(entry[2])
+        
+        sequence, legs = self._from_neighbour(depot, warehouse_point, stops, ids, fingerprint, distance)
+        if sequence is None:
+            self.misses += 1
+            sequence = build()
+            points = [warehouse_point] + [stops[order_id] for order_id in sequence]
+            legs = [distance(points[i], points[i + 1]) for i in range(len(sequence))]
+        
+        self._store(key, ids, sequence, legs)
+        self._latest[depot] = key
+        return sequence, legs
+    
+    def _from_neighbour(self, depot: Tuple[str, Point, Hashable], warehouse_point: Point, stops: Dict[str, Point],
+                        ids: frozenset, fingerprint: int, distance: DistanceFn):
+        # One order fewer than this set: each candidate is a single XOR away
+        for order_id in ids:
+            entry = self._entries.get((depot, fingerprint ^ order_hash(order_id)))
+            if entry is not None and entry[0] == ids - {order_id}:
+                self.extended += 1
+                return self._insert(entry, warehouse_point, stops, order_id, distance)
+        
+        # One order more: the previous prefix of the same warehouse
+        latest = self._entries.get(self._latest.get(depot))
+        if latest is not None and len(latest[0]) == len(ids) + 1 and ids < latest[0]:
+            (removed,) = latest[0] - ids
+            self.shrunk += 1
+            return self._remove(latest, warehouse_point, stops, removed, distance)
+        return None, None
+    
+    @staticmethod
+    def _insert(entry, warehouse_point: Point, stops: Dict[str, Point], order_id: str, distance: DistanceFn):
+        _, sequence, legs = entry
+        new_point = stops[order_id]
+        points = [warehouse_point] + [stops[stop] for stop in sequence]
+        to_new = [distance(point, new_point) for point in points]
+        from_new = [distance(new_point, point) for point in points[1:]]
+        
+        # Appending after the last stop adds only the leg into the new order
+        best_position, best_cost = len(sequence), to_new[-1]
+        for i, leg in enumerate(legs):
+            cost = to_new[i] + from_new[i] - leg
+            if cost < best_cost:
+                best_position, best_cost = i, cost
+        
+        new_legs = list(legs[:best_position]) + [to_new[best_position]]
+        if best_position < len(sequence):
+            new_legs += [from_new[best_position]] + list(legs[best_position + 1:])
+        return list(sequence[:best_position]) + [order_id] + list(sequence[best_position:]), new_legs
+    
+    @staticmethod
+    def _remove(entry, warehouse_point: Point, stops: Dict[str, Point], order_id: str, distance: DistanceFn):
+        _, sequence, legs = entry
+        i = sequence.index(order_id)
+        new_sequence = list(sequence[:i]) + list(sequence[i + 1:])
+        if i == len(sequence) - 1:
+            return new_sequence, list(legs[:i])
+        previous = warehouse_point if i == 0 else stops[sequence[i - 1]]
+        bridge = distance(previous, stops[sequence[i + 1]])
+        return new_sequence, list(legs[:i]) + [bridge] + list(legs[i + 2:])
+    
+    def _store(self, key, ids: frozenset, sequence: List[str], legs: List[float]):
+        self._entries[key] = (ids, tuple(sequence), tuple(legs))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    def clear(self):
+        self._entries.clear()
+        self._latest.clear()
+    
+    def stats(self) -> Dict:
+        lookups = self.hits + self.extended + self.shrunk + self.misses
+        return {
+            'hits': self.hits,
+            'extended': self.extended,
+            'shrunk': self.shrunk,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+            'reuse_rate': round((lookups - self.misses) / lookups, 4) if lookups else 0,
+            'entries': len(self._entries)
+        }
+
+# Global instance
+route_memo = RouteMemo()
@@ -0,0 +1,90 @@
+from typing import Callable, List
+import numpy as np
+
+# Routes are open paths that start at the warehouse and end at the last stop,
+# matching LocationUtils.calculate_route_distance. Stops are indices into a
+# distance matrix whose index 0 is the warehouse.
+
+DEPOT = 0
+
+def path_length(matrix: np.ndarray, sequence: List[int]) -> float:
+    """Length of the path warehouse -> sequence[0] -> ... -> sequence[-1]"""
+    if not sequence:
+        return 0.0
+    stops = np.asarray([DEPOT] + list(sequence))
+    return float(matrix[stops[:-1], stops[1:]].sum())
+
+def nearest_neighbour(matrix: np.ndarray, stops: List[int]) -> List[int]:
+    """Greedy sequence: always drive to the closest unvisited stop"""
+    remaining = list(stops)
+    sequence = []
+    current = DEPOT
+    while remaining:
+        nearest = min(remaining, key=lambda stop: matrix[current, stop])
+        sequence.append(nearest)
+        remaining.remove(nearest)
+        current = nearest
+    return sequence
+
+def insertion_cost(matrix: np.ndarray, sequence: List[int], stop: int):
+    """Cheapest (extra km, position) to insert stop into sequence"""
+    best_cost = matrix[sequence[-1], stop] if sequence else matrix[DEPOT, stop]
+    best_position = len(sequence)
+    previous = DEPOT
+    for position, current in enumerate(sequence):
+        cost = matrix[previous, stop] + matrix[stop, current] - matrix[previous, current]
+        if cost < best_cost:
+            best_cost = cost
+            best_position = position
+        previous = current
+    return float(best_cost), best_position
+
+def cheapest_insertion(matrix: np.ndarray, sequence: List[int], stops: List[int]) -> List[int]:
+    """Insert stops one by one where each adds the least distance"""
+    sequence = list(sequence)
+    for stop in stops:
+        _, position = insertion_cost(matrix, sequence, stop)
+        sequence.insert(position, stop)
+    return sequence
+
+def removal_gains(matrix: np.ndarray, sequence: List[int]) -> List[float]:
+    """Distance saved by removing each stop from the sequence"""
+    gains = []
+    for i, stop in enumerate(sequence):
+        previous = sequence[i - 1] if i > 0 else DEPOT
+        if i + 1 < len(sequence):
+            following = sequence[i + 1]
+            gains.append(float(matrix[previous, stop] + matrix[stop, following] - matrix[previous, following]))
+        else:
+            gains.append(float(matrix[previous, stop]))
+    return gains
+
+def two_opt(matrix: np.ndarray, sequence: List[int], max_passes: int = 10,
+            feasible: Callable[[List[int]], bool] = None) -> List[int]:
+    """Reverse segments while that shortens the path (first improvement).
+    
+    With feasible, a shorter sequence is only taken when feasible accepts it
+    (time windows, which a reversed segment can break).
+    """
+    sequence = list(sequence)
+    symmetric = np.allclose(matrix, matrix.T)
+    n = len(sequence)
+    for _ in range(max_passes):
+        improved = False
+        for i in range(n - 1):
+            previous = sequence[i - 1] if i > 0 else DEPOT
+            for j in range(i + 1, n):
+                following = sequence[j + 1] if j + 1 < n else None
+                delta = matrix[previous, sequence[j]] - matrix[previous, sequence[i]]
+                if following is not None:
+                    delta += matrix[sequence[i], following] - matrix[sequence[j], following]
+                if delta < -1e-9:
+                    candidate = sequence[:i] + sequence[i:j + 1][::-1] + sequence[j + 1:]
+                    # With one-way streets the reversed segment's own legs change too
+                    if ((symmetric or path_length(matrix, candidate) < path_length(matrix, sequence) - 1e-9)
+                            and (feasible is None or feasible(candidate))):
+                        sequence = candidate
+                        improved = True
+        if not improved:
+            break
+    return sequence
@@ -1,51 +1,223 @@
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.triggers.cron import CronTrigger
-from datetime import datetime, time
-from allocation_engine import allocation_engine
-from models import Agent
+from datetime import date, datetime, time, timedelta, timezone
+import time as clock
+from models import Agent, Order
+from leader_election import LeaderLease
+from config import Config
 import logging
 
 logger = logging.getLogger(__name__)
 
 class DeliveryScheduler:
+    """Daily jobs, run by whichever process holds the scheduler lease.
+    
+    Every process (e.g. each gunicorn worker) may start the scheduler; they
+    elect a leader through a lease in MongoDB and only the leader runs the
+    jobs, each at most once per day. If the leader dies, another process
+    takes the lease over once it expires and runs the jobs from then on,
+    starting with any of today's that the dead leader left unfinished.
+    
+    The APScheduler instance and its jobs are only built when first needed,
+    so importing this module (as app.py does) costs next to nothing.
+    """
+    
     def __init__(self):
-        self.scheduler = BackgroundScheduler()
-        self.setup_jobs()
+        self._scheduler = None
+        self.leader = LeaderLease('scheduler')
+    
+    @property
+    def scheduler(self):
+        if self._scheduler is None:
+            from apscheduler.schedulers.background import BackgroundScheduler
+            self._scheduler = BackgroundScheduler()
+            self.setup_jobs()
+        return self._scheduler
+    
+    @property
+    def running(self) -> bool:
+        return self._scheduler is not None and self._scheduler.running
     
     def setup_jobs(self):
         """Setup scheduled jobs"""
+        from apscheduler.triggers.cron import CronTrigger
+        from apscheduler.triggers.interval import IntervalTrigger
+        
+        # Keep competing for (or renewing) the scheduler lease
+        self.scheduler.add_job(
+            func=self.renew_lease,
+            trigger=IntervalTrigger(seconds=Config.LEADER_RENEW_SECONDS),
+            id='leader_lease',
+            name='Scheduler Leader Lease',
+            replace_existing=True
+        )
+        
+        # Roll yesterday's deferred orders back into the pending pool at 6:30 AM
+        self.scheduler.add_job(
+            func=self._leader_job('deferred_rollover', self.release_deferred_orders),
+            trigger=CronTrigger(hour=6, minute=30),
+            id='deferred_rollover',
+            name='Deferred Order Rollover',
+            replace_existing=True
+        )
+        
+        # Move pending orders to their nearest warehouse at 6:45 AM
+        if Config.WAREHOUSE_AUTO_ROUTE:
+            self.scheduler.add_job(
+                func=self._leader_job('order_rehoming', self.rehome_pending_orders),
+                trigger=CronTrigger(hour=6, minute=45),
+                id='order_rehoming',
+                name='Nearest Warehouse Re-homing',
+                replace_existing=True
+            )
+        
         # Run allocation every day at 7:00 AM
         self.scheduler.add_job(
-            func=self.run_daily_allocation,
+            func=self._leader_job('daily_allocation', self.run_daily_allocation),
             trigger=CronTrigger(hour=7, minute=0),
             id='daily_allocation',
             name='Daily Order Allocation',
             replace_existing=True
         )
         
-        # Check out all agents at 8:00 PM
+        # Check out all agents at 8:00 PM, then archive the days that are over
         self.scheduler.add_job(
-            func=self.check_out_all_agents,
+            func=self._leader_job('daily_checkout', self.close_day),
             trigger=CronTrigger(hour=20, minute=0),
             id='daily_checkout',
             name='Daily Agent Checkout',
             replace_existing=True
         )
     
+    def daily_jobs(self):
+        """The jobs run once a day by the leader, by id"""
+        return {
+            'deferred_rollover': self.release_deferred_orders,
+            'order_rehoming': self.rehome_pending_orders,
+            'daily_allocation': self.run_daily_allocation,
+            'daily_checkout': self.close_day
+        }
+    
+    def renew_lease(self):
+        try:
+            if self.leader.acquire():
+                self._resume_abandoned_jobs()
+        except Exception as e:
+            logger.error(f"Error renewing scheduler lease: {str(e)}")
+    
+    def _resume_abandoned_jobs(self):
+        """Run again today's jobs that a previous leader started but never finished"""
+        jobs = self.daily_jobs()
+        for job_id in self.leader.abandoned_runs(date.today().isoformat()):
+            if job_id not in jobs:
+                continue
+            logger.warning(f"Resuming {job_id}: the leader that started it today never finished it")
+            # On the scheduler's thread pool, so lease renewals go on meanwhile
+            self.scheduler.add_job(
+                func=self._leader_job(job_id, jobs[job_id]),
+                id=f'{job_id}_resume',
+                name=f'Resume {job_id}',
+                replace_existing=True
+            )
+    
+    def _leader_job(self, job_id, func):
+        """Wrap a daily job so only the leader runs it, once per day.
+        
+        A process that finds the lease held by another skips the job at
+        once and looks again just after that lease runs out, so if its
+        holder died before running the job, whoever takes over runs it.
+        """
+        def run(recheck: bool = True):
+            if not self._wait_for_leadership():
+                logger.info(f"Skipping {job_id}: another process holds the scheduler lease")
+                if recheck:
+                    self._recheck_after_lease(job_id, run)
+                return
+            run_key = date.today().isoformat()
+            if not self.leader.claim_run(job_id, run_key):
+                logger.info(f"Skipping {job_id}: it already ran today")
+                return
+            func()
+            self.leader.finish_run(job_id, run_key)
+        return run
+    
+    def _wait_for_leadership(self) -> bool:
+        """Leader now; False at once while another process holds an unexpired lease.
+        
+        Only a lease that has already expired but could not be taken (another
+        process took it first, or the database failed) is retried, for one
+        renewal interval.
+        """
+        deadline = clock.monotonic() + Config.LEADER_RENEW_SECONDS
+        while True:
+            try:
+                if self.leader.acquire():
+                    return True
+                expires_at = self.leader.holder_expires_at()
+                if expires_at is not None and expires_at > datetime.utcnow():
+                    return False
+            except Exception as e:
+                logger.error(f"Error acquiring scheduler lease: {str(e)}")
+            if clock.monotonic() >= deadline:
+                return False
+            clock.sleep(1)
+    
+    def _recheck_after_lease(self, job_id, run):
+        """Run job_id once more just after the current lease expires, without a further recheck"""
+        try:
+            expires_at = self.leader.holder_expires_at()
+        except Exception as e:
+            logger.error(f"Error reading scheduler lease: {str(e)}")
+            return
+        if expires_at is None:
+            return
+        # A live holder renews before then and the recheck skips; a dead one's lease has lapsed
+        self.scheduler.add_job(
+            func=run,
+            trigger='date',
+            run_date=expires_at.replace(tzinfo=timezone.utc) + timedelta(seconds=1),
+            kwargs={'recheck': False},
+            id=f'{job_id}_recheck',
+            name=f'Recheck {job_id}',
+            replace_existing=True
+        )
+    
     def run_daily_allocation(self):
         """Run the daily order allocation"""
         try:
             logger.info("Starting scheduled daily allocation")
-            result = allocation_engine.run_allocation()
+            if Config.DISTRIBUTED_ALLOCATION:
+                from distributed_allocation import AllocationCoordinator
+                # Worker processes pick the tasks up; this only queues them
+                batch = AllocationCoordinator().enqueue()
+                logger.info(f"Daily allocation queued for workers: {batch}")
+                return
+            from allocation_engine import OrderAllocationEngine
+            result = OrderAllocationEngine().run_allocation()
             
             if result['status'] == 'success':
                 logger.info(f"Daily allocation completed successfully: {result}")
             else:
                 logger.error(f"Daily allocation failed: {result}")
-                
+        
         except Exception as e:
             logger.error(f"Error in daily allocation: {str(e)}")
     
+    def release_deferred_orders(self):
+        """Move deferred orders back to pending ahead of the daily allocation"""
+        try:
+            result = Order.release_deferred()
+            logger.info(f"Released {result.modified_count} deferred orders to pending")
+        except Exception as e:
+            logger.error(f"Error releasing deferred orders: {str(e)}")
+    
+    def rehome_pending_orders(self):
+        """Re-home pending orders to their nearest warehouse ahead of the daily allocation"""
+        from warehouse_index import warehouse_index
+        try:
+            result = warehouse_index.rehome_pending_orders()
+            logger.info(f"Re-homing completed: {result}")
+        except Exception as e:
+            logger.error(f"Error re-homing orders: {str(e)}")
+    
     def check_out_all_agents(self):
         """Check out all agents at end of day"""
         try:
@@ -55,18 +227,46 @@ class DeliveryScheduler:
         except Exception as e:
             logger.error(f"Error checking out agents: {str(e)}")
     
+    def archive_completed_days(self):
+        """Move finished days' assignments and orders into the archive collections"""
+        from archival import OrderArchive
+        try:
+            result = OrderArchive().archive()
+            logger.info(f"Archival completed: {result}")
+        except Exception as e:
+            logger.error(f"Error archiving completed days: {str(e)}")
+    
+    def rebuild_daily_stats(self):
+        """Recompute today's performance rollups from its assignments"""
+        from performance_stats import PerformanceStats
+        try:
+            PerformanceStats.rebuild_day(date.today())
+        except Exception as e:
+            logger.error(f"Error rebuilding performance rollups: {str(e)}")
+    
+    def close_day(self):
+        """End-of-day job: check every agent out, settle the day's rollups, then archive"""
+        self.check_out_all_agents()
+        self.rebuild_daily_stats()
+        if Config.ARCHIVE_ENABLED:
+            self.archive_completed_days()
+    
     def start(self):
         """Start the scheduler"""
         try:
+            self.renew_lease()
             self.scheduler.start()
-            logger.info("Delivery scheduler started successfully")
+            logger.info(f"Delivery scheduler started successfully "
+                        f"({'leader' if self.leader.is_leader else 'standby'})")
         except Exception as e:
             logger.error(f"Error starting scheduler: {str(e)}")
     
     def stop(self):
         """Stop the scheduler"""
         try:
-            self.scheduler.shutdown()
+            if self.running:
+                self.scheduler.shutdown()
+            self.leader.release()
             logger.info("Delivery scheduler stopped")
         except Exception as e:
             logger.error(f"Error stopping scheduler: {str(e)}")
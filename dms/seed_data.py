@@ -60,6 +60,7 @@ class SeedDataGenerator:
                     'name': f"{random.choice(self.first_names)} {random.choice(self.last_names)}",
                     'warehouse_id': str(warehouse['_id']),
                     'phone': f"+91-{random.randint(9000000000, 9999999999)}",
+                    'vehicle_type': random.choices(['two_wheeler', 'three_wheeler'], weights=[4, 1])[0],
                     'is_checked_in': False,
                     'checked_in_at': None,
                     'created_at': datetime.utcnow()
@@ -103,6 +104,7 @@ class SeedDataGenerator:
                     'status': 'pending',
                     'assigned_agent_id': None,
                     'assigned_at': None,
+                    'defer_count': 0,
                     'created_at': datetime.utcnow()
                 }
                 
@@ -0,0 +1,131 @@
+import gzip
+import json
+import math
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from typing import Any
+from flask import Flask, Response, request
+from flask.json.provider import JSONProvider
+from bson import ObjectId, Decimal128
+from config import Config
+
+try:
+    import orjson
+except ImportError:  # optional, the standard library encoder is used instead
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional, responses are gzipped instead
+    brotli = None
+
+# Documents go out as MongoDB returns them: ObjectIds become strings,
+# datetimes ISO 8601 in UTC (MongoDB stores them naive), Decimal128 and
+# Decimal strings, numpy values plain numbers, NaN and infinity null.
+# orjson encodes the common types itself and calls _default only for the
+# rest; the standard library fallback produces the same output.
+
+if orjson is not None:
+    ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+COMPRESSIBLE_TYPES = {'application/json', 'text/html', 'text/plain', 'text/csv', 'text/css', 'application/javascript'}
+
+def _default(value: Any) -> Any:
+    """JSON form of a value the encoder has no type for"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).isoformat()
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, 'tolist'):  # numpy arrays and scalars
+        return value.tolist()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+def _finite(value: Any) -> Any:
+    """value with NaN and infinite floats, keys included, replaced by None as orjson writes them"""
+    if isinstance(value, float):
+        return value if math.isfinite(value) else None
+    if isinstance(value, dict):
+        return {(None if isinstance(key, float) and not math.isfinite(key) else key): _finite(item)
+                for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_finite(item) for item in value]
+    return value
+
+def _stdlib_default(value: Any) -> Any:
+    return _finite(_default(value))
+
+def dumps(obj: Any) -> bytes:
+    """Compact UTF-8 JSON of obj, BSON types included"""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS)
+    try:
+        text = json.dumps(obj, default=_stdlib_default, ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+    except ValueError:
+        # Only documents that hold NaN or infinity pay for the extra pass
+        text = json.dumps(_finite(obj), default=_stdlib_default, ensure_ascii=False, separators=(',', ':'),
+                          allow_nan=False)
+    return text.encode('utf-8')
+
+def loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+class BSONJSONProvider(JSONProvider):
+    """Flask's jsonify and request.get_json through dumps and loads.
+    
+    Handlers return documents as read from MongoDB, without converting
+    their fields first. Keys keep the order they have in the document.
+    """
+    
+    mimetype = 'application/json'
+    
+    def dumps(self, obj: Any, **kwargs) -> str:
+        return dumps(obj).decode('utf-8')
+    
+    def loads(self, s, **kwargs) -> Any:
+        return loads(s)
+    
+    def response(self, *args, **kwargs) -> Response:
+        # Straight to bytes, without a round trip through str
+        return self._app.response_class(dumps(self._prepare_response_obj(args, kwargs)), mimetype=self.mimetype)
+
+def _encoders():
+    encoders = {}
+    if brotli is not None:
+        encoders['br'] = lambda data: brotli.compress(data, quality=Config.BROTLI_QUALITY)
+    encoders['gzip'] = lambda data: gzip.compress(data, compresslevel=Config.GZIP_LEVEL, mtime=0)
+    return encoders
+
+ENCODERS = _encoders()  # in order of preference when the client accepts several equally
+
+def compress_response(response: Response) -> Response:
+    """Brotli or gzip a text response of COMPRESS_MIN_BYTES or more, as the client accepts"""
+    if (not Config.COMPRESS_RESPONSES or response.direct_passthrough or response.is_streamed or
+            response.status_code < 200 or response.status_code in (204, 206, 304) or
+            'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_TYPES):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < Config.COMPRESS_MIN_BYTES:
+        return response
+    encoding = request.accept_encodings.best_match(ENCODERS)
+    if encoding is None:
+        return response
+    response.set_data(ENCODERS[encoding](data))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def init_app(app: Flask):
+    """Serve JSON through BSONJSONProvider and compress responses"""
+    app.json = BSONJSONProvider(app)
+    app.after_request(compress_response)
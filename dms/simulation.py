@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+What-if simulation for the allocation engine.
+
+Runs the engine on an in-memory snapshot of agents, warehouses and pending
+orders with per-run Config overrides. Nothing is written to the database.
+    
+    python simulation.py --set MAX_TRAVEL_DISTANCE_PER_DAY=150
+    python simulation.py --sweep MINUTES_PER_KM=2,3,4 --sweep TIER_1_ORDERS=12,15 --workers 4
+"""
+
+import argparse
+import copy
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import date
+from typing import List, Dict
+from config import Config
+from capacity_planner import CapacityPlanner
+from route_bounds import route_bounds
+from route_memo import route_memo
+import logging
+
+logger = logging.getLogger(__name__)
+
+def parse_config_value(key: str, value):
+    """Convert an override (a CLI string or a JSON value) to the type of the existing Config attribute.
+    
+    Raises ValueError for unknown keys and for values that do not convert,
+    such as "fast" for a number or 5 for a string setting.
+    """
+    if not hasattr(Config, key):
+        raise ValueError(f"Unknown config key: {key}")
+    current = getattr(Config, key)
+    if isinstance(current, bool):
+        if isinstance(value, bool):
+            return value
+        if isinstance(value, str) and value.lower() in ('1', 'true', 'yes', '0', 'false', 'no'):
+            return value.lower() in ('1', 'true', 'yes')
+        raise ValueError(f"{key} must be true or false, got {value!r}")
+    if isinstance(current, (int, float)):
+        if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+            raise ValueError(f"{key} must be a number, got {value!r}")
+        try:
+            number = float(value)
+        except ValueError:
+            raise ValueError(f"{key} must be a number, got {value!r}")
+        if not math.isfinite(number):
+            raise ValueError(f"{key} must be finite, got {value!r}")
+        return int(number) if isinstance(current, int) and number.is_integer() else number
+    if current is not None and not isinstance(value, type(current)):
+        raise ValueError(f"{key} must be a {type(current).__name__}, got {value!r}")
+    return value
+
+def build_scenarios(overrides: Dict, sweep: Dict[str, List]) -> List[Dict]:
+    """Validated override dicts: overrides plus each combination of the sweep values.
+    
+    Raises ValueError for bad keys or values and for sweeps of more than
+    SIMULATION_MAX_SCENARIOS scenarios.
+    """
+    if not isinstance(overrides, dict) or not isinstance(sweep, dict):
+        raise ValueError("overrides and sweep must be objects of config keys")
+    base = {key: parse_config_value(key, value) for key, value in overrides.items()}
+    grid = {}
+    for key, values in sweep.items():
+        if not isinstance(values, list) or not values:
+            raise ValueError(f"sweep values of {key} must be a non-empty list")
+        grid[key] = [parse_config_value(key, value) for value in values]
+    
+    count = math.prod(len(values) for values in grid.values())
+    if count > Config.SIMULATION_MAX_SCENARIOS:
+        raise ValueError(f"The sweep has {count} scenarios, at most {Config.SIMULATION_MAX_SCENARIOS} are allowed")
+    return [{**base, **scenario} for scenario in Simulator.expand_grid(grid)]
+
+@contextmanager
+def config_overrides(overrides: Dict):
+    """Temporarily replace Config attributes, restoring them on exit"""
+    unknown = [key for key in overrides if not hasattr(Config, key)]
+    if unknown:
+        raise ValueError(f"Unknown config keys: {', '.join(unknown)}")
+    
+    original = {key: getattr(Config, key) for key in overrides}
+    try:
+        for key, value in overrides.items():
+            setattr(Config, key, value)
+        yield
+    finally:
+        for key, value in original.items():
+            setattr(Config, key, value)
+
+class DataSnapshot:
+    """Plain-dict copy of everything one allocation run reads"""
+    
+    def __init__(self, snapshot_date: date, agents: List[Dict],
+                 warehouses: Dict[str, Dict], orders: Dict[str, List[Dict]],
+                 previous_routes: Dict[str, List] = None):
+        self.date = snapshot_date
+        self.agents = agents
+        self.warehouses = warehouses
+        self.orders = orders
+        self.previous_routes = previous_routes or {}
+    
+    @classmethod
+    def capture(cls, snapshot_date: date = None, warm_start: bool = False) -> 'DataSnapshot':
+        """Read checked-in agents, their warehouses and pending orders.
+        
+        With warm_start, the agents' routes from the day before are captured too.
+        """
+        from models import Warehouse, Agent, Order
+        from warm_start import load_previous_routes
+        
+        agents = Agent.get_checked_in_agents()
+        warehouse_ids = {agent['warehouse_id'] for agent in agents}
+        warehouses = {}
+        orders = {}
+        for warehouse_id in warehouse_ids:
+            warehouse = Warehouse.get_by_id(warehouse_id)
+            if warehouse:
+                warehouses[warehouse_id] = warehouse
+                orders[warehouse_id] = Order.get_by_warehouse(warehouse_id)
+        
+        snapshot_date = snapshot_date or date.today()
+        previous_routes = load_previous_routes(agents, warehouses, snapshot_date) if warm_start else {}
+        return cls(snapshot_date, agents, warehouses, orders, previous_routes)
+    
+    def total_orders(self) -> int:
+        return sum(len(orders) for orders in self.orders.values())
+
+class Simulator:
+    """Runs allocation scenarios against a DataSnapshot"""
+    
+    def __init__(self, snapshot: DataSnapshot):
+        self.snapshot = snapshot
+    
+    def run(self, overrides: Dict = None) -> Dict:
+        """Run one scenario in this process and return its metrics"""
+        from allocation_engine import OrderAllocationEngine
+        
+        overrides = overrides or {}
+        started = time.perf_counter()
+        
+        # An iteration budget instead of a time budget, so a scenario's result
+        # depends on its settings and not on how busy the machine is
+        with config_overrides({'LOCAL_SEARCH_ITERATIONS': Config.SIMULATION_SEARCH_ITERATIONS, **overrides}):
+            route_bounds.reset_stats()
+            route_memo.reset_stats()
+            engine = OrderAllocationEngine(today=self.snapshot.date)
+            all_agents = copy.deepcopy(self.snapshot.agents)
+            warehouse_agents = engine.group_agents_by_warehouse(all_agents)
+            
+            warehouse_assignments = {}
+            idle_agents = {}
+            warehouse_deferred = {}
+            for warehouse_id, agents in warehouse_agents.items():
+                warehouse = self.snapshot.warehouses.get(warehouse_id)
+                if not warehouse:
+                    continue
+                orders = self.snapshot.orders.get(warehouse_id, [])
+                if not orders:
+                    idle_agents[warehouse_id] = agents
+                    continue
+                
+                assignments, deferred_orders = engine.solve_warehouse(
+                    agents, list(orders), warehouse, self.snapshot.previous_routes
+                )
+                busy_agents = {assignment['agent_id'] for assignment in assignments}
+                idle_agents[warehouse_id] = [agent for agent in agents if str(agent['_id']) not in busy_agents]
+                warehouse_assignments[warehouse_id] = assignments
+                warehouse_deferred[warehouse_id] = deferred_orders
+            
+            total_rebalanced = 0
+            if Config.REBALANCE_ENABLED:
+                assignments, rehomed, warehouse_deferred = engine.rebalance(
+                    self.snapshot.warehouses, idle_agents, warehouse_deferred
+                )
+                total_rebalanced = sum(len(order_ids) for order_ids in rehomed.values())
+                agent_warehouses = {str(agent['_id']): agent['warehouse_id'] for agent in all_agents}
+                for assignment in assignments:
+                    warehouse_assignments.setdefault(agent_warehouses[assignment['agent_id']], []).append(assignment)
+            
+            warehouse_metrics = {
+                warehouse_id: self.summarize(assignments, len(warehouse_deferred.get(warehouse_id, [])))
+                for warehouse_id, assignments in warehouse_assignments.items()
+            }
+            metrics = self.summarize(
+                [assignment for assignments in warehouse_assignments.values() for assignment in assignments],
+                sum(len(orders) for orders in warehouse_deferred.values())
+            )
+            metrics['total_rebalanced'] = total_rebalanced
+            metrics['local_search'] = engine.search_summary()
+            metrics['route_bounds'] = route_bounds.stats()
+            metrics['route_memo'] = route_memo.stats()
+        
+        metrics.update({
+            'overrides': overrides,
+            'date': self.snapshot.date.isoformat(),
+            'runtime_seconds': round(time.perf_counter() - started, 3),
+            'warehouses': warehouse_metrics
+        })
+        return metrics
+    
+    def sweep(self, scenarios: List[Dict], workers: int = None) -> List[Dict]:
+        """Run scenarios in worker processes; results come back in input order"""
+        workers = min(workers or os.cpu_count() or 1, max(len(scenarios), 1))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(self.snapshot,)) as executor:
+            return list(executor.map(_run_scenario, scenarios))
+    
+    @staticmethod
+    def summarize(assignments: List[Dict], deferred_count: int) -> Dict:
+        """Aggregate metrics over planned assignments"""
+        total_orders = sum(len(a['order_ids']) for a in assignments)
+        total_distance = sum(a['total_distance'] for a in assignments)
+        total_time = sum(a['total_time'] for a in assignments)
+        total_cost = sum(a['total_earning'] for a in assignments)
+        
+        return {
+            'total_agents': len(assignments),
+            'total_assigned': total_orders,
+            'total_deferred': deferred_count,
+            'total_distance': round(total_distance, 2),
+            'total_time': round(total_time, 2),
+            'total_cost': total_cost,
+            'cost_per_order': round(total_cost / total_orders, 2) if total_orders else 0,
+            'avg_orders_per_agent': round(total_orders / len(assignments), 2) if assignments else 0,
+            'warm_start_matched': sum(a.get('warm_start_orders', 0) for a in assignments),
+            'tiers': CapacityPlanner.tier_breakdown([len(a['order_ids']) for a in assignments])
+        }
+    
+    @staticmethod
+    def expand_grid(grid: Dict[str, List]) -> List[Dict]:
+        """Cartesian product of {key: [values]} as a list of override dicts"""
+        keys = list(grid)
+        return [dict(zip(keys, values)) for values in itertools.product(*(grid[key] for key in keys))]
+
+_worker_simulator = None
+
+def _init_worker(snapshot: DataSnapshot):
+    global _worker_simulator
+    logging.getLogger().setLevel(logging.WARNING)
+    _worker_simulator = Simulator(snapshot)
+
+def _run_scenario(overrides: Dict) -> Dict:
+    return _worker_simulator.run(overrides)
+
+def main():
+    parser = argparse.ArgumentParser(description='Dry-run the allocation engine with config overrides')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='Config override applied to every scenario')
+    parser.add_argument('--sweep', action='append', default=[], metavar='KEY=V1,V2,...',
+                        help='Config values to sweep; several --sweep flags form a grid')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes for sweeps')
+    parser.add_argument('--output', help='Write the full results as JSON to this file')
+    parser.add_argument('--warm-start', action='store_true',
+                        help="Seed agents from their previous day's routes")
+    args = parser.parse_args()
+    
+    base = dict(item.split('=', 1) for item in args.set)
+    grid = {key: raw.split(',') for key, raw in (item.split('=', 1) for item in args.sweep)}
+    try:
+        scenarios = build_scenarios(base, grid)
+    except ValueError as e:
+        parser.error(str(e))
+    
+    snapshot = DataSnapshot.capture(warm_start=args.warm_start)
+    print(f"Snapshot: {len(snapshot.agents)} agents, {len(snapshot.warehouses)} warehouses, "
+          f"{snapshot.total_orders()} pending orders")
+    
+    simulator = Simulator(snapshot)
+    if grid:
+        results = simulator.sweep(scenarios, args.workers)
+    else:
+        results = [simulator.run(scenarios[0])]
+    
+    print(f"\n{'scenario':<50} {'assigned':>9} {'deferred':>9} {'distance':>10} {'cost':>9} {'₹/order':>8}")
+    for result in results:
+        label = ', '.join(f"{k}={v}" for k, v in result['overrides'].items()) or 'baseline'
+        print(f"{label:<50} {result['total_assigned']:>9} {result['total_deferred']:>9} "
+              f"{result['total_distance']:>10} {result['total_cost']:>9} {result['cost_per_order']:>8}")
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"\nResults written to {args.output}")
+
+if __name__ == "__main__":
+    main()
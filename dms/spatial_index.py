@@ -0,0 +1,107 @@
+import math
+from typing import Any, Dict, List, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = math.pi * EARTH_RADIUS_KM / 180
+
+class GridIndex:
+    """In-memory spatial index over (lat, lon) points using fixed-size grid cells.
+    
+    Each point carries an arbitrary payload. Nearest and radius queries only
+    look at cells around the query point and widen ring by ring, so lookups
+    stay cheap regardless of how many points are indexed.
+    """
+    
+    def __init__(self, cell_km: float = 1.0):
+        self.cell_km = cell_km
+        self._cells: Dict[Tuple[int, int], List[Tuple[float, float, Any]]] = {}
+        self._size = 0
+        self._origin = None
+        self._max_ring = 0
+    
+    def __len__(self):
+        return self._size
+    
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        # Longitude cells are sized at the equator, so away from it they are
+        # narrower than cell_km; _min_ring_km accounts for that in searches
+        return (int(math.floor(latitude * KM_PER_DEGREE_LAT / self.cell_km)),
+                int(math.floor(longitude * KM_PER_DEGREE_LAT / self.cell_km)))
+    
+    def insert(self, latitude: float, longitude: float, payload: Any = None):
+        cell = self._cell(latitude, longitude)
+        self._cells.setdefault(cell, []).append((latitude, longitude, payload))
+        self._size += 1
+        if self._origin is None:
+            self._origin = cell
+        self._max_ring = max(self._max_ring, abs(cell[0] - self._origin[0]) + 1,
+                             abs(cell[1] - self._origin[1]) + 1)
+    
+    @classmethod
+    def build(cls, points: List[Tuple[float, float, Any]], cell_km: float = 1.0) -> 'GridIndex':
+        """Index a list of (lat, lon, payload) tuples"""
+        index = cls(cell_km)
+        for latitude, longitude, payload in points:
+            index.insert(latitude, longitude, payload)
+        return index
+    
+    @staticmethod
+    def distance_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+        """Haversine distance, cheap enough for index queries"""
+        phi1, phi2 = math.radians(lat1), math.radians(lat2)
+        a = (math.sin((phi2 - phi1) / 2) ** 2 +
+             math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+        return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+    
+    def _min_ring_km(self, latitude: float, ring: int) -> float:
+        """Lower bound on the distance to any point outside the first ring rings"""
+        return ring * self.cell_km * math.cos(math.radians(latitude))
+    
+    def _ring(self, center: Tuple[int, int], ring: int):
+        row, col = center
+        if ring == 0:
+            yield center
+            return
+        for d in range(-ring, ring + 1):
+            yield (row - ring, col + d)
+            yield (row + ring, col + d)
+        for d in range(-ring + 1, ring):
+            yield (row + d, col - ring)
+            yield (row + d, col + ring)
+    
+    def nearest(self, latitude: float, longitude: float, k: int = 1) -> List[Tuple[float, Any]]:
+        """The k closest points as (distance_km, payload), closest first"""
+        if not self._size:
+            return []
+        
+        center = self._cell(latitude, longitude)
+        found = []
+        ring = 0
+        # Rings further than max_ring from the data cannot contain anything new
+        max_ring = self._max_ring + max(abs(center[0] - self._origin[0]), abs(center[1] - self._origin[1]))
+        while ring <= max_ring:
+            for cell in self._ring(center, ring):
+                for lat, lon, payload in self._cells.get(cell, ()):
+                    found.append((self.distance_km(latitude, longitude, lat, lon), payload))
+            # Anything outside the rings searched so far is at least ring * cell_km away
+            if len(found) >= k:
+                found.sort(key=lambda item: item[0])
+                if found[k - 1][0] <= self._min_ring_km(latitude, ring):
+                    break
+            ring += 1
+        found.sort(key=lambda item: item[0])
+        return found[:k]
+    
+    def within(self, latitude: float, longitude: float, radius_km: float) -> List[Tuple[float, Any]]:
+        """All points within radius_km as (distance_km, payload), closest first"""
+        center = self._cell(latitude, longitude)
+        rings = int(math.ceil(radius_km / self._min_ring_km(latitude, 1))) + 1
+        found = []
+        for ring in range(rings + 1):
+            for cell in self._ring(center, ring):
+                for lat, lon, payload in self._cells.get(cell, ()):
+                    distance = self.distance_km(latitude, longitude, lat, lon)
+                    if distance <= radius_km:
+                        found.append((distance, payload))
+        found.sort(key=lambda item: item[0])
+        return found
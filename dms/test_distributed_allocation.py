@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Test that distributed allocation recovers from a worker killed mid-commit
+
+A worker process is killed after it has claimed an agent's orders but
+before the assignment is saved. A second worker process reclaims the task
+once its lease expires, takes over the dead worker's run (whose lease is
+still live) and finishes it: the orphaned orders go back to pending and
+are assigned, and the agent the dead run held still gets a route.
+
+Needs a running mongod; everything is written to its own database,
+dms_test_distributed, which is dropped afterwards.
+    
+    python test_distributed_allocation.py
+"""
+
+import sys
+import os
+import multiprocessing
+import random
+import signal
+import time
+from datetime import date, datetime
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Never touch the real database; spawned workers inherit this
+os.environ['DB_NAME'] = 'dms_test_distributed'
+
+from config import Config
+from database import db
+from distributed_allocation import AllocationCoordinator, AllocationWorker
+
+# Short task leases so the test does not wait minutes; the run lease keeps its default
+OVERRIDES = {'TASK_LEASE_SECONDS': 2, 'TASK_HEARTBEAT_SECONDS': 0.5, 'TASK_POLL_SECONDS': 0.2}
+
+def seed(agents: int = 4, orders: int = 100):
+    """One warehouse with checked-in agents and pending orders around it"""
+    rng = random.Random(42)
+    warehouse_id = db.warehouses.insert_one({
+        'name': 'Warehouse 1 - Indiranagar', 'latitude': 12.9716, 'longitude': 77.5946,
+        'city': 'Bangalore', 'created_at': datetime.utcnow()
+    }).inserted_id
+    db.agents.insert_many([{
+        'name': f'Agent {index}', 'warehouse_id': str(warehouse_id), 'phone': f'+91-90000000{index:02d}',
+        'vehicle_type': 'three_wheeler', 'is_checked_in': True, 'checked_in_at': datetime.utcnow(),
+        'created_at': datetime.utcnow()
+    } for index in range(agents)])
+    db.orders.insert_many([{
+        'order_id': f'ORD{index:06d}', 'customer_name': 'Priya Nair', 'customer_phone': '+91-9000000000',
+        'delivery_address': f'{index}, Indiranagar, Bangalore',
+        'latitude': 12.9716 + rng.uniform(-0.03, 0.03), 'longitude': 77.5946 + rng.uniform(-0.03, 0.03),
+        'warehouse_id': str(warehouse_id), 'order_date': date.today().isoformat(), 'status': 'pending',
+        'assigned_agent_id': None, 'assigned_at': None, 'defer_count': 0, 'created_at': datetime.utcnow()
+    } for index in range(orders)])
+
+def _configure():
+    for name, value in OVERRIDES.items():
+        setattr(Config, name, value)
+
+def _crashing_worker(crash_at: int):
+    """Worker killed while saving its crash_at-th assignment, after the orders were claimed"""
+    _configure()
+    from models import Assignment
+    create = Assignment.create
+    saved = []
+    
+    def create_or_die(assignment_data):
+        if len(saved) + 1 == crash_at:
+            os.kill(os.getpid(), getattr(signal, 'SIGKILL', signal.SIGTERM))
+        saved.append(assignment_data['_id'])
+        return create(assignment_data)
+    Assignment.create = create_or_die
+    AllocationWorker().run(exit_when_idle=True)
+
+def _worker():
+    _configure()
+    AllocationWorker().run(exit_when_idle=True)
+
+def orphaned_orders():
+    """Orders marked assigned whose assignment was never saved"""
+    saved = {assignment['_id'] for assignment in db.assignments.find({}, {'_id': 1})}
+    return [order for order in db.orders.find({'status': 'assigned'}) if order.get('assignment_id') not in saved]
+
+def test_worker_killed_mid_commit():
+    db.client.drop_database(Config.DB_NAME)
+    seed()
+    batch = AllocationCoordinator().enqueue(time_budget=1)
+    context = multiprocessing.get_context('spawn')
+    
+    crashed = context.Process(target=_crashing_worker, args=(2,))
+    crashed.start()
+    crashed.join(timeout=300)
+    assert crashed.exitcode not in (0, None), f"worker was not killed (exit code {crashed.exitcode})"
+    orphans = orphaned_orders()
+    assert orphans, "the worker died before claiming any orders"
+    held_agent = orphans[0]['assigned_agent_id']
+    run = db.allocation_runs.find_one({'status': 'running'})
+    assert run is not None and run['lease_until'] > datetime.utcnow(), "the dead run's lease should still be live"
+    print(f"✓ Worker killed mid-commit: {len(orphans)} orders claimed without an assignment, "
+          f"run lease live for {(run['lease_until'] - datetime.utcnow()).total_seconds():.0f}s")
+    
+    # Let the task lease (not the run lease) expire, then let a healthy worker reclaim the task
+    time.sleep(OVERRIDES['TASK_LEASE_SECONDS'] + 1)
+    worker = context.Process(target=_worker)
+    worker.start()
+    worker.join(timeout=300)
+    assert worker.exitcode == 0
+    
+    status = AllocationCoordinator().status(batch['batch_id'])
+    assert status['finished'] and status['done'] == status['tasks'], status
+    runs = list(db.allocation_runs.find({'date': date.today().isoformat()}))
+    assert len(runs) == 1 and runs[0]['status'] == 'completed', "the retried task should take over the dead run"
+    assert not orphaned_orders()
+    
+    assignments = list(db.assignments.find({'assignment_date': date.today().isoformat()}))
+    assigned_agents = {assignment['agent_id'] for assignment in assignments}
+    assert held_agent in assigned_agents, "the agent the dead run held lost their route"
+    claimed_agents = {str(agent['_id']) for agent in db.agents.find({'allocated_date': date.today().isoformat()})}
+    assert claimed_agents <= assigned_agents, "agents claimed without an assignment"
+    assert sum(len(assignment['order_ids']) for assignment in assignments) == \
+        db.orders.count_documents({'status': 'assigned'})
+    print(f"✓ Retried task took over the run: {len(assignments)} assignments, no orphaned orders or agents")
+
+def cleanup_database():
+    db.client.drop_database(Config.DB_NAME)
+    print("✓ Test database dropped")
+
+if __name__ == "__main__":
+    print("="*60)
+    print("DISTRIBUTED ALLOCATION RECOVERY TEST")
+    print("="*60)
+    try:
+        test_worker_killed_mid_commit()
+    finally:
+        cleanup_database()
+    print("\nDistributed allocation recovery test passed!")
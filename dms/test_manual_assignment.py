@@ -47,12 +47,12 @@ if orders:
         # Create assignment manually
         assignment_data = {
             'agent_id': agent_id,
-            'order_ids': [str(order['_id']) for order in orders],
             'assignment_date': date.today().isoformat(),
             'total_distance': metrics['total_distance'],
             'total_time': metrics['total_time'],
             'earning_per_order': metrics['earning_per_order'],
             'total_earning': metrics['total_earning'],
+            **AssignmentUtils.route_fields(orders, metrics),
             'created_at': datetime.utcnow()
         }
         
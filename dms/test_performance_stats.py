@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Test the daily performance rollups as an agent-day crosses payment tiers
+
+Assignments are recorded one at a time, and concurrently from several
+threads, for agents whose day crosses TIER_1 and TIER_2. After every step
+the warehouse's tier histogram must count each agent-day once, in the
+agent's current tier, and match what rebuild_day computes from the
+assignments.
+
+Needs a running mongod; everything is written to its own database,
+dms_test_stats, which is dropped afterwards.
+    
+    python test_performance_stats.py
+"""
+
+import sys
+import os
+import threading
+from datetime import date
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Never touch the real database
+os.environ['DB_NAME'] = 'dms_test_stats'
+
+from bson import ObjectId
+from config import Config
+from database import db
+from performance_stats import PerformanceStats, TIERS
+
+DAY = date(2024, 5, 1)
+WAREHOUSE_ID = str(ObjectId())
+
+def record(agent_id: str, orders: int):
+    """Save an assignment of orders orders and add it to the rollups, as a commit does"""
+    assignment = {
+        'agent_id': agent_id, 'warehouse_id': WAREHOUSE_ID, 'assignment_date': DAY.isoformat(),
+        'order_ids': [str(ObjectId()) for _ in range(orders)],
+        'total_distance': 1.5 * orders, 'total_time': 0.1 * orders, 'total_earning': 30 * orders
+    }
+    db.assignments.insert_one(dict(assignment))
+    PerformanceStats.record_assignment(assignment, WAREHOUSE_ID)
+
+def warehouse_rollup():
+    """(tier histogram, agent-days, orders) of the warehouse's day"""
+    rollup = db.warehouse_daily_stats.find_one({'_id': f'{WAREHOUSE_ID}:{DAY.isoformat()}'}) or {}
+    return {name: rollup.get('tiers', {}).get(name, 0) for name in TIERS}, rollup.get('agents', 0), rollup.get('orders', 0)
+
+def agent_tier(agent_id: str) -> str:
+    return db.agent_daily_stats.find_one({'_id': f'{agent_id}:{DAY.isoformat()}'})['tier']
+
+def assert_matches_rebuild():
+    incremental = warehouse_rollup()
+    PerformanceStats.rebuild_day(DAY)
+    assert warehouse_rollup() == incremental, (incremental, warehouse_rollup())
+
+def test_agent_day_crosses_tiers():
+    """An agent moving DEFAULT -> TIER_1 -> TIER_2 stays one agent-day, counted in its current tier"""
+    db.client.drop_database(Config.DB_NAME)
+    agent_id = str(ObjectId())
+    steps = [
+        (Config.TIER_1_ORDERS - 1, 'DEFAULT'),
+        (1, 'TIER_1'),                                           # exactly TIER_1_ORDERS
+        (Config.TIER_2_ORDERS - Config.TIER_1_ORDERS, 'TIER_2'),  # exactly TIER_2_ORDERS
+        (5, 'TIER_2')
+    ]
+    total = 0
+    for orders, tier in steps:
+        record(agent_id, orders)
+        total += orders
+        assert agent_tier(agent_id) == tier
+        tiers, agents, recorded = warehouse_rollup()
+        assert tiers == {name: int(name == tier) for name in TIERS}, tiers
+        assert agents == 1 and recorded == total
+    
+    # A second agent skips TIER_1 in one assignment
+    other = str(ObjectId())
+    record(other, 3)
+    record(other, Config.TIER_2_ORDERS)
+    assert agent_tier(other) == 'TIER_2'
+    assert warehouse_rollup()[:2] == ({'DEFAULT': 0, 'TIER_1': 0, 'TIER_2': 2}, 2)
+    
+    assert_matches_rebuild()
+    history = PerformanceStats.agent_history(agent_id, DAY, DAY)
+    assert history['tier_days']['TIER_2'] == 1 and all('previous_tier' not in day for day in history['days'])
+    print("✓ Agent-days crossing TIER_1 and TIER_2 are counted once, in their current tier")
+
+def test_concurrent_assignments():
+    """Assignments of one agent-day recorded from several threads at once keep the histogram exact"""
+    db.client.drop_database(Config.DB_NAME)
+    agent_ids = [str(ObjectId()) for _ in range(3)]
+    per_thread = Config.TIER_2_ORDERS // 4 + 1
+    
+    def worker():
+        for _ in range(per_thread):
+            for agent_id in agent_ids:
+                record(agent_id, 1)
+    
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    tiers, agents, orders = warehouse_rollup()
+    assert all(agent_tier(agent_id) == 'TIER_2' for agent_id in agent_ids)
+    assert tiers == {'DEFAULT': 0, 'TIER_1': 0, 'TIER_2': len(agent_ids)}, tiers
+    assert agents == len(agent_ids) and orders == 4 * per_thread * len(agent_ids)
+    assert_matches_rebuild()
+    print(f"✓ {4 * per_thread * len(agent_ids)} concurrent assignments leave one agent-day per agent in TIER_2")
+
+def cleanup_database():
+    db.client.drop_database(Config.DB_NAME)
+    print("✓ Test database dropped")
+
+if __name__ == "__main__":
+    print("="*60)
+    print("PERFORMANCE STATS TEST")
+    print("="*60)
+    try:
+        test_agent_day_crosses_tiers()
+        test_concurrent_assignments()
+    finally:
+        cleanup_database()
+    print("\nAll performance stats tests passed!")
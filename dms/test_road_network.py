@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Test road network distances against plain Dijkstra
+
+Small random JSON graphs around a warehouse, with two-way and one-way
+streets, an isolated node and a one-way dead end, are loaded through
+RoadNetwork.load. The contraction hierarchy's node_matrix must equal
+Dijkstra on the original graph for every pair of nodes that
+_largest_component keeps, and the nodes outside the largest strongly
+connected component must be dropped. No MongoDB server is needed.
+    
+    python test_road_network.py
+"""
+
+import sys
+import os
+import heapq
+import json
+import random
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from road_network import RoadNetwork
+from spatial_index import GridIndex
+
+WAREHOUSE = (12.9716, 77.5946)
+
+def random_graph(rng: random.Random, size: int = 6):
+    """Jittered size x size street grid as a directed JSON graph, plus nodes outside the grid's component.
+    
+    Returns the JSON document, the (u, v, km) edges it describes and the
+    isolated and dead-end nodes.
+    """
+    nodes = [(WAREHOUSE[0] + 0.004 * row + rng.uniform(-0.001, 0.001),
+              WAREHOUSE[1] + 0.004 * column + rng.uniform(-0.001, 0.001))
+             for row in range(size) for column in range(size)]
+    json_edges, edges = [], []
+    
+    def street(u, v, one_way):
+        # Some streets carry their length, the rest use the straight line between their ends
+        if rng.random() < 0.5:
+            km = GridIndex.distance_km(*nodes[u], *nodes[v]) * rng.uniform(1.0, 1.6)
+            json_edges.append([u, v, km])
+        else:
+            km = GridIndex.distance_km(*nodes[u], *nodes[v])
+            json_edges.append([u, v])
+        edges.append((u, v, km))
+        if not one_way:
+            json_edges.append([v, u] + json_edges[-1][2:])
+            edges.append((v, u, km))
+    
+    for row in range(size):
+        for column in range(size):
+            node = row * size + column
+            for neighbour in ([node + 1] if column + 1 < size else []) + ([node + size] if row + 1 < size else []):
+                if rng.random() < 0.25:
+                    street(*rng.sample([node, neighbour], 2), one_way=True)
+                else:
+                    street(node, neighbour, one_way=False)
+    
+    # An isolated node, and a dead end that can be driven into but not out of
+    isolated = len(nodes)
+    nodes.append((WAREHOUSE[0] - 0.01, WAREHOUSE[1] - 0.01))
+    dead_end = len(nodes)
+    nodes.append((WAREHOUSE[0] - 0.004, WAREHOUSE[1]))
+    street(0, dead_end, one_way=True)
+    return {'nodes': nodes, 'edges': json_edges, 'directed': True}, edges, (isolated, dead_end)
+
+def dijkstra(n: int, edges, source: int) -> np.ndarray:
+    adjacency = [[] for _ in range(n)]
+    for u, v, km in edges:
+        adjacency[u].append((v, km))
+    dist = np.full(n, np.inf)
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    while heap:
+        d, node = heapq.heappop(heap)
+        if d > dist[node]:
+            continue
+        for nxt, km in adjacency[node]:
+            if d + km < dist[nxt]:
+                dist[nxt] = d + km
+                heapq.heappush(heap, (d + km, nxt))
+    return dist
+
+def load(directory: str, graph: dict) -> RoadNetwork:
+    path = os.path.join(directory, 'roads.json')
+    with open(path, 'w') as f:
+        json.dump(graph, f)
+    return RoadNetwork.load(path)
+
+def test_node_matrix_matches_dijkstra():
+    """Every kept pair's road distance is the shortest path, one-way streets respected"""
+    rng = random.Random(30)
+    one_way_pairs = 0
+    for _ in range(8):
+        graph, edges, outside = random_graph(rng)
+        n = len(graph['nodes'])
+        reference = np.array([dijkstra(n, edges, source) for source in range(n)])
+        
+        with tempfile.TemporaryDirectory() as directory:
+            network = load(directory, graph)
+            # Kept nodes keep their coordinates, which the jitter makes unique
+            position = {tuple(point): index for index, point in enumerate(graph['nodes'])}
+            kept = [position[(lat, lon)] for lat, lon in zip(network.latitudes, network.longitudes)]
+            
+            # Exactly the largest strongly connected component is kept
+            components = {frozenset(np.nonzero(np.isfinite(reference[node]) & np.isfinite(reference[:, node]))[0])
+                          for node in range(n)}
+            largest = max(components, key=len)
+            assert set(kept) == largest and len(network) == len(largest)
+            assert not set(outside) & set(kept), "nodes outside the largest component were kept"
+            
+            matrix = network.node_matrix(list(range(len(network))), list(range(len(network))))
+            expected = reference[np.ix_(kept, kept)]
+            assert np.allclose(matrix, expected, rtol=1e-9, atol=1e-12), np.abs(matrix - expected).max()
+            one_way_pairs += int((~np.isclose(expected, expected.T)).sum())
+            
+            # The pickled hierarchy gives the same distances
+            cached = RoadNetwork.load(os.path.join(directory, 'roads.json'))
+            assert np.allclose(cached.node_matrix(list(range(len(cached))), list(range(len(cached)))), matrix)
+    assert one_way_pairs, "no pair was one-way"
+    print(f"✓ node_matrix equals Dijkstra on 8 graphs ({one_way_pairs} asymmetric pairs), "
+          f"nodes outside the largest component dropped")
+
+def test_undirected_graph():
+    """Undirected JSON edges go both ways, so the matrix is symmetric"""
+    graph, _, _ = random_graph(random.Random(31), size=4)
+    graph['directed'] = False
+    # Listed once each; the loader adds the reverse edges
+    streets = {}
+    for edge in graph['edges']:
+        streets.setdefault(frozenset(edge[:2]), edge)
+    graph['edges'] = list(streets.values())
+    with tempfile.TemporaryDirectory() as directory:
+        network = load(directory, graph)
+        nodes = list(range(len(network)))
+        matrix = network.node_matrix(nodes, nodes)
+    assert len(network) == len(graph['nodes']) - 1, "only the isolated node should be dropped"
+    assert np.allclose(matrix, matrix.T) and np.isfinite(matrix).all()
+    print("✓ Undirected graphs give symmetric distances")
+
+def test_distance_matrix_on_nodes():
+    """Coordinates on graph nodes get the node distances, with or without a cache scope"""
+    graph, _, _ = random_graph(random.Random(32))
+    with tempfile.TemporaryDirectory() as directory:
+        network = load(directory, graph)
+        nodes = list(range(0, len(network), 3))
+        points = [(network.latitudes[node], network.longitudes[node]) for node in nodes]
+        expected = network.node_matrix(nodes, nodes)
+        np.fill_diagonal(expected, 0.0)
+        assert np.allclose(network.distance_matrix(points, points), expected)
+        # A scope grown over two queries equals one query of all the points
+        network.distance_matrix(points[:4], points[:4], scope=WAREHOUSE)
+        assert np.allclose(network.distance_matrix(points, points, scope=WAREHOUSE), expected)
+    print("✓ distance_matrix on graph nodes matches node_matrix, scoped or not")
+
+if __name__ == "__main__":
+    print("="*60)
+    print("ROAD NETWORK TEST")
+    print("="*60)
+    test_node_matrix_matches_dijkstra()
+    test_undirected_graph()
+    test_distance_matrix_on_nodes()
+    print("\nAll road network tests passed!")
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Test that the route bounds prefilter never rejects a feasible route
+
+Random order sets around a warehouse, sized to straddle the daily distance
+limit, are settled by AssignmentUtils.prefilter and then routed in full by
+check_route_constraints. The allocation prefix search must route only
+the prefixes the bounds leave open and pick the same set as routing every
+prefix. No MongoDB server is needed.
+    
+    python test_route_bounds.py
+"""
+
+import sys
+import os
+import random
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from bson import ObjectId
+import distance_cache
+from distance_cache import DistanceCache
+from utils import LocationUtils, AssignmentUtils
+from allocation_engine import OrderAllocationEngine
+from config import Config
+
+WAREHOUSE = {'latitude': 12.9716, 'longitude': 77.5946}
+
+def random_instance(rng: random.Random):
+    """Warehouse-relative order set whose route is often near the distance limit"""
+    count = rng.randint(1, 40)
+    spread = rng.choice([0.02, 0.1, 0.25, 0.5])
+    return [{
+        'order_id': f'ORD{index:03d}',
+        'latitude': WAREHOUSE['latitude'] + rng.uniform(-spread, spread),
+        'longitude': WAREHOUSE['longitude'] + rng.uniform(-spread, spread)
+    } for index in range(count)]
+
+def settle(orders):
+    """(prefilter decision, whether the full route check accepts the set)"""
+    warehouse_coords = (WAREHOUSE['latitude'], WAREHOUSE['longitude'])
+    delivery_coords = [(order['latitude'], order['longitude']) for order in orders]
+    decision = AssignmentUtils.prefilter(warehouse_coords, delivery_coords)
+    # Passing the route skips the prefilter inside the check
+    route = LocationUtils.optimize_route(warehouse_coords, delivery_coords)
+    feasible, _ = AssignmentUtils.check_route_constraints(WAREHOUSE, orders, route=route)
+    return decision, feasible
+
+def check_instances(seed: int, count: int):
+    rng = random.Random(seed)
+    decisions = {True: 0, False: 0, None: 0}
+    for _ in range(count):
+        orders = random_instance(rng)
+        decision, feasible = settle(orders)
+        decisions[decision] += 1
+        assert not (decision is False and feasible), \
+            f"prefilter rejected a feasible set of {len(orders)} orders"
+        assert not (decision is True and not feasible), \
+            f"prefilter accepted an infeasible set of {len(orders)} orders"
+    return decisions
+
+def test_prefilter_never_rejects_feasible_routes():
+    """Straight-line distances, as without a cache or road network"""
+    decisions = check_instances(seed=35, count=300)
+    # The instances must exercise every outcome to mean anything
+    assert all(decisions.values()), decisions
+    print(f"✓ 300 random sets: {decisions[False]} pruned, {decisions[True]} proven feasible, "
+          f"{decisions[None]} routed")
+
+def test_prefilter_with_distance_cache():
+    """Cached distances snap to cells, so the bounds must allow each leg's slack"""
+    with tempfile.TemporaryDirectory() as directory:
+        previous = distance_cache._distance_cache
+        distance_cache._distance_cache = DistanceCache(os.path.join(directory, 'distances.sqlite'),
+                                                       precision=Config.DISTANCE_CACHE_PRECISION)
+        try:
+            decisions = check_instances(seed=36, count=150)
+        finally:
+            distance_cache._distance_cache.close()
+            distance_cache._distance_cache = previous
+    assert decisions[False], decisions
+    print(f"✓ 150 random sets with the distance cache: {decisions[False]} pruned, "
+          f"{decisions[True]} proven feasible, {decisions[None]} routed")
+
+def test_minimum_earning():
+    """A set too small to reach the minimum earning is rejected by both"""
+    orders = [{'order_id': 'ORD000', 'latitude': 12.98, 'longitude': 77.60}]
+    if Config.DEFAULT_PAYMENT >= Config.MIN_DAILY_EARNING:
+        print("✓ Minimum earning check skipped, one order already earns the minimum")
+        return
+    decision, feasible = settle(orders)
+    assert decision is False and not feasible
+    print("✓ Single order below the minimum earning rejected by prefilter and route check")
+
+def test_prefix_search_routes_only_open_prefixes():
+    """Pruned prefixes are not routed, a proven one is routed once, and the chosen set is unchanged"""
+    rng = random.Random(37)
+    engine = OrderAllocationEngine()
+    warehouse = dict(WAREHOUSE, _id=ObjectId())
+    agent = {'name': 'Agent 1', 'vehicle_type': 'van'}
+    check = AssignmentUtils.check_route_constraints
+    routed = []
+    
+    def counted_check(warehouse, orders, route=None, capacity=None, matrix=None):
+        routed.append(len(orders))
+        return check(warehouse, orders, route, capacity, matrix)
+    
+    outcomes = {'pruned prefixes': 0, 'routed once': 0}
+    try:
+        for _ in range(40):
+            # Near orders first, far ones last, so long prefixes are pruned and shorter ones proven
+            orders = [{'_id': ObjectId(), 'order_id': f'ORD{index:03d}',
+                       'latitude': WAREHOUSE['latitude'] + rng.uniform(-spread, spread),
+                       'longitude': WAREHOUSE['longitude'] + rng.uniform(-spread, spread)}
+                      for index, spread in enumerate([0.01] * rng.randint(5, 30) + [0.6] * rng.randint(0, 15))]
+            target = rng.randint(Config.MIN_ORDERS_PER_AGENT, len(orders))
+            
+            # Routing every prefix from the longest down, as without the bounds
+            expected = []
+            for count in range(target, Config.MIN_ORDERS_PER_AGENT - 1, -1):
+                if check(warehouse, orders[:count], capacity=120)[0]:
+                    expected = orders[:count]
+                    break
+            
+            routed.clear()
+            AssignmentUtils.check_route_constraints = staticmethod(counted_check)
+            try:
+                chosen, metrics = engine._find_optimal_order_set(agent, orders, warehouse, target)
+            finally:
+                AssignmentUtils.check_route_constraints = staticmethod(check)
+            assert chosen == expected, (len(chosen), len(expected))
+            if chosen:
+                assert metrics['total_distance'] == check(warehouse, chosen, capacity=120)[1]['total_distance']
+            assert len(set(routed)) == len(routed), f"a prefix was routed twice: {routed}"
+            assert all(count <= target for count in routed)
+            if routed and routed[0] < target:
+                outcomes['pruned prefixes'] += 1
+            if routed == [len(chosen)]:
+                outcomes['routed once'] += 1
+    finally:
+        AssignmentUtils.check_route_constraints = staticmethod(check)
+    assert all(outcomes.values()), outcomes
+    print(f"✓ Prefix search skips pruned prefixes and picks the same set: {outcomes}")
+
+if __name__ == "__main__":
+    print("="*60)
+    print("ROUTE BOUNDS PREFILTER TEST")
+    print("="*60)
+    test_prefilter_never_rejects_feasible_routes()
+    test_prefilter_with_distance_cache()
+    test_minimum_earning()
+    test_prefix_search_routes_only_open_prefixes()
+    print("\nAll route bounds tests passed!")
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Test the route memo: set fingerprints, LRU eviction and cache correctness
+
+A memoized route must be exactly what routing the set again would give,
+whichever order its ids arrive in, when fingerprints collide, and after
+the warehouse moves, the distance provider changes or the vehicle
+capacity changes. No MongoDB server is needed.
+    
+    python test_route_memo.py
+"""
+
+import sys
+import os
+import math
+import random
+import tempfile
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import route_memo as route_memo_module
+import distance_cache
+from distance_cache import DistanceCache
+from route_memo import RouteMemo, route_memo
+from utils import LocationUtils, AssignmentUtils
+from bson import ObjectId
+
+WAREHOUSE_POINT = (0.0, 0.0)
+
+def euclidean(origin, destination):
+    return math.hypot(origin[0] - destination[0], origin[1] - destination[1])
+
+def by_id(stops):
+    """build() that routes a set in order-id order, counting its calls"""
+    def build():
+        build.calls += 1
+        return sorted(stops)
+    build.calls = 0
+    return build
+
+def route_legs(stops, sequence, warehouse_point=WAREHOUSE_POINT):
+    points = [warehouse_point] + [stops[order_id] for order_id in sequence]
+    return [euclidean(points[i], points[i + 1]) for i in range(len(sequence))]
+
+def test_fingerprint_order_independent():
+    """The same ids in any order are the same set and a memo hit"""
+    ids = [f'ORD{index:03d}' for index in range(20)]
+    shuffled = ids[:]
+    random.Random(36).shuffle(shuffled)
+    assert RouteMemo.fingerprint(ids) == RouteMemo.fingerprint(shuffled)
+    assert RouteMemo.fingerprint(ids) != RouteMemo.fingerprint(ids[1:])
+    
+    memo = RouteMemo(max_entries=10)
+    stops = {order_id: (index, index % 3) for index, order_id in enumerate(ids)}
+    first = memo.route('W1', WAREHOUSE_POINT, stops, by_id(stops), euclidean)
+    reordered = {order_id: stops[order_id] for order_id in shuffled}
+    build = by_id(reordered)
+    second = memo.route('W1', WAREHOUSE_POINT, reordered, build, euclidean)
+    assert second == first and build.calls == 0 and memo.hits == 1
+    print("✓ Fingerprints and memo hits do not depend on id order")
+
+def test_fingerprint_collisions():
+    """Sets whose fingerprints collide never reuse each other's route"""
+    original = route_memo_module.order_hash
+    # Every id hashes alike, so every even-sized set XORs to 0 and every odd one to 1
+    route_memo_module.order_hash = lambda order_id: 1
+    try:
+        memo = RouteMemo(max_entries=10)
+        first = {'A': (1, 0), 'B': (2, 0)}
+        other = {'C': (0, 1), 'D': (0, 2)}
+        assert memo.fingerprint(first) == memo.fingerprint(other)
+        memo.route('W1', WAREHOUSE_POINT, first, by_id(first), euclidean)
+        
+        build = by_id(other)
+        sequence, legs = memo.route('W1', WAREHOUSE_POINT, other, build, euclidean)
+        assert build.calls == 1 and sequence == ['C', 'D']
+        assert legs == route_legs(other, sequence)
+        
+        # One order off a colliding set is not a neighbour either
+        larger = {'C': (0, 1), 'D': (0, 2), 'E': (0, 3)}
+        build = by_id(larger)
+        sequence, legs = memo.route('W1', WAREHOUSE_POINT, larger, build, euclidean)
+        assert set(sequence) == set(larger) and legs == route_legs(larger, sequence)
+        assert memo.hits == 0
+    finally:
+        route_memo_module.order_hash = original
+    print("✓ Colliding fingerprints fall back to routing the set")
+
+def test_lru_eviction():
+    """The least recently used set is evicted first"""
+    memo = RouteMemo(max_entries=2)
+    sets = {name: {f'{name}{index}': (index, ord(name)) for index in range(3)} for name in 'XYZ'}
+    memo.route('W1', WAREHOUSE_POINT, sets['X'], by_id(sets['X']), euclidean)
+    memo.route('W1', WAREHOUSE_POINT, sets['Y'], by_id(sets['Y']), euclidean)
+    memo.route('W1', WAREHOUSE_POINT, sets['X'], by_id(sets['X']), euclidean)  # X is now the most recent
+    memo.route('W1', WAREHOUSE_POINT, sets['Z'], by_id(sets['Z']), euclidean)
+    assert memo.stats()['entries'] == 2
+    
+    build = by_id(sets['X'])
+    memo.route('W1', WAREHOUSE_POINT, sets['X'], build, euclidean)
+    assert build.calls == 0
+    build = by_id(sets['Y'])
+    memo.route('W1', WAREHOUSE_POINT, sets['Y'], build, euclidean)
+    assert build.calls == 1
+    print("✓ LRU keeps recently used sets and evicts the oldest")
+
+def test_neighbours_match_their_legs():
+    """Extended and shrunk routes carry the legs of the sequence they return"""
+    rng = random.Random(7)
+    stops = {f'ORD{index:03d}': (rng.uniform(-5, 5), rng.uniform(-5, 5)) for index in range(15)}
+    ids = sorted(stops)
+    # Growing sets extend the previous one, shrinking prefixes cut the previous one
+    growing, shrinking = RouteMemo(max_entries=100), RouteMemo(max_entries=100)
+    for memo, sizes in ((growing, range(1, 16)), (shrinking, range(15, 0, -1))):
+        for size in sizes:
+            subset = {order_id: stops[order_id] for order_id in ids[:size]}
+            sequence, legs = memo.route('W1', WAREHOUSE_POINT, subset, by_id(subset), euclidean)
+            assert sorted(sequence) == sorted(subset)
+            assert all(math.isclose(a, b) for a, b in zip(legs, route_legs(subset, sequence)))
+    assert growing.extended == 14 and shrinking.shrunk == 14
+    print("✓ Extended and shrunk routes match their legs")
+
+def check(warehouse, orders, capacity=None):
+    accepted, metrics = AssignmentUtils.check_route_constraints(warehouse, orders, capacity=capacity)
+    assert accepted, metrics
+    return metrics['total_distance'], metrics['legs'], metrics['sequence'], metrics['reloads']
+
+def test_cached_matches_recomputed():
+    """After the warehouse moves or the capacity changes, a memoized check equals a fresh one"""
+    rng = random.Random(11)
+    warehouse = {'_id': ObjectId(), 'latitude': 12.9716, 'longitude': 77.5946}
+    orders = [{'_id': ObjectId(), 'order_id': f'ORD{index:03d}',
+               'latitude': 12.9716 + rng.uniform(-0.05, 0.05),
+               'longitude': 77.5946 + rng.uniform(-0.05, 0.05)} for index in range(12)]
+    
+    route_memo.clear()
+    check(warehouse, orders)
+    moved = dict(warehouse, latitude=13.0100, longitude=77.6400)
+    cached = check(moved, orders)
+    route_memo.clear()
+    assert cached == check(moved, orders)
+    
+    check(warehouse, orders)
+    for capacity in (None, 5, 3):
+        cached = check(warehouse, orders, capacity)
+        route_memo.clear()
+        assert cached == check(warehouse, orders, capacity)
+    route_memo.clear()
+    print("✓ Memoized routes match recomputation after the warehouse moves or the capacity changes")
+
+def test_provider_change():
+    """Legs measured by one distance provider are not reused under another"""
+    memo = RouteMemo(max_entries=10)
+    stops = {'A': (1, 0), 'B': (2, 0)}
+    memo.route('W1', WAREHOUSE_POINT, stops, by_id(stops), euclidean, ('geodesic',))
+    build = by_id(stops)
+    memo.route('W1', WAREHOUSE_POINT, stops, build, euclidean, ('road', ('roads.json', 1.0)))
+    assert build.calls == 1 and memo.hits == 0
+    
+    rng = random.Random(12)
+    warehouse = {'_id': ObjectId(), 'latitude': 12.9716, 'longitude': 77.5946}
+    orders = [{'_id': ObjectId(), 'order_id': f'ORD{index:03d}',
+               'latitude': 12.9716 + rng.uniform(-0.05, 0.05),
+               'longitude': 77.5946 + rng.uniform(-0.05, 0.05)} for index in range(12)]
+    route_memo.clear()
+    check(warehouse, orders)
+    with tempfile.TemporaryDirectory() as directory:
+        previous = distance_cache._distance_cache
+        # A coarse cache, so its distances differ visibly from geodesic ones
+        distance_cache._distance_cache = DistanceCache(os.path.join(directory, 'distances.sqlite'), precision=5)
+        try:
+            assert LocationUtils.distance_provider()[0] == 'cache'
+            cached = check(warehouse, orders)
+            route_memo.clear()
+            assert cached == check(warehouse, orders)
+        finally:
+            distance_cache._distance_cache.close()
+            distance_cache._distance_cache = previous
+    route_memo.clear()
+    print("✓ Memoized legs are not reused after the distance provider changes")
+
+if __name__ == "__main__":
+    print("="*60)
+    print("ROUTE MEMO TEST")
+    print("="*60)
+    test_fingerprint_order_independent()
+    test_fingerprint_collisions()
+    test_lru_eviction()
+    test_neighbours_match_their_legs()
+    test_cached_matches_recomputed()
+    test_provider_change()
+    print("\nAll route memo tests passed!")
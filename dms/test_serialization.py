@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""
+Test API response encoding and compression
+
+Responses go through create_app(start_scheduler=False).test_client(), so
+BSONJSONProvider and compress_response are exercised as the API serves
+them: BSON and numpy values, non-string keys, NaN and infinity, the
+standard library fallback without orjson, and Accept-Encoding
+negotiation. No MongoDB
+server is needed.
+    
+    python test_serialization.py
+"""
+
+import sys
+import os
+import gzip
+import json
+from datetime import date, datetime, timezone, timedelta
+from decimal import Decimal
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from flask import jsonify, request
+from bson import ObjectId, Decimal128
+from app import create_app
+from config import Config
+import serialization
+
+OBJECT_ID = ObjectId('6650f1c2a1b2c3d4e5f60718')
+
+def document():
+    """An order as MongoDB returns it, with the types handlers pass straight through"""
+    return {
+        '_id': OBJECT_ID,
+        'warehouse_id': ObjectId('6650f1c2a1b2c3d4e5f60719'),
+        'order_date': date(2024, 5, 1),
+        'created_at': datetime(2024, 5, 1, 6, 30, 15),
+        'updated_at': datetime(2024, 5, 1, 12, 0, tzinfo=timezone(timedelta(hours=5, minutes=30))),
+        'amount': Decimal128('249.50'),
+        'fee': Decimal('12.25'),
+        'tags': frozenset(['fragile']),
+        'distance_km': np.float64(3.5),
+        'stops': np.int64(7),
+        'legs_km': np.array([1.25, 2.25]),
+        'counts': {2: 'two', 1.5: 'one and a half', None: 'none'},
+        'customer_name': 'Priya Nair'
+    }
+
+EXPECTED = {
+    '_id': '6650f1c2a1b2c3d4e5f60718',
+    'warehouse_id': '6650f1c2a1b2c3d4e5f60719',
+    'order_date': '2024-05-01',
+    'created_at': '2024-05-01T06:30:15+00:00',
+    'updated_at': '2024-05-01T12:00:00+05:30',
+    'amount': '249.50',
+    'fee': '12.25',
+    'tags': ['fragile'],
+    'distance_km': 3.5,
+    'stops': 7,
+    'legs_km': [1.25, 2.25],
+    'counts': {'2': 'two', '1.5': 'one and a half', 'null': 'none'},
+    'customer_name': 'Priya Nair'
+}
+
+def make_client():
+    """Test client of the real app, with routes that return fixed payloads"""
+    app = create_app(start_scheduler=False)
+    
+    @app.route('/test/document')
+    def test_document():
+        return jsonify(document())
+    
+    @app.route('/test/sized/<int:size>')
+    def test_sized(size):
+        return jsonify({'padding': 'x' * size})
+    
+    @app.route('/test/echo', methods=['POST'])
+    def test_echo():
+        return jsonify(request.get_json())
+    
+    return app.test_client()
+
+def test_bson_types():
+    """ObjectIds, datetimes, decimals, sets and numpy values encode as plain JSON"""
+    response = make_client().get('/test/document', headers={'Accept-Encoding': 'identity'})
+    assert response.status_code == 200 and response.mimetype == 'application/json'
+    assert json.loads(response.data) == EXPECTED
+    # Keys keep the order they have in the document
+    assert list(json.loads(response.data)) == list(EXPECTED)
+    print("✓ BSON, datetime and numpy values encoded")
+
+def test_stdlib_fallback():
+    """Without orjson the standard library encoder gives the same bytes"""
+    client = make_client()
+    with_orjson = client.get('/test/document', headers={'Accept-Encoding': 'identity'}).data
+    fast = serialization.orjson
+    serialization.orjson = None
+    try:
+        fallback = client.get('/test/document', headers={'Accept-Encoding': 'identity'}).data
+        echoed = client.post('/test/echo', json={'a': [1, 2.5, None], 'b': 'é'},
+                             headers={'Accept-Encoding': 'identity'})
+    finally:
+        serialization.orjson = fast
+    assert fallback == with_orjson, (fallback, with_orjson)
+    assert json.loads(echoed.data) == {'a': [1, 2.5, None], 'b': 'é'}
+    print(f"✓ Standard library fallback matches {'orjson' if fast is not None else 'itself'} byte for byte")
+
+def test_non_finite_floats():
+    """NaN and infinity, numpy ones included, are null with orjson and without it"""
+    payload = {'nan': float('nan'), 'inf': float('inf'), 'ninf': -np.inf, 'scalar': np.float64('nan'),
+               'single': np.float32('inf'), 'array': np.array([1.5, np.nan]), 'nested': [(2.5, float('nan'))],
+               'tags': frozenset([float('inf')]), float('nan'): 'key', 'finite': 0.1}
+    expected = {'nan': None, 'inf': None, 'ninf': None, 'scalar': None, 'single': None,
+                'array': [1.5, None], 'nested': [[2.5, None]], 'tags': [None], 'null': 'key', 'finite': 0.1}
+    fast = serialization.orjson
+    encoded = {}
+    try:
+        for name, module in (('orjson', fast), ('stdlib', None)):
+            if name == 'orjson' and fast is None:
+                continue
+            serialization.orjson = module
+            encoded[name] = serialization.dumps(payload)
+    finally:
+        serialization.orjson = fast
+    for name, data in encoded.items():
+        assert b'NaN' not in data and b'Infinity' not in data, (name, data)
+        assert json.loads(data) == expected, (name, data)
+    assert len(set(encoded.values())) == 1, encoded
+    print(f"✓ NaN and infinity encoded as null by {' and '.join(encoded)}")
+
+def test_unknown_type_fails():
+    """A type with no JSON form is an error, not a silent str()"""
+    try:
+        serialization.dumps({'value': object()})
+    except TypeError:
+        print("✓ Unknown types raise TypeError")
+        return
+    raise AssertionError('object() was encoded')
+
+def test_gzip():
+    client = make_client()
+    response = client.get('/test/document', headers={'Accept-Encoding': 'gzip'})
+    # The document alone is below COMPRESS_MIN_BYTES
+    assert 'Content-Encoding' not in response.headers
+    assert 'Accept-Encoding' in response.headers.get('Vary', '')
+    
+    response = client.get(f'/test/sized/{Config.COMPRESS_MIN_BYTES}', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert json.loads(gzip.decompress(response.data)) == {'padding': 'x' * Config.COMPRESS_MIN_BYTES}
+    print("✓ gzip for bodies of COMPRESS_MIN_BYTES or more, small bodies sent as they are")
+
+def test_brotli():
+    """Brotli is preferred when installed and accepted, gzip otherwise"""
+    client = make_client()
+    response = client.get('/test/sized/4096', headers={'Accept-Encoding': 'gzip, br'})
+    if serialization.brotli is None:
+        assert response.headers['Content-Encoding'] == 'gzip'
+        only_br = client.get('/test/sized/4096', headers={'Accept-Encoding': 'br'})
+        assert 'Content-Encoding' not in only_br.headers
+        assert json.loads(only_br.data) == {'padding': 'x' * 4096}
+        print("✓ brotli not installed: gzip chosen, br-only clients get the plain body")
+        return
+    assert response.headers['Content-Encoding'] == 'br'
+    assert json.loads(serialization.brotli.decompress(response.data)) == {'padding': 'x' * 4096}
+    response = client.get('/test/sized/4096', headers={'Accept-Encoding': 'gzip;q=1.0, br;q=0.5'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    print("✓ brotli preferred unless the client ranks gzip higher")
+
+def test_identity():
+    """identity, a refused encoding or no Accept-Encoding get the plain body"""
+    client = make_client()
+    for headers in ({'Accept-Encoding': 'identity'}, {'Accept-Encoding': 'gzip;q=0, br;q=0'}, {}):
+        response = client.get('/test/sized/4096', headers=headers)
+        assert 'Content-Encoding' not in response.headers, headers
+        assert json.loads(response.data) == {'padding': 'x' * 4096}
+    print("✓ identity and refused encodings are sent uncompressed")
+
+def test_compression_disabled():
+    enabled = Config.COMPRESS_RESPONSES
+    Config.COMPRESS_RESPONSES = False
+    try:
+        response = make_client().get('/test/sized/4096', headers={'Accept-Encoding': 'gzip'})
+    finally:
+        Config.COMPRESS_RESPONSES = enabled
+    assert 'Content-Encoding' not in response.headers
+    print("✓ COMPRESS_RESPONSES off sends every body uncompressed")
+
+if __name__ == "__main__":
+    print("="*60)
+    print("SERIALIZATION TEST")
+    print("="*60)
+    test_bson_types()
+    test_stdlib_fallback()
+    test_non_finite_floats()
+    test_unknown_type_fails()
+    test_gzip()
+    test_brotli()
+    test_identity()
+    test_compression_disabled()
+    print("\nAll serialization tests passed!")
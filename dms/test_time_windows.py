@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Test delivery window feasibility: forward slack, reloads and service time
+
+TimeWindows.fits decides insertions, removals and route joins in O(1) from
+a route's forward slack; on random instances it must agree with replaying
+the changed route. Schedules with reloads must match the replay of the
+driven route, and orders with service_minutes=None take
+DEFAULT_SERVICE_MINUTES. No MongoDB server is needed.
+    
+    python test_time_windows.py
+"""
+
+import sys
+import os
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from config import Config
+from time_windows import TimeWindows, order_window, has_windows, schedule_route
+from trips import split_trips, with_reloads, stop_legs
+from utils import LocationUtils, AssignmentUtils
+
+WAREHOUSE = {'latitude': 12.9716, 'longitude': 77.5946}
+
+def random_windows(rng: random.Random, stops: int) -> TimeWindows:
+    """Random symmetric matrix (km) with tight and open windows on stops 1..stops"""
+    points = np.array([(0.0, 0.0)] + [(rng.uniform(-8, 8), rng.uniform(-8, 8)) for _ in range(stops)])
+    matrix = np.hypot(*(points[:, None, :] - points[None, :, :]).transpose(2, 0, 1))
+    earliest, latest, service = [0.0], [np.inf], [0.0]
+    for _ in range(stops):
+        opens = rng.choice([0.0, rng.uniform(0, 120)])
+        earliest.append(opens)
+        latest.append(rng.choice([np.inf, opens + rng.uniform(10, 90)]))
+        service.append(rng.choice([0.0, 2.0, 5.0]))
+    return TimeWindows(matrix, np.array(earliest), np.array(latest), np.array(service))
+
+def test_fits_matches_replay():
+    """Insert, remove and join checks agree with scheduling the changed route"""
+    rng = random.Random(47)
+    checked = {True: 0, False: 0}
+    for _ in range(300):
+        windows = random_windows(rng, 9)
+        stops = list(range(1, 10))
+        rng.shuffle(stops)
+        route, other = stops[:5], stops[5:8]
+        spare = stops[8]
+        route_schedule, other_schedule = windows.schedule(route), windows.schedule(other)
+        if not (route_schedule.feasible and other_schedule.feasible):
+            continue
+        
+        for position in range(len(route) + 1):
+            fits = windows.fits(route, route_schedule, position - 1, spare, route, route_schedule, position)
+            assert fits == windows.feasible(route[:position] + [spare] + route[position:])
+            checked[fits] += 1
+        for position in range(len(route)):
+            fits = windows.fits(route, route_schedule, position - 1, None, route, route_schedule, position + 1)
+            assert fits == windows.feasible(route[:position] + route[position + 1:])
+            checked[fits] += 1
+        for i in range(-1, len(route)):
+            for j in range(len(other) + 1):
+                fits = windows.fits(route, route_schedule, i, None, other, other_schedule, j)
+                assert fits == windows.feasible(route[:i + 1] + other[j:])
+                checked[fits] += 1
+    assert checked[True] and checked[False], checked
+    print(f"✓ {sum(checked.values())} slack checks agree with replay "
+          f"({checked[True]} fit, {checked[False]} rejected)")
+
+def test_schedule_with_reloads_matches_replay():
+    """A schedule with reloads starts each service when the driven route reaches it"""
+    rng = random.Random(48)
+    for _ in range(100):
+        windows = random_windows(rng, 12)
+        sequence = list(range(1, 13))
+        rng.shuffle(sequence)
+        reloads, _ = split_trips(windows.matrix, sequence, rng.choice([3, 4, 5]))
+        schedule = windows.schedule(sequence, reloads)
+        
+        driven = with_reloads([0] + sequence, reloads)
+        assert len(driven) == len(sequence) + len(reloads) + 1
+        legs = stop_legs([float(windows.matrix[a, b]) for a, b in zip(driven, driven[1:])], reloads)
+        orders = [{'earliest': windows.earliest[stop], 'latest': windows.latest[stop],
+                   'service': windows.service[stop]} for stop in sequence]
+        
+        time = 0.0
+        for position, (order, leg) in enumerate(zip(orders, legs)):
+            if position in reloads:
+                time += Config.RELOAD_MINUTES
+            begin = max(time + leg * Config.MINUTES_PER_KM, order['earliest'])
+            assert abs(begin - schedule.begin[position]) < 1e-6
+            time = begin + order['service']
+        assert schedule.feasible == all(begin <= order['latest'] + 1e-9
+                                        for begin, order in zip(schedule.begin, orders))
+        
+        # Reloads only make stops later, so a move ruled out without them stays out
+        plain = windows.schedule(sequence)
+        assert all(a <= b + 1e-9 for a, b in zip(plain.begin, schedule.begin))
+        assert plain.feasible or not schedule.feasible
+    print("✓ Schedules with reloads match the replay of the driven route")
+
+def test_window_across_reload():
+    """An order reachable on the first trip is late once a reload comes before it"""
+    orders = [{'order_id': f'ORD{index}', 'latitude': 12.9716 + 0.02 * (index + 1), 'longitude': 77.5946}
+              for index in range(3)]
+    # The third stop is about 6.7 km out: 20 minutes straight, more after driving back for a reload
+    orders[2].update({'window_start': '09:00', 'window_end': '09:25'})
+    accepted, metrics = AssignmentUtils.check_route_constraints(WAREHOUSE, orders)
+    assert accepted and not metrics['reloads'], metrics
+    
+    accepted, metrics = AssignmentUtils.check_route_constraints(WAREHOUSE, orders, capacity=2)
+    assert not accepted and 'window closes' in metrics['error'], metrics
+    
+    # Opened later, the same window is met after the reload
+    orders[2].update({'window_start': '09:30', 'window_end': '10:30'})
+    accepted, metrics = AssignmentUtils.check_route_constraints(WAREHOUSE, orders, capacity=2)
+    assert accepted and metrics['reloads'], metrics
+    assert metrics['service_start'][-1] >= 30
+    print("✓ Windows are checked against the time after each reload")
+
+def test_service_minutes_none():
+    """service_minutes=None takes DEFAULT_SERVICE_MINUTES, 0 means no time at the door"""
+    default = Config.DEFAULT_SERVICE_MINUTES
+    try:
+        Config.DEFAULT_SERVICE_MINUTES = 0
+        assert order_window({'service_minutes': None}) == (0.0, np.inf, 0.0)
+        assert not has_windows([{'service_minutes': None}, {}])
+        
+        Config.DEFAULT_SERVICE_MINUTES = 4
+        assert order_window({'service_minutes': None})[2] == 4.0
+        assert order_window({})[2] == 4.0
+        assert order_window({'service_minutes': 0})[2] == 0.0
+        assert has_windows([{'service_minutes': None}])
+        
+        orders = [{'order_id': 'A', 'latitude': 12.98, 'longitude': 77.60, 'service_minutes': None},
+                  {'order_id': 'B', 'latitude': 12.99, 'longitude': 77.61, 'service_minutes': 0}]
+        begins, finish, late = schedule_route(orders, [1.0, 1.0])
+        assert begins == [3.0, 10.0] and finish == 10.0 and late is None
+    finally:
+        Config.DEFAULT_SERVICE_MINUTES = default
+    print("✓ service_minutes=None uses DEFAULT_SERVICE_MINUTES")
+
+def test_sequence_with_windows():
+    """Every placed order meets its window, and orders that cannot be met even alone are left out"""
+    rng = random.Random(49)
+    for _ in range(40):
+        orders = []
+        for index in range(10):
+            opens = rng.randint(9, 11)
+            order = {'order_id': f'ORD{index}',
+                     'latitude': WAREHOUSE['latitude'] + rng.uniform(-0.08, 0.08),
+                     'longitude': WAREHOUSE['longitude'] + rng.uniform(-0.08, 0.08),
+                     'service_minutes': rng.choice([None, 0, 3])}
+            if rng.random() < 0.6:
+                order.update({'window_start': f'{opens:02d}:00', 'window_end': f'{opens:02d}:{rng.choice([10, 30, 59])}'})
+            orders.append(order)
+        
+        sequence, unplaced = AssignmentUtils.sequence_with_windows(WAREHOUSE, orders)
+        assert sorted(sequence + unplaced) == list(range(len(orders)))
+        route = [(WAREHOUSE['latitude'], WAREHOUSE['longitude'])] + \
+                [(orders[position]['latitude'], orders[position]['longitude']) for position in sequence]
+        _, _, late = schedule_route([orders[position] for position in sequence], LocationUtils.route_legs(route))
+        assert late is None
+        for position, order in enumerate(orders):
+            alone = [(WAREHOUSE['latitude'], WAREHOUSE['longitude']), (order['latitude'], order['longitude'])]
+            _, _, late = schedule_route([order], LocationUtils.route_legs(alone))
+            assert late is None or position in unplaced
+    print("✓ sequence_with_windows keeps every window it places")
+
+if __name__ == "__main__":
+    print("="*60)
+    print("TIME WINDOWS TEST")
+    print("="*60)
+    test_fits_matches_replay()
+    test_schedule_with_reloads_matches_replay()
+    test_window_across_reload()
+    test_service_minutes_none()
+    test_sequence_with_windows()
+    print("\nAll time window tests passed!")
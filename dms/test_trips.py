@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Test splitting routes into capacity-limited trips
+
+split_trips must find the cheapest way to cut a visiting order into trips,
+checked against brute force over every set of cut points on small
+instances, and handle the edge cases: no stops, a single order exactly at
+capacity, routes that fit in one trip. The inter-route search, which
+measures routes with split_trips, must apply and count each move once.
+No MongoDB server is needed.
+    
+    python test_trips.py
+"""
+
+import sys
+import os
+import itertools
+import random
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+from config import Config
+from trips import vehicle_capacity, needs_reloads, split_trips, with_reloads, stop_legs
+from local_search import InterRouteSearch
+import routing
+
+RELOAD_KM = Config.RELOAD_MINUTES / Config.MINUTES_PER_KM
+
+def random_matrix(rng: random.Random, stops: int, symmetric: bool = True) -> np.ndarray:
+    """Distances between the warehouse (index 0) and stops 1..stops, one-way if not symmetric"""
+    points = np.array([(0.0, 0.0)] + [(rng.uniform(-10, 10), rng.uniform(-10, 10)) for _ in range(stops)])
+    matrix = np.hypot(*(points[:, None, :] - points[None, :, :]).transpose(2, 0, 1))
+    if not symmetric:
+        matrix = matrix * np.array([[rng.uniform(1.0, 1.5) for _ in range(stops + 1)] for _ in range(stops + 1)])
+        np.fill_diagonal(matrix, 0.0)
+    return matrix
+
+def driven_km(matrix: np.ndarray, sequence, reloads) -> float:
+    driven = with_reloads([routing.DEPOT] + list(sequence), reloads)
+    return float(sum(matrix[a, b] for a, b in zip(driven, driven[1:])))
+
+def brute_force(matrix: np.ndarray, sequence, capacity: int):
+    """Least km plus reload time (as km) over every way to cut sequence into trips"""
+    n = len(sequence)
+    best = None
+    for cuts in range(n):
+        for reloads in itertools.combinations(range(1, n), cuts):
+            bounds = [0] + list(reloads) + [n]
+            if any(end - start > capacity for start, end in zip(bounds, bounds[1:])):
+                continue
+            cost = driven_km(matrix, sequence, reloads) + len(reloads) * RELOAD_KM
+            if best is None or cost < best:
+                best = cost
+    return best
+
+def test_split_trips_matches_brute_force():
+    """The chosen cuts cost what the best of all cuts costs, and their km is what is driven"""
+    rng = random.Random(48)
+    checked = 0
+    for _ in range(200):
+        n = rng.randint(2, 8)
+        matrix = random_matrix(rng, n, symmetric=rng.random() < 0.5)
+        sequence = list(range(1, n + 1))
+        rng.shuffle(sequence)
+        for capacity in range(1, n):
+            reloads, km = split_trips(matrix, sequence, capacity)
+            bounds = [0] + reloads + [n]
+            assert reloads == sorted(set(reloads)) and all(0 < position < n for position in reloads)
+            assert all(end - start <= capacity for start, end in zip(bounds, bounds[1:]))
+            assert abs(km - driven_km(matrix, sequence, reloads)) < 1e-9
+            assert abs(km + len(reloads) * RELOAD_KM - brute_force(matrix, sequence, capacity)) < 1e-9
+            checked += 1
+    print(f"✓ split_trips matches brute force on {checked} small instances")
+
+def test_edge_cases():
+    """Empty routes, single orders and routes that fit in one trip are not split"""
+    rng = random.Random(1)
+    matrix = random_matrix(rng, 5)
+    
+    assert split_trips(matrix, [], 3) == ([], 0.0)
+    assert split_trips(matrix, [], None) == ([], 0.0)
+    assert with_reloads([(0.0, 0.0)], []) == [(0.0, 0.0)]
+    assert stop_legs([], []) == []
+    
+    # A single order exactly at capacity is one trip out
+    assert not needs_reloads(1, 1)
+    assert split_trips(matrix, [4], 1) == ([], float(matrix[0, 4]))
+    
+    # A route of exactly capacity stops, or with no capacity, is one trip
+    sequence = [3, 1, 5, 2, 4]
+    for capacity in (5, 6, None):
+        assert split_trips(matrix, sequence, capacity) == ([], routing.path_length(matrix, sequence))
+    
+    # Capacity one reloads before every stop after the first
+    reloads, km = split_trips(matrix, sequence, 1)
+    assert reloads == [1, 2, 3, 4]
+    assert abs(km - sum(matrix[0, stop] for stop in sequence) - sum(matrix[stop, 0] for stop in sequence[:-1])) < 1e-9
+    
+    # Folded legs add up to the driven route
+    driven = with_reloads([(0.0, 0.0), (1.0, 0.0), (2.0, 0.0), (3.0, 0.0)], [2])
+    assert driven == [(0.0, 0.0), (1.0, 0.0), (2.0, 0.0), (0.0, 0.0), (3.0, 0.0)]
+    assert stop_legs([1.0, 1.0, 2.0, 3.0], [2]) == [1.0, 1.0, 5.0]
+    print("✓ Edge cases: empty route, single order at capacity, one-trip routes")
+
+def test_vehicle_capacity():
+    """An agent's own capacity wins over their vehicle type's"""
+    two_wheeler = Config.VEHICLE_CAPACITY.get('two_wheeler')
+    assert vehicle_capacity({'capacity': 7, 'vehicle_type': 'two_wheeler'}) == 7
+    assert vehicle_capacity({'vehicle_type': 'two_wheeler'}) == two_wheeler
+    default = Config.VEHICLE_CAPACITY.get(Config.DEFAULT_VEHICLE_TYPE)
+    assert vehicle_capacity({}) == (int(default) if default else None)
+    assert vehicle_capacity({'vehicle_type': 'hovercraft'}) == vehicle_capacity({})
+    print("✓ vehicle_capacity prefers the agent's own capacity")
+
+def test_moves_applied_once():
+    """Every move the search counts, 2-opt* included, is applied once and lowers the total cost"""
+    rng = random.Random(33)
+    applied = {'relocate': 0, 'swap': 0, '2opt*': 0}
+    for _ in range(20):
+        matrix = random_matrix(rng, 40)
+        stops = list(range(1, 41))
+        rng.shuffle(stops)
+        search = InterRouteSearch(matrix, [stops[start:start + 10] for start in range(0, 40, 10)],
+                                  capacities=[4, 6, None, 10])
+        apply = search._apply
+        
+        def checked_apply(move, r1, r2, route1, route2):
+            before = search.total_cost()
+            apply(move, r1, r2, route1, route2)
+            # Applying the same exchange twice would leave the cost unchanged the second time
+            assert search.total_cost() < before - search.EPSILON, f"{move} did not lower the cost"
+            applied[move] += 1
+        search._apply = checked_apply
+        search.run(time_budget=0, iterations=2000)
+    assert applied['2opt*'], applied
+    print(f"✓ Each move is applied once and lowers the cost: {applied}")
+
+if __name__ == "__main__":
+    print("="*60)
+    print("TRIPS TEST")
+    print("="*60)
+    test_split_trips_matches_brute_force()
+    test_edge_cases()
+    test_vehicle_capacity()
+    test_moves_applied_once()
+    print("\nAll trips tests passed!")
@@ -0,0 +1,248 @@
+import math
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Tuple
+from spatial_index import KM_PER_DEGREE_LAT
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+Tile = Tuple[int, int]
+
+class TileGrid:
+    """Square tiles of about tile_km over a warehouse's service area.
+    
+    A tile is the (row, column) of floor(latitude / tile_lat) and
+    floor(longitude / tile_lon), computed the same way in the database
+    ($floor of $divide) and here, so every order falls in exactly one tile.
+    """
+    
+    def __init__(self, warehouse: Dict, tile_km: float):
+        self.tile_lat = tile_km / KM_PER_DEGREE_LAT
+        self.tile_lon = tile_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(warehouse['latitude'])), 0.01))
+    
+    def tile(self, latitude: float, longitude: float) -> Tile:
+        return math.floor(latitude / self.tile_lat), math.floor(longitude / self.tile_lon)
+    
+    def bounds(self, tiles: List[Tile]) -> Tuple[float, float, float, float]:
+        """(south, west, north, east) around the tiles, a little wider than their edges"""
+        rows = [row for row, _ in tiles]
+        columns = [column for _, column in tiles]
+        margin = 1e-9
+        return (min(rows) * self.tile_lat - margin, min(columns) * self.tile_lon - margin,
+                (max(rows) + 1) * self.tile_lat + margin, (max(columns) + 1) * self.tile_lon + margin)
+
+def group_tiles(counts: Dict[Tile, int], max_orders: int) -> List[List[Tile]]:
+    """Consecutive tiles along a serpentine path, grouped up to max_orders orders.
+    
+    Rows are walked alternately west to east and east to west, so each group
+    borders the next one; a single tile denser than max_orders is a group of
+    its own.
+    """
+    path = sorted(counts, key=lambda tile: (tile[0], tile[1] if tile[0] % 2 == 0 else -tile[1]))
+    groups = []
+    current, current_orders = [], 0
+    for tile in path:
+        if current and current_orders + counts[tile] > max_orders:
+            groups.append(current)
+            current, current_orders = [], 0
+        current.append(tile)
+        current_orders += counts[tile]
+    if current:
+        groups.append(current)
+    return groups
+
+def apportion(agent_count: int, demands: List[int]) -> List[int]:
+    """Agents per group in proportion to its orders (largest remainder).
+    
+    While there are enough agents every group with orders gets at least one.
+    """
+    total = sum(demands)
+    if not total or not agent_count:
+        return [0] * len(demands)
+    busy = [index for index, demand in enumerate(demands) if demand]
+    shares = [0] * len(demands)
+    if agent_count >= len(busy):
+        for index in busy:
+            shares[index] = 1
+    spare = agent_count - sum(shares)
+    quotas = [spare * demand / total for demand in demands]
+    for index, quota in enumerate(quotas):
+        shares[index] += int(quota)
+    by_remainder = sorted(range(len(demands)), key=lambda index: quotas[index] - int(quotas[index]), reverse=True)
+    for index in by_remainder[:agent_count - sum(shares)]:
+        shares[index] += 1
+    return shares
+
+def _solve_group(job: Tuple) -> Tuple[List[Tuple], List[Dict], List[Dict]]:
+    """Plan one tile group in a worker process; returns its plans, deferred orders and search reports"""
+    from allocation_engine import OrderAllocationEngine
+    today, agents, orders, warehouse, previous_routes, search_budget = job
+    logging.getLogger().setLevel(logging.WARNING)
+    engine = OrderAllocationEngine(today=today)
+    plans, deferred_orders = engine.plan_and_improve(agents, orders, warehouse, previous_routes, search_budget)
+    return plans, deferred_orders, engine.search_reports
+
+class TiledAllocator:
+    """Plans and commits a very large warehouse one group of tiles at a time.
+    
+    Pending orders are counted per tile with one aggregation, and neighbouring
+    tiles are grouped up to TILE_MAX_ORDERS orders. Agents are shared among
+    the groups in proportion to their orders. Agents whose previous route lies
+    in a group are placed there first. Each group's orders are read from an
+    index-backed box query and solved on their own, in TILE_WORKERS processes
+    when there are several. Consecutive groups share a border: before a group
+    is committed, the inter-route search runs over the routes along its
+    border with the next group, so they can trade stops across it. Only a few
+    groups are in memory at any time, however large the warehouse is.
+    """
+    
+    def __init__(self, engine, warehouse: Dict, agents: List[Dict], previous_routes: Dict = None,
+                 search_budget: float = None, workers: int = None):
+        self.engine = engine
+        self.warehouse = warehouse
+        self.warehouse_id = str(warehouse['_id'])
+        self.agents = agents
+        self.previous_routes = previous_routes or {}
+        self.search_budget = Config.LOCAL_SEARCH_TIME_BUDGET if search_budget is None else search_budget
+        self.workers = workers or Config.TILE_WORKERS
+        self.grid = TileGrid(warehouse, Config.TILE_KM)
+        self.stats = {'tiles': 0, 'groups': 0, 'max_group_orders': 0, 'stitched_km': 0.0}
+    
+    def load_orders(self, tiles: List[Tile]) -> List[Dict]:
+        """Pending orders in the tiles, read with a bounding-box cursor"""
+        from models import Order
+        wanted = set(tiles)
+        return [order for order in Order.iter_pending_in_box(self.warehouse_id, *self.grid.bounds(tiles))
+                if self.grid.tile(order['latitude'], order['longitude']) in wanted]
+    
+    def assign_agents(self, groups: List[List[Tile]], shares: List[int]) -> List[List[Dict]]:
+        """Agents of each group, those whose previous route centre lies in it first"""
+        home = {}
+        for agent in self.agents:
+            stops = self.previous_routes.get(str(agent['_id']))
+            if stops:
+                home[str(agent['_id'])] = self.grid.tile(sum(lat for lat, _ in stops) / len(stops),
+                                                         sum(lon for _, lon in stops) / len(stops))
+        group_of_tile = {tile: index for index, tiles in enumerate(groups) for tile in tiles}
+        
+        assigned = [[] for _ in groups]
+        free = []
+        for agent in sorted(self.agents, key=lambda agent: agent['name']):
+            index = group_of_tile.get(home.get(str(agent['_id'])))
+            if index is not None and len(assigned[index]) < shares[index]:
+                assigned[index].append(agent)
+            else:
+                free.append(agent)
+        for index, share in enumerate(shares):
+            while len(assigned[index]) < share and free:
+                assigned[index].append(free.pop(0))
+        return assigned
+    
+    def _jobs(self, groups: List[List[Tile]], group_agents: List[List[Dict]], budget: float) -> Iterator[Tuple]:
+        for tiles, agents in zip(groups, group_agents):
+            orders = self.load_orders(tiles)
+            self.stats['max_group_orders'] = max(self.stats['max_group_orders'], len(orders))
+            previous = {str(agent['_id']): self.previous_routes[str(agent['_id'])] for agent in agents
+                        if str(agent['_id']) in self.previous_routes}
+            yield self.engine.today, agents, orders, self.warehouse, previous, budget
+    
+    def _solved(self, jobs: Iterator[Tuple]) -> Iterator[Tuple[Tuple, Tuple]]:
+        """(job, (plans, deferred)) in group order, loading at most workers + 1 groups ahead"""
+        if self.workers <= 1:
+            for job in jobs:
+                yield job, self.engine.plan_and_improve(*job[1:])
+            return
+        # Fresh interpreters, so no worker inherits this process's MongoDB connections
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as executor:
+            pending = deque()
+            for job in jobs:
+                pending.append((job, executor.submit(_solve_group, job)))
+                while len(pending) > self.workers:
+                    yield self._result(*pending.popleft())
+            while pending:
+                yield self._result(*pending.popleft())
+    
+    def _result(self, job: Tuple, future) -> Tuple[Tuple, Tuple]:
+        plans, deferred_orders, reports = future.result()
+        self.engine.search_reports.extend(reports)
+        return job, (plans, deferred_orders)
+    
+    def _stitch(self, previous_tiles: List[Tile], previous_plans: List[Tuple], tiles: List[Tile],
+                plans: List[Tuple], budget: float) -> Tuple[List[Tuple], List[Tuple]]:
+        """Let the routes along two neighbouring groups' border trade stops across it.
+        
+        Only routes with a stop in a tile touching the other group take part,
+        so the search stays about the size of the border, not of both groups.
+        """
+        if not previous_plans or not plans or budget <= 0:
+            return previous_plans, plans
+        previous_border = self._border(previous_tiles, tiles)
+        border = self._border(tiles, previous_tiles)
+        chosen = [(True, index) for index, plan in enumerate(previous_plans) if self._touches(plan, previous_border)]
+        chosen += [(False, index) for index, plan in enumerate(plans) if self._touches(plan, border)]
+        if len(chosen) < 2:
+            return previous_plans, plans
+        
+        before = [previous_plans[index] if earlier else plans[index] for earlier, index in chosen]
+        after = self.engine._improve_plans(self.warehouse, before, budget)
+        self.stats['stitched_km'] += sum(plan[2]['total_distance'] for plan in before) - \
+            sum(plan[2]['total_distance'] for plan in after)
+        previous_plans, plans = list(previous_plans), list(plans)
+        for (earlier, index), plan in zip(chosen, after):
+            (previous_plans if earlier else plans)[index] = plan
+        return previous_plans, plans
+    
+    @staticmethod
+    def _border(tiles: List[Tile], other: List[Tile]) -> set:
+        """Tiles that share an edge or a corner with a tile of the other group"""
+        other = set(other)
+        return {(row, column) for row, column in tiles
+                if any((row + dr, column + dc) in other for dr in (-1, 0, 1) for dc in (-1, 0, 1))}
+    
+    def _touches(self, plan: Tuple, border: set) -> bool:
+        return any(self.grid.tile(order['latitude'], order['longitude']) in border for order in plan[1])
+    
+    def _commit(self, tiles: List[Tile], agents: List[Dict], plans: List[Tuple], deferred: List[Dict], totals: Dict):
+        assigned_count, committed, unavailable, deferred, conflicts = self.engine._commit_warehouse(
+            self.warehouse, agents, plans, deferred, reload_orders=lambda: self.load_orders(tiles)
+        )
+        totals['assigned'] += assigned_count
+        totals['committed'] += committed
+        totals['unavailable'] |= unavailable
+        totals['deferred'] += deferred
+        totals['conflicts'] += conflicts
+        self.engine._extend_lease()
+    
+    def run(self) -> Tuple[int, List[Dict], set, List[Dict], int]:
+        """Plan and commit every group; returns the same tuple as OrderAllocationEngine._commit_warehouse"""
+        from models import Order
+        
+        counts = Order.tile_counts(self.warehouse_id, self.grid.tile_lat, self.grid.tile_lon)
+        groups = group_tiles(counts, Config.TILE_MAX_ORDERS)
+        shares = apportion(len(self.agents), [sum(counts[tile] for tile in tiles) for tiles in groups])
+        group_agents = self.assign_agents(groups, shares)
+        self.stats.update(tiles=len(counts), groups=len(groups))
+        logger.info(f"Warehouse {self.warehouse_id}: {sum(counts.values())} pending orders in {len(counts)} tiles, "
+                    f"{len(groups)} groups for {len(self.agents)} agents")
+        
+        budget = self.search_budget / max(len(groups), 1)
+        stitch_budget = budget * Config.TILE_STITCH_SHARE
+        totals = {'assigned': 0, 'committed': [], 'unavailable': set(), 'deferred': [], 'conflicts': 0}
+        previous = None  # (tiles, agents, plans, deferred) waiting to be stitched to the next group
+        jobs = self._jobs(groups, group_agents, budget - stitch_budget)
+        for tiles, (job, (plans, deferred)) in zip(groups, self._solved(jobs)):
+            if previous is not None:
+                previous_plans, plans = self._stitch(previous[0], previous[2], tiles, plans, stitch_budget)
+                self._commit(previous[0], previous[1], previous_plans, previous[3], totals)
+            previous = (tiles, job[1], plans, deferred)
+        if previous is not None:
+            self._commit(*previous, totals)
+        
+        self.stats['stitched_km'] = round(self.stats['stitched_km'], 2)
+        logger.info(f"Tiled allocation of warehouse {self.warehouse_id}: {totals['assigned']} orders assigned, "
+                    f"{len(totals['deferred'])} deferred, {self.stats}")
+        return totals['assigned'], totals['committed'], totals['unavailable'], totals['deferred'], totals['conflicts']
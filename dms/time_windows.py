@@ -0,0 +1,202 @@
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from config import Config
+import routing
+
+# Times are minutes after SHIFT_START, when agents leave the warehouse. An
+# order may carry window_start and window_end ("HH:MM" on its delivery day)
+# and service_minutes spent at the door. An agent who arrives early waits
+# for the window to open; arriving after it closes makes the route
+# infeasible. The working-hours limit closes every window: the last service
+# must end within MAX_WORKING_HOURS_PER_DAY.
+
+EPSILON = 1e-9
+
+def clock_minutes(value: str) -> float:
+    """Minutes after midnight of an "HH:MM" time"""
+    hours, _, minutes = str(value).strip().partition(':')
+    hours, minutes = int(hours), int(minutes or 0)
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > 24 * 60:
+        raise ValueError(f'Invalid time {value}, expected HH:MM')
+    return float(hours * 60 + minutes)
+
+def clock_time(minutes_after_start: float) -> str:
+    """"HH:MM" of a time given in minutes after the shift start"""
+    minutes = int(round(clock_minutes(Config.SHIFT_START) + minutes_after_start))
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+def order_window(order: Dict) -> Tuple[float, float, float]:
+    """(earliest, latest, service) of an order in minutes after the shift start"""
+    start = clock_minutes(Config.SHIFT_START)
+    earliest = clock_minutes(order['window_start']) - start if order.get('window_start') else 0.0
+    latest = clock_minutes(order['window_end']) - start if order.get('window_end') else math.inf
+    service = order.get('service_minutes')
+    service = float(Config.DEFAULT_SERVICE_MINUTES if service is None else service)
+    return max(earliest, 0.0), latest, service
+
+def has_windows(orders: Sequence[Dict]) -> bool:
+    """Whether routing these orders has to track time beyond travel"""
+    return Config.DEFAULT_SERVICE_MINUTES > 0 or any(
+        order.get('window_start') or order.get('window_end') or order.get('service_minutes')
+        for order in orders
+    )
+
+def schedule_route(orders: List[Dict], legs: List[float],
+                   reloads: Sequence[int] = ()) -> Tuple[List[float], float, Optional[int]]:
+    """Replay a route: service start at each stop, when the last service ends,
+    and the index of the first stop reached after its window closed (None if none).
+    
+    Stops at reloads start a new trip: RELOAD_MINUTES at the warehouse are
+    spent on the way to them (their leg includes the drive back to it).
+    """
+    reloads = set(reloads)
+    begins = []
+    time = 0.0
+    late = None
+    for index, (order, leg) in enumerate(zip(orders, legs)):
+        earliest, latest, service = order_window(order)
+        if index in reloads:
+            time += Config.RELOAD_MINUTES
+        begin = max(time + leg * Config.MINUTES_PER_KM, earliest)
+        if late is None and begin > latest + EPSILON:
+            late = index
+        begins.append(begin)
+        time = begin + service
+    return begins, time, late
+
+class Schedule:
+    """Service start and forward time slack at each stop of one route.
+    
+    slack[i] is how much later service at stop i could start without any
+    stop from i on missing its window: the smallest of each later stop's
+    room before its deadline plus the waiting in between, which absorbs
+    part of a delay.
+    """
+    
+    __slots__ = ('begin', 'slack', 'feasible')
+    
+    def __init__(self, begin: List[float], slack: List[float], feasible: bool):
+        self.begin = begin
+        self.slack = slack
+        self.feasible = feasible
+
+class TimeWindows:
+    """Windows of the stops of a distance matrix whose index 0 is the warehouse.
+    
+    A route's Schedule is built in O(n). Against it, inserting, removing or
+    replacing a stop, or joining one route's head to another's tail, is
+    checked in O(1): the changed stop must start before its deadline and
+    the delay passed on to the rest of the route must fit in its slack.
+    A route driven in several trips is scheduled with its reloads; checked
+    against a schedule without them, fits only rules moves out.
+    """
+    
+    def __init__(self, matrix: np.ndarray, earliest: np.ndarray, latest: np.ndarray, service: np.ndarray):
+        self.matrix = matrix
+        self.earliest = earliest
+        self.service = service
+        self.latest = np.minimum(latest, Config.MAX_WORKING_HOURS_PER_DAY * 60 - service)
+        self.minutes_per_km = Config.MINUTES_PER_KM
+    
+    @classmethod
+    def for_orders(cls, matrix: np.ndarray, orders: List[Dict]) -> 'TimeWindows':
+        """Windows for a matrix whose index i + 1 is orders[i]"""
+        windows = np.array([(0.0, math.inf, 0.0)] + [order_window(order) for order in orders], dtype=float)
+        return cls(matrix, windows[:, 0], windows[:, 1], windows[:, 2])
+    
+    def travel(self, a: int, b: int) -> float:
+        return float(self.matrix[a, b]) * self.minutes_per_km
+    
+    def schedule(self, sequence: List[int], reloads: Sequence[int] = ()) -> Schedule:
+        """Schedule of a sequence, driven back to the warehouse and reloaded before the stops at reloads"""
+        reloads = set(reloads)
+        begin = []
+        waits = []
+        time = 0.0
+        previous = routing.DEPOT
+        for position, stop in enumerate(sequence):
+            if position in reloads:
+                time += self.travel(previous, routing.DEPOT) + Config.RELOAD_MINUTES
+                previous = routing.DEPOT
+            arrival = time + self.travel(previous, stop)
+            start = max(arrival, float(self.earliest[stop]))
+            waits.append(start - arrival)
+            begin.append(start)
+            time = start + float(self.service[stop])
+            previous = stop
+        
+        slack = [0.0] * len(sequence)
+        following = math.inf
+        feasible = True
+        for i in range(len(sequence) - 1, -1, -1):
+            room = float(self.latest[sequence[i]]) - begin[i]
+            feasible = feasible and room >= -EPSILON
+            slack[i] = min(room, following)
+            following = waits[i] + slack[i]
+        return Schedule(begin, slack, feasible)
+    
+    def feasible(self, sequence: List[int], reloads: Sequence[int] = ()) -> bool:
+        return self.schedule(sequence, reloads).feasible
+    
+    def fits(self, head: List[int], head_schedule: Schedule, i: int, stop: Optional[int],
+             tail: List[int], tail_schedule: Schedule, j: int) -> bool:
+        """Whether head[:i + 1], then stop (if any), then tail[j:] keeps every window.
+        
+        head and tail may be the same route: inserting u at position p is
+        (route, p - 1, u, route, p), removing position p is
+        (route, p - 1, None, route, p + 1).
+        """
+        if i >= 0:
+            previous = head[i]
+            time = head_schedule.begin[i] + float(self.service[previous])
+        else:
+            previous, time = routing.DEPOT, 0.0
+        if stop is not None:
+            start = max(time + self.travel(previous, stop), float(self.earliest[stop]))
+            if start > float(self.latest[stop]) + EPSILON:
+                return False
+            previous, time = stop, start + float(self.service[stop])
+        if j >= len(tail):
+            return True
+        delay = time + self.travel(previous, tail[j]) - tail_schedule.begin[j]
+        return delay <= tail_schedule.slack[j] + EPSILON
+    
+    def insert(self, sequence: List[int], stops: Sequence[int]) -> Tuple[List[int], List[int]]:
+        """Insert stops where each adds the least distance without breaking a window.
+        
+        Stops go in order of deadline, then of opening time. Returns the
+        sequence and the stops that fit nowhere.
+        """
+        sequence = list(sequence)
+        unplaced = []
+        for stop in sorted(stops, key=lambda stop: (self.latest[stop], self.earliest[stop])):
+            schedule = self.schedule(sequence)
+            best_cost, best_position = math.inf, None
+            previous = routing.DEPOT
+            for position in range(len(sequence) + 1):
+                following = sequence[position] if position < len(sequence) else None
+                cost = float(self.matrix[previous, stop])
+                if following is not None:
+                    cost += float(self.matrix[stop, following] - self.matrix[previous, following])
+                if cost < best_cost and self.fits(sequence, schedule, position - 1, stop, sequence, schedule, position):
+                    best_cost, best_position = cost, position
+                previous = following
+            if best_position is None:
+                unplaced.append(stop)
+            else:
+                sequence.insert(best_position, stop)
+        return sequence, unplaced
+    
+    def sequence(self, stops: List[int]) -> Tuple[List[int], List[int]]:
+        """A sequence of stops that keeps their windows, and the stops that fit nowhere.
+        
+        Nearest neighbour when that already keeps every window, otherwise
+        insertion by deadline, tidied with window-checked 2-opt.
+        """
+        sequence = routing.nearest_neighbour(self.matrix, stops)
+        if self.feasible(sequence):
+            return sequence, []
+        sequence, unplaced = self.insert([], stops)
+        return routing.two_opt(self.matrix, sequence, feasible=self.feasible), unplaced
+
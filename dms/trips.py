@@ -0,0 +1,112 @@
+import math
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from config import Config
+import routing
+
+Point = Tuple[float, float]
+
+# A vehicle leaves the warehouse with at most its capacity of orders. A day
+# with more stops is driven as several trips in the route's visiting order:
+# after a trip's last stop the agent drives back to the warehouse, reloads
+# for RELOAD_MINUTES and drives out to the next trip's first stop. The last
+# trip ends at its last stop, like every route. Reloads are given as the
+# positions in the visiting order of the stops that start a new trip.
+
+def vehicle_capacity(agent: Dict) -> Optional[int]:
+    """Orders the agent carries per trip, None when unlimited.
+    
+    The agent's own capacity wins over that of their vehicle_type; agents
+    without either (or with an unknown type) drive DEFAULT_VEHICLE_TYPE.
+    """
+    capacity = agent.get('capacity')
+    if capacity is None:
+        capacity = Config.VEHICLE_CAPACITY.get(agent.get('vehicle_type'),
+                                               Config.VEHICLE_CAPACITY.get(Config.DEFAULT_VEHICLE_TYPE))
+    return int(capacity) if capacity else None
+
+def needs_reloads(count: int, capacity: Optional[int]) -> bool:
+    return capacity is not None and count > capacity
+
+def split_trips(matrix: np.ndarray, sequence: List[int], capacity: Optional[int]) -> Tuple[List[int], float]:
+    """Where to reload along a sequence so that no trip exceeds capacity stops.
+    
+    Returns the reload positions and the km driven, returns to the warehouse
+    included. Of all ways to cut the sequence into trips, the one taking the
+    least time is chosen, each reload's minutes counted as the km driven in
+    that time: a shortest path over the cut points, in O(n * capacity).
+    """
+    n = len(sequence)
+    if not needs_reloads(n, capacity):
+        return [], routing.path_length(matrix, sequence)
+    
+    stops = [routing.DEPOT] + list(sequence)
+    out = matrix[routing.DEPOT, stops].tolist()
+    back = matrix[stops, routing.DEPOT].tolist()
+    along = [0.0, 0.0] + np.cumsum(matrix[stops[1:-1], stops[2:]]).tolist()  # km from stops[1] to stops[k]
+    reload_km = Config.RELOAD_MINUTES / Config.MINUTES_PER_KM
+    
+    # best[k]: stops 1..k delivered and the agent back at the warehouse, reloaded.
+    # ahead[s]: cost of everything before a trip starting at stop s, that
+    # trip's drive out to it, less along[s]; a trip ending at stop k is
+    # cheapest from the smallest ahead among its capacity possible starts.
+    best = [0.0] + [math.inf] * n
+    ahead = [math.inf] * (n + 1)
+    ahead[1] = out[1] - along[1]
+    start_of = [0] * (n + 1)
+    for end in range(1, n):
+        first = max(1, end - capacity + 1)
+        window = ahead[first:end + 1]
+        lowest = min(window)
+        start_of[end] = first + window.index(lowest)
+        best[end] = lowest + along[end] + back[end] + reload_km
+        ahead[end + 1] = best[end] + out[end + 1] - along[end + 1]
+    
+    # The last trip does not come back
+    window = ahead[n - capacity + 1:]
+    lowest = min(window)
+    last = n - capacity + 1 + window.index(lowest)
+    finish = lowest + along[n]
+    
+    reloads = []
+    start = last
+    while start > 1:
+        reloads.append(start - 1)
+        start = start_of[start - 1]
+    reloads.reverse()
+    return reloads, finish - len(reloads) * reload_km
+
+def with_reloads(route: List[Point], reloads: List[int]) -> List[Point]:
+    """A route (warehouse, then stops) with the warehouse again before every reloaded trip"""
+    starts = set(reloads)
+    driven = [route[0]]
+    for position, point in enumerate(route[1:]):
+        if position in starts:
+            driven.append(route[0])
+        driven.append(point)
+    return driven
+
+def stop_legs(driven_legs: List[float], reloads: List[int]) -> List[float]:
+    """Legs of a route driven with reloads folded into one leg per stop.
+    
+    The leg into a stop that starts a trip is the drive back to the
+    warehouse plus the drive out to that stop.
+    """
+    starts = set(reloads)
+    legs = []
+    index = 0
+    for position in range(len(driven_legs) - len(reloads)):
+        leg = driven_legs[index]
+        index += 1
+        if position in starts:
+            leg += driven_legs[index]
+            index += 1
+        legs.append(leg)
+    return legs
+
+def reload_minutes_before(reloads: List[int], count: int) -> List[float]:
+    """Reload minutes spent right before reaching each of count stops"""
+    minutes = [0.0] * count
+    for position in reloads:
+        minutes[position] = float(Config.RELOAD_MINUTES)
+    return minutes
@@ -3,13 +3,94 @@ from typing import Tuple, List
 from geopy.distance import geodesic
 from config import Config
 from bson import ObjectId
+from distance_cache import get_distance_cache, cell_diagonal_km
+from road_network import get_road_network
+from spatial_index import EARTH_RADIUS_KM
+from route_bounds import route_bounds
+from route_memo import route_memo
+from route_encoding import encode_polyline
+from time_windows import TimeWindows, has_windows, schedule_route, clock_time
+from trips import needs_reloads, split_trips, with_reloads, stop_legs, reload_minutes_before, vehicle_capacity
+import numpy as np
+
+# Largest relative gap between spherical haversine and WGS84 geodesic distance
+HAVERSINE_TOLERANCE = 0.006
 
 class LocationUtils:
     @staticmethod
     def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """Calculate distance between two coordinates in kilometers"""
+        network = get_road_network()
+        if network is not None:
+            return network.distance(lat1, lon1, lat2, lon2)
+        cache = get_distance_cache()
+        if cache is not None:
+            return cache.distance(lat1, lon1, lat2, lon2)
         return geodesic((lat1, lon1), (lat2, lon2)).kilometers
     
+    @staticmethod
+    def point_distance(origin: Tuple[float, float], destination: Tuple[float, float]) -> float:
+        """calculate_distance for two (lat, lon) points"""
+        return LocationUtils.calculate_distance(origin[0], origin[1], destination[0], destination[1])
+    
+    @staticmethod
+    def distance_provider() -> tuple:
+        """What calculate_distance measures with: the road network file, the distance cache or geodesic"""
+        network = get_road_network()
+        if network is not None:
+            return ('road', network.source)
+        cache = get_distance_cache()
+        if cache is not None:
+            return ('cache', cache.path, cache.precision)
+        return ('geodesic',)
+    
+    @staticmethod
+    def distance_cache_stats() -> dict:
+        """Hit-rate statistics of the persistent distance cache, if enabled"""
+        cache = get_distance_cache()
+        return cache.stats() if cache is not None else {'enabled': False}
+    
+    @staticmethod
+    def road_network_stats() -> dict:
+        """Query statistics of the road network provider, if one is loaded"""
+        network = get_road_network()
+        return network.stats() if network is not None else {'enabled': False}
+    
+    @staticmethod
+    def distances_from(origin: Tuple[float, float],
+                       coords: List[Tuple[float, float]]) -> np.ndarray:
+        """Vectorized distances (km) from one point to many points.
+        
+        Road distances when a road network is loaded (cached with the origin as
+        scope, so a warehouse's whole matrix is built once), haversine otherwise.
+        """
+        if not coords:
+            return np.zeros(0)
+        network = get_road_network()
+        if network is not None:
+            return network.distance_matrix([origin], coords, scope=tuple(origin))[0]
+        points = np.radians(np.asarray(coords, dtype=float))
+        lat1, lon1 = np.radians(origin[0]), np.radians(origin[1])
+        dlat = points[:, 0] - lat1
+        dlon = points[:, 1] - lon1
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(points[:, 0]) * np.sin(dlon / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    
+    @staticmethod
+    def distance_matrix(points: List[Tuple[float, float]]) -> np.ndarray:
+        """Pairwise distances (km) between points; the first point scopes road caching"""
+        if not points:
+            return np.zeros((0, 0))
+        network = get_road_network()
+        if network is not None:
+            return network.distance_matrix(points, points, scope=tuple(points[0]))
+        coords = np.radians(np.asarray(points, dtype=float))
+        lat, lon = coords[:, 0], coords[:, 1]
+        dlat = lat[:, None] - lat[None, :]
+        dlon = lon[:, None] - lon[None, :]
+        a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    
     @staticmethod
     def calculate_travel_time(distance_km: float) -> float:
         """Calculate travel time in hours based on distance"""
@@ -21,14 +102,23 @@ class LocationUtils:
         """Calculate total distance for a route with multiple waypoints"""
         if len(waypoints) < 2:
             return 0
+        return sum(LocationUtils.route_legs(waypoints))
+    
+    @staticmethod
+    def route_legs(waypoints: List[Tuple[float, float]]) -> List[float]:
+        """Distance of each leg of a route, in driving order"""
+        network = get_road_network()
+        if network is not None:
+            matrix = network.distance_matrix(waypoints, waypoints, scope=tuple(waypoints[0]))
+            return [float(matrix[i, i + 1]) for i in range(len(waypoints) - 1)]
         
-        total_distance = 0
-        for i in range(len(waypoints) - 1):
-            total_distance += LocationUtils.calculate_distance(
+        return [
+            LocationUtils.calculate_distance(
                 waypoints[i][0], waypoints[i][1],
                 waypoints[i+1][0], waypoints[i+1][1]
             )
-        return total_distance
+            for i in range(len(waypoints) - 1)
+        ]
     
     @staticmethod
     def optimize_route(warehouse_coords: Tuple[float, float], 
@@ -37,6 +127,10 @@ class LocationUtils:
         if not delivery_coords:
             return [warehouse_coords]
         
+        network = get_road_network()
+        if network is not None:
+            return LocationUtils._optimize_route_on_network(network, warehouse_coords, delivery_coords)
+        
         route = [warehouse_coords]
         remaining_deliveries = delivery_coords.copy()
         current_location = warehouse_coords
@@ -52,8 +146,41 @@ class LocationUtils:
             current_location = nearest_point
         
         return route
+    
+    @staticmethod
+    def _optimize_route_on_network(network, warehouse_coords: Tuple[float, float],
+                                   delivery_coords: List[Tuple[float, float]]) -> List[Tuple[float, float]]:
+        """Nearest neighbor over one road distance matrix instead of per-pair queries"""
+        points = [warehouse_coords] + list(delivery_coords)
+        matrix = network.distance_matrix(points, points, scope=tuple(warehouse_coords))
+        return LocationUtils.optimize_route_on_matrix(points, matrix)
+    
+    @staticmethod
+    def optimize_route_on_matrix(points: List[Tuple[float, float]],
+                                 matrix: np.ndarray) -> List[Tuple[float, float]]:
+        """Nearest neighbor route from points[0] over their distance matrix"""
+        unvisited = np.ones(len(points), dtype=bool)
+        unvisited[0] = False
+        current = 0
+        route = [points[0]]
+        for _ in range(len(points) - 1):
+            candidates = np.where(unvisited, matrix[current], np.inf)
+            current = int(np.argmin(candidates))
+            unvisited[current] = False
+            route.append(points[current])
+        return route
 
 class AssignmentUtils:
+    @staticmethod
+    def calculate_payment_rate(total_orders: int) -> int:
+        """Per-order payment for an agent delivering total_orders in a day"""
+        if total_orders >= Config.TIER_2_ORDERS:
+            return Config.TIER_2_PAYMENT
+        elif total_orders >= Config.TIER_1_ORDERS:
+            return Config.TIER_1_PAYMENT
+        else:
+            return Config.DEFAULT_PAYMENT
+    
     @staticmethod
     def can_agent_accept_orders(agent_id: str, new_orders: List[dict], 
                                current_assignment: dict = None) -> Tuple[bool, dict]:
@@ -71,16 +198,94 @@ class AssignmentUtils:
         if not warehouse:
             return False, {'error': 'Warehouse not found'}
         
-        # Prepare route waypoints
-        warehouse_coords = (warehouse['latitude'], warehouse['longitude'])
-        delivery_coords = [(order['latitude'], order['longitude']) for order in new_orders]
+        return AssignmentUtils.check_route_constraints(warehouse, new_orders, capacity=vehicle_capacity(agent))
+    
+    @staticmethod
+    def check_route_constraints(warehouse: dict, orders: List[dict],
+                                route: List[Tuple[float, float]] = None,
+                                capacity: int = None,
+                                matrix: np.ndarray = None) -> Tuple[bool, dict]:
+        """Route orders from a warehouse and check them against the daily limits.
+        
+        Pass route (warehouse first, then stops) to evaluate a sequence that was
+        already built instead of re-optimizing it; orders must then be listed
+        in the same order as the route's stops. The metrics carry the route,
+        its leg lengths and the order ids in visiting order ('sequence', None
+        for unsaved orders).
         
-        # Optimize route
-        route = LocationUtils.optimize_route(warehouse_coords, delivery_coords)
+        Orders with delivery windows or service time are routed around their
+        windows, and the route's time includes service and waiting. When a
+        window cannot be met, the error metrics list the positions of those
+        orders in orders as 'unreachable'.
         
-        # Calculate distance and time
-        total_distance = LocationUtils.calculate_route_distance(route)
-        total_time = LocationUtils.calculate_travel_time(total_distance)
+        With a vehicle capacity, a route of more stops is driven as several
+        trips through the warehouse. 'reloads' lists the positions in the
+        visiting order of the stops that start a new trip; the route then
+        includes the returns to the warehouse, the leg into such a stop the
+        drive back and out again, and the time the reloads.
+        
+        Pass matrix (warehouse first, then orders as listed) for a set the
+        caller already screened with prefilter on that matrix; routing then
+        reuses it instead of measuring every pair again.
+        """
+        windowed = has_windows(orders)
+        positions = list(range(len(orders)))
+        points = None
+        if route is None:
+            # Prepare route waypoints
+            warehouse_coords = (warehouse['latitude'], warehouse['longitude'])
+            delivery_coords = [(order['latitude'], order['longitude']) for order in orders]
+            points = [warehouse_coords] + delivery_coords
+            
+            # Skip routing a set whose distance bounds already rule it out
+            if matrix is None:
+                matrix = LocationUtils.distance_matrix(points)
+                if AssignmentUtils.prefilter(warehouse_coords, delivery_coords, matrix) is False:
+                    return False, {'error': 'Route length lower bound exceeds the daily limits', 'pruned': True}
+            
+            if windowed:
+                positions, unreachable = AssignmentUtils.sequence_with_windows(warehouse, orders, matrix)
+                if unreachable:
+                    return False, {'error': f'{len(unreachable)} orders cannot be reached within their '
+                                            f'delivery windows', 'unreachable': unreachable}
+                # Listed in visiting order from here on
+                orders = [orders[position] for position in positions]
+                route = [warehouse_coords] + [(order['latitude'], order['longitude']) for order in orders]
+                legs = LocationUtils.route_legs(route) if len(route) > 1 else []
+                sequence = [str(order['_id']) for order in orders] if all('_id' in order for order in orders) else None
+            else:
+                # Optimize route, reusing any memoized route of the same or a neighbouring set
+                route, legs, sequence = AssignmentUtils.route_orders(warehouse, orders, matrix)
+        else:
+            legs = LocationUtils.route_legs(route) if len(route) > 1 else []
+            sequence = [str(order['_id']) for order in orders] if all('_id' in order for order in orders) else None
+        
+        reloads = []
+        if needs_reloads(len(orders), capacity):
+            # Cut the visiting order into trips the vehicle can carry
+            if points is not None:
+                # The route's matrix is the set's, rows taken in visiting order
+                row = {point: index for index, point in enumerate(points)}
+                visits = [row[point] for point in route]
+                route_matrix = matrix[np.ix_(visits, visits)]
+            else:
+                route_matrix = LocationUtils.distance_matrix(route)
+            reloads, _ = split_trips(route_matrix, list(range(1, len(route))), capacity)
+            route = with_reloads(route, reloads)
+            legs = stop_legs(LocationUtils.route_legs(route), reloads)
+        total_distance = float(sum(legs))
+        
+        # Calculate time
+        total_time = LocationUtils.calculate_travel_time(total_distance) + len(reloads) * Config.RELOAD_MINUTES / 60
+        begins = None
+        if windowed:
+            begins, finish, late = schedule_route(orders, legs, reloads)
+            if late is not None:
+                order = orders[late]
+                return False, {'error': f"Order {order.get('order_id', late)} reached at {clock_time(begins[late])}, "
+                                        f"after its window closes at {order['window_end']}",
+                               'unreachable': [positions[late]]}
+            total_time = finish / 60
         
         # Check constraints
         if total_distance > Config.MAX_TRAVEL_DISTANCE_PER_DAY:
@@ -90,14 +295,8 @@ class AssignmentUtils:
             return False, {'error': f'Time {total_time:.2f}h exceeds limit {Config.MAX_WORKING_HOURS_PER_DAY}h'}
         
         # Calculate earnings
-        total_orders = len(new_orders)
-        if total_orders >= Config.TIER_2_ORDERS:
-            earning_per_order = Config.TIER_2_PAYMENT
-        elif total_orders >= Config.TIER_1_ORDERS:
-            earning_per_order = Config.TIER_1_PAYMENT
-        else:
-            earning_per_order = Config.DEFAULT_PAYMENT
-        
+        total_orders = len(orders)
+        earning_per_order = AssignmentUtils.calculate_payment_rate(total_orders)
         total_earning = total_orders * earning_per_order
         
         if total_earning < Config.MIN_DAILY_EARNING:
@@ -109,9 +308,132 @@ class AssignmentUtils:
             'total_orders': total_orders,
             'earning_per_order': earning_per_order,
             'total_earning': total_earning,
-            'route': route
+            'route': route,
+            'legs': legs,
+            'sequence': sequence,
+            'service_start': begins,
+            'reloads': reloads
+        }
+    
+    @staticmethod
+    def route_orders(warehouse: dict, orders: List[dict],
+                     matrix: np.ndarray = None) -> Tuple[List[Tuple[float, float]], List[float], List[str]]:
+        """Route, leg lengths and visiting order of an order set, through the route memo.
+        
+        With matrix (warehouse first, then orders as listed) the nearest
+        neighbour route is built over it instead of measuring each pair.
+        """
+        warehouse_coords = (warehouse['latitude'], warehouse['longitude'])
+        delivery_coords = [(order['latitude'], order['longitude']) for order in orders]
+        
+        def optimize():
+            if matrix is not None:
+                return LocationUtils.optimize_route_on_matrix([warehouse_coords] + delivery_coords, matrix)
+            return LocationUtils.optimize_route(warehouse_coords, delivery_coords)
+        
+        stops = {str(order['_id']): (order['latitude'], order['longitude'])
+                 for order in orders if '_id' in order}
+        if len(stops) != len(orders) or '_id' not in warehouse:
+            # Unsaved orders have no identity to memoize by
+            route = optimize()
+            return route, LocationUtils.route_legs(route) if len(route) > 1 else [], None
+        
+        def build():
+            route = optimize()
+            ids_at = {}
+            for order_id, point in stops.items():
+                ids_at.setdefault(point, []).append(order_id)
+            return [ids_at[point].pop() for point in route[1:]]
+        
+        sequence, legs = route_memo.route(
+            str(warehouse['_id']), warehouse_coords, stops, build, LocationUtils.point_distance,
+            LocationUtils.distance_provider()
+        )
+        return [warehouse_coords] + [stops[order_id] for order_id in sequence], legs, sequence
+    
+    @staticmethod
+    def sequence_with_windows(warehouse: dict, orders: List[dict],
+                              matrix: np.ndarray = None) -> Tuple[List[int], List[int]]:
+        """Visiting order (positions in orders) that keeps every delivery window, and the positions that fit nowhere.
+        
+        The distance-optimal route of the set (through the route memo) is
+        kept when it already meets every window.
+        """
+        points = [(warehouse['latitude'], warehouse['longitude'])] + \
+                 [(order['latitude'], order['longitude']) for order in orders]
+        if matrix is None:
+            matrix = LocationUtils.distance_matrix(points)
+        windows = TimeWindows.for_orders(matrix, orders)
+        
+        # Matrix index i + 1 is orders[i]
+        if '_id' in warehouse and all('_id' in order for order in orders):
+            _, _, order_ids = AssignmentUtils.route_orders(warehouse, orders, matrix)
+            index = {str(order['_id']): position + 1 for position, order in enumerate(orders)}
+            sequence = [index[order_id] for order_id in order_ids]
+            if windows.feasible(sequence):
+                return [stop - 1 for stop in sequence], []
+        sequence, unplaced = windows.sequence(list(range(1, len(points))))
+        return [stop - 1 for stop in sequence], sorted(stop - 1 for stop in unplaced)
+    
+    @staticmethod
+    def route_fields(orders: List[dict], metrics: dict) -> dict:
+        """Assignment fields for a routed order set.
+        
+        order_ids are in visiting order, legs_km[i] is the leg into stop i
+        and eta_minutes[i] the minutes from leaving the warehouse to
+        reaching it (to starting service, with time windows). reloads are
+        the indices of stops that start a new trip from the warehouse.
+        polyline encodes the warehouse, every stop and the returns to the
+        warehouse between trips.
+        """
+        order_ids = metrics.get('sequence') or [str(order['_id']) for order in orders]
+        legs = metrics.get('legs') or []
+        reloads = metrics.get('reloads') or []
+        if metrics.get('service_start') is not None:
+            etas = [round(begin, 1) for begin in metrics['service_start']]
+        else:
+            etas = []
+            elapsed = 0.0
+            for leg, reload in zip(legs, reload_minutes_before(reloads, len(legs))):
+                elapsed += reload + leg * Config.MINUTES_PER_KM
+                etas.append(round(elapsed, 1))
+        return {
+            'order_ids': order_ids,
+            'legs_km': [round(leg, 3) for leg in legs],
+            'eta_minutes': etas,
+            'reloads': list(reloads),
+            'polyline': encode_polyline(metrics['route']) if metrics.get('route') else ''
         }
     
+    @staticmethod
+    def route_memo_stats() -> dict:
+        return route_memo.stats()
+    
+    @staticmethod
+    def prefilter(warehouse_coords: Tuple[float, float],
+                  delivery_coords: List[Tuple[float, float]],
+                  matrix: np.ndarray = None):
+        """True/False when route bounds settle feasibility, None when routing must decide.
+        
+        matrix is the warehouse-first distance matrix of the set, built here
+        when not given.
+        """
+        total_orders = len(delivery_coords)
+        earning = total_orders * AssignmentUtils.calculate_payment_rate(total_orders)
+        if matrix is None:
+            matrix = LocationUtils.distance_matrix([warehouse_coords] + list(delivery_coords))
+        
+        if get_road_network() is not None:
+            # Routes are measured on the same road matrix
+            return route_bounds.decide(matrix, earning)
+        cache = get_distance_cache()
+        leg_slack = cell_diagonal_km(cache.precision) if cache is not None else 0.0
+        return route_bounds.decide(matrix, earning, HAVERSINE_TOLERANCE, leg_slack)
+    
+    @staticmethod
+    def route_bounds_stats() -> dict:
+        return route_bounds.stats()
+    
     @staticmethod
     def generate_daily_summary(assignment_date: str) -> dict:
         """Generate summary metrics for a given date"""
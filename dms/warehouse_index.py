@@ -0,0 +1,131 @@
+import time
+from typing import Dict, Optional, Tuple
+from spatial_index import GridIndex
+from config import Config
+import logging
+
+logger = logging.getLogger(__name__)
+
+class WarehouseIndex:
+    """Nearest-warehouse lookups over an in-memory grid of all warehouses.
+    
+    The index is loaded from the database on first use and reloaded after
+    WAREHOUSE_INDEX_TTL seconds, or at once after invalidate() (called when
+    a warehouse is created), so lookups never query the database.
+    """
+    
+    # Warehouses are kilometres apart; coarse cells keep nearest() to a few rings
+    CELL_KM = 10.0
+    
+    def __init__(self, ttl: float = None):
+        self.ttl = Config.WAREHOUSE_INDEX_TTL if ttl is None else ttl
+        self._index = None
+        self._warehouses = {}
+        self._loaded_at = 0.0
+    
+    def invalidate(self):
+        self._index = None
+    
+    def refresh(self):
+        from models import Warehouse
+        warehouses = Warehouse.get_all()
+        self._warehouses = {str(warehouse['_id']): warehouse for warehouse in warehouses}
+        self._index = GridIndex.build([
+            (warehouse['latitude'], warehouse['longitude'], warehouse_id)
+            for warehouse_id, warehouse in self._warehouses.items()
+        ], cell_km=self.CELL_KM)
+        self._loaded_at = time.monotonic()
+        logger.info(f"Warehouse index loaded with {len(self._warehouses)} warehouses")
+    
+    def _current(self) -> GridIndex:
+        if self._index is None or time.monotonic() - self._loaded_at > self.ttl:
+            self.refresh()
+        return self._index
+    
+    def __contains__(self, warehouse_id) -> bool:
+        self._current()
+        return str(warehouse_id) in self._warehouses
+    
+    def __len__(self):
+        return len(self._current())
+    
+    def get(self, warehouse_id: str) -> Optional[Dict]:
+        self._current()
+        return self._warehouses.get(str(warehouse_id))
+    
+    def nearest(self, latitude: float, longitude: float) -> Tuple[Optional[str], float]:
+        """(warehouse_id, distance_km) of the closest warehouse, (None, inf) without any"""
+        found = self._current().nearest(latitude, longitude, 1)
+        if not found:
+            return None, float('inf')
+        distance, warehouse_id = found[0]
+        return warehouse_id, distance
+    
+    def distance_to(self, warehouse_id: str, latitude: float, longitude: float) -> float:
+        warehouse = self.get(warehouse_id)
+        return GridIndex.distance_km(latitude, longitude, warehouse['latitude'], warehouse['longitude'])
+    
+    def route(self, latitude: float, longitude: float,
+              warehouse_id: str = None) -> Tuple[Optional[str], Optional[str]]:
+        """Warehouse an order should belong to, or the reason it cannot be placed.
+        
+        Without a warehouse_id the nearest warehouse within
+        WAREHOUSE_SERVICE_RADIUS_KM is chosen. A given warehouse_id must exist;
+        it is kept unless another warehouse is at least REHOME_MIN_GAIN_KM
+        closer, so orders on the boundary between two hubs do not flip back
+        and forth.
+        """
+        if warehouse_id and warehouse_id not in self:
+            return None, f'Unknown warehouse_id {warehouse_id}'
+        
+        nearest_id, distance = self.nearest(latitude, longitude)
+        if nearest_id is None:
+            return None, 'No warehouses to route to'
+        if distance > Config.WAREHOUSE_SERVICE_RADIUS_KM:
+            return None, (f'Nearest warehouse is {distance:.1f}km away, beyond '
+                          f'{Config.WAREHOUSE_SERVICE_RADIUS_KM}km')
+        
+        if warehouse_id and warehouse_id != nearest_id:
+            if self.distance_to(warehouse_id, latitude, longitude) - distance < Config.REHOME_MIN_GAIN_KM:
+                return warehouse_id, None
+        return nearest_id, None
+    
+    def rehome_pending_orders(self) -> Dict:
+        """Move every pending order to its nearest warehouse, where that is clearly closer"""
+        from models import Order
+        
+        started = time.perf_counter()
+        self.refresh()
+        moves = {}
+        saved_km = 0.0
+        scanned = 0
+        for order in Order.iter_pending({'latitude': 1, 'longitude': 1, 'warehouse_id': 1}):
+            scanned += 1
+            current = order.get('warehouse_id')
+            known = current in self
+            # Orders placed at a warehouse that no longer exists go to the nearest one
+            target, _ = self.route(order['latitude'], order['longitude'], current if known else None)
+            if target is None or target == current:
+                # Already at its nearest warehouse, or out of range of every warehouse
+                continue
+            if known:
+                saved_km += (self.distance_to(current, order['latitude'], order['longitude']) -
+                             self.distance_to(target, order['latitude'], order['longitude']))
+            moves.setdefault(target, []).append(str(order['_id']))
+        
+        # One update per target warehouse
+        for target, order_ids in moves.items():
+            Order.rehome(order_ids, target)
+        
+        moved = sum(len(order_ids) for order_ids in moves.values())
+        logger.info(f"Re-homed {moved} of {scanned} pending orders to a nearer warehouse")
+        return {
+            'scanned': scanned,
+            'rehomed': moved,
+            'by_warehouse': {target: len(order_ids) for target, order_ids in moves.items()},
+            'warehouse_km_saved': round(saved_km, 2),
+            'seconds': round(time.perf_counter() - started, 3)
+        }
+
+# Global instance
+warehouse_index = WarehouseIndex()
@@ -0,0 +1,171 @@
+from datetime import date, timedelta
+from typing import List, Dict, Tuple
+from utils import LocationUtils, AssignmentUtils
+from spatial_index import GridIndex
+from deferral_queue import DeferralQueue
+from time_windows import TimeWindows, has_windows
+from trips import vehicle_capacity
+from config import Config
+import routing
+import logging
+
+logger = logging.getLogger(__name__)
+
+def load_previous_routes(agents: List[Dict], warehouses: Dict[str, Dict],
+                         today: date) -> Dict[str, List[Tuple[float, float]]]:
+    """Stops each agent was routed through the day before, in driving order"""
+    from models import Assignment, Order
+    
+    agent_warehouses = {str(agent['_id']): agent['warehouse_id'] for agent in agents}
+    assignments = Assignment.get_by_agents(list(agent_warehouses), today - timedelta(days=1))
+    if not assignments:
+        return {}
+    
+    order_ids = [order_id for assignment in assignments for order_id in assignment['order_ids']]
+    coordinates = {str(order['_id']): (order['latitude'], order['longitude'])
+                   for order in Order.get_by_ids(order_ids)}
+    
+    previous_routes = {}
+    for assignment in assignments:
+        warehouse = warehouses.get(agent_warehouses[assignment['agent_id']])
+        stops = [coordinates[oid] for oid in assignment['order_ids'] if oid in coordinates]
+        if not warehouse or not stops:
+            continue
+        if 'polyline' in assignment:
+            # order_ids are stored in visiting order
+            previous_routes[assignment['agent_id']] = stops
+            continue
+        # Older assignments keep the order set, not the sequence, so re-derive
+        # the route the agent was given from the same optimizer
+        route = LocationUtils.optimize_route((warehouse['latitude'], warehouse['longitude']), stops)
+        previous_routes[assignment['agent_id']] = route[1:]
+    return previous_routes
+
+class WarmStart:
+    """Seeds agents' order sets from the routes they drove the day before.
+    
+    Today's queued orders are matched to the nearest previous stop within
+    WARM_START_MATCH_RADIUS_KM, so each agent keeps their territory. The
+    matched orders keep yesterday's stop order, orders filling the rest of
+    the planned count are inserted where they add the least distance, and
+    the sequence is tidied with 2-opt. Only when the result breaks a daily
+    limit are stops dropped, starting with the one whose detour costs most.
+    """
+    
+    def __init__(self, previous_routes: Dict[str, List[Tuple[float, float]]]):
+        self.previous_routes = previous_routes
+        self._stops = GridIndex.build([
+            (latitude, longitude, (agent_id, position))
+            for agent_id, route in previous_routes.items()
+            for position, (latitude, longitude) in enumerate(route)
+        ])
+    
+    def seed(self, agents: List[Dict], queue: DeferralQueue, warehouse: Dict,
+             targets: Dict[str, int]) -> Dict[str, Tuple[List[Dict], Dict, int]]:
+        """Plan order sets for agents with a previous route.
+        
+        Returns {agent_id: (orders in route order, route metrics, matched count)}
+        and removes the planned orders from the queue. Agents without a
+        previous route, or whose seeded route cannot be made feasible, are
+        left for the regular allocation.
+        """
+        warm_agents = [agent for agent in agents
+                       if str(agent['_id']) in self.previous_routes and targets.get(str(agent['_id']))]
+        if not warm_agents or not queue:
+            return {}
+        
+        queued_orders = queue.ordered()
+        matches = self._match(queued_orders, {str(agent['_id']) for agent in warm_agents})
+        pool = GridIndex.build([(order['latitude'], order['longitude'], order) for order in queued_orders])
+        
+        seeded = {}
+        for agent in warm_agents:
+            agent_id = str(agent['_id'])
+            target_orders = targets[agent_id]
+            
+            # Keep the most overdue matches when the territory has more than planned
+            matched = [(position, order) for position, order in matches.get(agent_id, [])
+                       if str(order['_id']) in queue]
+            matched.sort(key=lambda item: queue.rank(item[1]))
+            matched = sorted(matched[:target_orders], key=lambda item: item[0])
+            matched_orders = [order for _, order in matched]
+            queue.remove(matched_orders)
+            
+            fill_orders = self._nearest_queued(pool, queue, self._centroid(agent_id),
+                                               target_orders - len(matched_orders))
+            queue.remove(fill_orders)
+            
+            orders, metrics = self._build_route(warehouse, matched_orders, fill_orders, vehicle_capacity(agent))
+            used = {str(order['_id']) for order in orders}
+            queue.push([order for order in matched_orders + fill_orders if str(order['_id']) not in used])
+            
+            if orders:
+                matched_count = sum(1 for order in matched_orders if str(order['_id']) in used)
+                seeded[agent_id] = (orders, metrics, matched_count)
+                logger.info(f"Warm start for agent {agent['name']}: {matched_count} orders matched "
+                            f"to yesterday's stops, {len(orders) - matched_count} filled")
+        return seeded
+    
+    def _match(self, orders: List[Dict], agent_ids: set) -> Dict[str, List[Tuple[int, Dict]]]:
+        """Assign each order to the agent whose previous stop is nearest, within the radius"""
+        matches = {}
+        for order in orders:
+            for _, (agent_id, position) in self._stops.within(
+                    order['latitude'], order['longitude'], Config.WARM_START_MATCH_RADIUS_KM):
+                if agent_id in agent_ids:
+                    matches.setdefault(agent_id, []).append((position, order))
+                    break
+        return matches
+    
+    def _centroid(self, agent_id: str) -> Tuple[float, float]:
+        route = self.previous_routes[agent_id]
+        return (sum(lat for lat, _ in route) / len(route), sum(lon for _, lon in route) / len(route))
+    
+    @staticmethod
+    def _nearest_queued(pool: GridIndex, queue: DeferralQueue,
+                        center: Tuple[float, float], count: int) -> List[Dict]:
+        """Up to count still-queued orders closest to center"""
+        if count <= 0 or not queue:
+            return []
+        k = count
+        while True:
+            nearest = pool.nearest(center[0], center[1], k)
+            orders = [order for _, order in nearest if str(order['_id']) in queue]
+            if len(orders) >= count or k >= len(pool):
+                return orders[:count]
+            k *= 2
+    
+    @staticmethod
+    def _build_route(warehouse: Dict, matched_orders: List[Dict], fill_orders: List[Dict],
+                     capacity: int = None) -> Tuple[List[Dict], Dict]:
+        """Sequence seeded orders, repairing the route until it fits the daily limits"""
+        orders = matched_orders + fill_orders
+        if len(orders) < Config.MIN_ORDERS_PER_AGENT:
+            return [], {}
+        
+        points = [(warehouse['latitude'], warehouse['longitude'])] + \
+                 [(order['latitude'], order['longitude']) for order in orders]
+        matrix = LocationUtils.distance_matrix(points)
+        
+        # Matrix index i + 1 is orders[i]; matched orders are already in yesterday's order
+        sequence = list(range(1, len(matched_orders) + 1))
+        if has_windows(orders):
+            # Yesterday's order is kept only if it meets today's windows; orders that fit nowhere are left out
+            windows = TimeWindows.for_orders(matrix, orders)
+            if not windows.feasible(sequence):
+                sequence = []
+            sequence, _ = windows.insert(sequence, [stop for stop in range(1, len(points)) if stop not in sequence])
+            sequence = routing.two_opt(matrix, sequence, feasible=windows.feasible)
+        else:
+            sequence = routing.cheapest_insertion(matrix, sequence, range(len(matched_orders) + 1, len(points)))
+            sequence = routing.two_opt(matrix, sequence)
+        
+        while len(sequence) >= Config.MIN_ORDERS_PER_AGENT:
+            route = [points[0]] + [points[stop] for stop in sequence]
+            route_orders = [orders[stop - 1] for stop in sequence]
+            can_accept, metrics = AssignmentUtils.check_route_constraints(warehouse, route_orders, route, capacity)
+            if can_accept:
+                return route_orders, metrics
+            gains = routing.removal_gains(matrix, sequence)
+            sequence.pop(gains.index(max(gains)))
+        return [], {}